@@ -0,0 +1 @@
+"""Synthetic benchmarks for the presence, coverage category and compile steps"""
\ No newline at end of file
@@ -0,0 +1,37 @@
+# compare two benchmark JSON files from benchmarks/run.py
+# python -m kelp_linear_extent_code.benchmarks.compare bench_results/abc1234_10000x5.json bench_results/def5678_10000x5.json
+import json
+import argparse
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(base, new):
+    """
+    Prints the wall time of every stage in both runs and the speedup (base / new)
+    * **base**, **new**: benchmark records from run.run
+    """
+    if base["params"] != new["params"]:
+        print(f"WARNING: runs have different parameters: {base['params']} vs {new['params']}")
+    if base.get("results_checksum") != new.get("results_checksum"):
+        print("WARNING: results differ between the two runs")
+
+    print(f"{'stage':<22}{base['commit']:>12}{new['commit']:>12}{'speedup':>10}")
+    for stage in dict.fromkeys(list(base["stages"]) + list(new["stages"])):
+        b = base["stages"].get(stage, {}).get("wall_s")
+        n = new["stages"].get(stage, {}).get("wall_s")
+        b_txt = f"{b:.3f}" if b is not None else "-"
+        n_txt = f"{n:.3f}" if n is not None else "-"
+        speedup = f"{b / n:.2f}x" if b and n else "-"
+        print(f"{stage:<22}{b_txt:>12}{n_txt:>12}{speedup:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument("base", help="benchmark JSON of the baseline commit")
+    parser.add_argument("new", help="benchmark JSON of the new commit")
+    args = parser.parse_args()
+    compare(load(args.base), load(args.new))
@@ -0,0 +1,199 @@
+# benchmark the presence / coverage category / compile path on synthetic data
+# python -m kelp_linear_extent_code.benchmarks.run --cells 10000 --years 5
+# Every stage is timed (best of --repeat runs) and the timings are written as JSON to bench_results/, named after the
+# current git commit, so runs from two commits can be compared with benchmarks/compare.py
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import contextlib
+import subprocess
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(PROJECT_ROOT) # this lets the project function library be found as a module
+
+import numpy as np # noqa: E402
+import pandas as pd # noqa: E402
+import shapely # noqa: E402
+import geopandas as gpd # noqa: E402
+import kelp_linear_extent_code.cache as cache # noqa: E402
+import kelp_linear_extent_code.geo_fns as geo_fns # noqa: E402
+import kelp_linear_extent_code.linref as linref # noqa: E402
+import kelp_linear_extent_code.result_io as result_io # noqa: E402
+from kelp_linear_extent_code.benchmarks import synthetic # noqa: E402
+
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "bench_results")
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def time_stage(fn, repeat, verbose, setup=None):
+    """
+    Runs fn repeat times and returns (best wall time in seconds, result of the last run)
+    * **setup**: optional function run (untimed) before each repeat, eg. to clear a cache
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            t0 = time.perf_counter()
+            result = fn()
+            wall = time.perf_counter() - t0
+        best = min(best, wall)
+    return best, result
+
+
+def run(n_cells, n_years, work_dir, repeat=3, seed=0, verbose=False):
+    """
+    Generates the synthetic inputs and times each stage
+    * returns the benchmark record (dict) that is written to JSON
+    """
+    stages = {}
+
+    def record(name, wall, **counts):
+        stages[name] = {"wall_s": round(wall, 4), **counts}
+        print(f"{name:<22}{wall:>10.3f} s  {counts if counts else ''}")
+
+    # inputs ------------------------------------------------------------
+    t0 = time.perf_counter()
+    inputs_dir = os.path.join(work_dir, f"inputs_{n_cells}x{n_years}_{seed}")
+    if not os.path.exists(os.path.join(inputs_dir, "kelp_all.gpkg")):
+        paths = synthetic.generate(inputs_dir, n_cells, n_years, seed)
+    else:
+        years = list(range(2025 - n_years, 2025))
+        paths = {
+            "lines": os.path.join(inputs_dir, "lines.gpkg"),
+            "containers": os.path.join(inputs_dir, "containers.gpkg"),
+            "cov_cat": os.path.join(inputs_dir, "cov_cat.gpkg"),
+            "kelp_all": os.path.join(inputs_dir, "kelp_all.gpkg"),
+            "kelp": {y: os.path.join(inputs_dir, f"kelp_{y}.gpkg") for y in years},
+            "svy": {y: os.path.join(inputs_dir, f"svy_{y}.gpkg") for y in years},
+        }
+    record("generate", time.perf_counter() - t0)
+
+    # point the caches and outputs at the work folder
+    cache.CACHE_DIR = os.path.join(work_dir, "reference_cache")
+    result_io.RESULT_DIR = os.path.join(work_dir, "results")
+    compiled_dir = os.path.join(work_dir, "compiled")
+    reference = [paths["containers"], paths["cov_cat"], paths["lines"]]
+    kelp_fcs = list(paths["kelp"].values())
+    pairs = list(zip(kelp_fcs, paths["svy"].values()))
+    n_kelp = len(gpd.read_file(paths["kelp_all"], columns=[]))
+
+    def clear_cache():
+        shutil.rmtree(cache.CACHE_DIR, ignore_errors=True)
+        cache._trees.clear()
+
+    # reference cache ---------------------------------------------------
+    wall, _ = time_stage(lambda: [cache.build(fc) for fc in reference], repeat, verbose, setup=clear_cache)
+    record("cache_build", wall, n_containers=n_cells, n_cov_cat=n_cells * synthetic.SUBDIVISIONS)
+
+    wall, _ = time_stage(lambda: [cache.load_tree(fc) for fc in reference], repeat, verbose, setup=cache._trees.clear)
+    record("cache_load", wall)
+
+    # presence / coverage category -------------------------------------
+    wall, pres = time_stage(lambda: geo_fns.calc_presence(pairs, paths["containers"], "SYNTH_PRESENCE",
+                                                          variable_survey_area=True), repeat, verbose)
+    record("presence", wall, n_kelp=n_kelp, n_rows=int(sum(len(df) for df in pres)))
+
+    wall, cov = time_stage(lambda: geo_fns.calc_cov_cat(paths["cov_cat"], kelp_fcs), repeat, verbose)
+    record("cov_cat", wall, n_kelp=n_kelp, n_rows=len(cov))
+
+    wall, cov_area = time_stage(lambda: geo_fns.calc_cov_cat(paths["cov_cat"], kelp_fcs, area_weighted=True),
+                                repeat, verbose)
+    record("cov_cat_area", wall, n_kelp=n_kelp, n_rows=len(cov_area))
+
+    wall, res = time_stage(lambda: geo_fns.calc_results(pairs, paths["containers"], paths["cov_cat"], "SYNTH_RESULTS",
+                                                        variable_survey_area=True), repeat, verbose)
+    record("results", wall, n_kelp=n_kelp, n_rows=len(res))
+
+    # linear referenced engine: shoreline measures built once (untimed here, cached like the weights), then the sweep
+    shoreline = linref.load_shoreline(paths["lines"], paths["containers"], paths["cov_cat"])
+    wall, res_lin = time_stage(lambda: geo_fns.calc_results(pairs, paths["containers"], paths["cov_cat"], "SYNTH_RESULTS",
+                                                            variable_survey_area=True, shoreline=shoreline),
+                               repeat, verbose)
+    both = pd.merge(res, res_lin, on=["SITE_CODE", "year"], suffixes=("", "_lin"))
+    record("results_linear", wall, n_kelp=n_kelp, n_rows=len(res_lin),
+           presence_agree=round(float(np.mean(both["presence"] == both["presence_lin"])), 4),
+           cov_cat_agree=round(float(np.mean(both["coverage_cat"].astype(int) == both["coverage_cat_lin"].astype(int))), 4))
+
+    # per year result cache: first run fills it, the timed runs read it
+    def calc_cached():
+        return geo_fns.calc_results(pairs, paths["containers"], paths["cov_cat"], "SYNTH_RESULTS",
+                                    variable_survey_area=True, cache_name="SYNTH_RESULTS")
+    time_stage(calc_cached, 1, verbose)
+    wall, _ = time_stage(calc_cached, repeat, verbose)
+    record("results_cached", wall)
+
+    svy_fcs = {str(y): fc for y, fc in paths["svy"].items()}
+    wall, by_year = time_stage(lambda: geo_fns.calc_by_year(paths["kelp_all"], "year_", paths["containers"],
+                                                            paths["cov_cat"], "SYNTH_BY_YEAR", svy_fcs=svy_fcs),
+                               repeat, verbose)
+    record("by_year", wall, n_kelp=n_kelp, n_rows=len(by_year))
+
+    # compile -----------------------------------------------------------
+    wall, result_files = time_stage(lambda: [result_io.write_results(res, "SYNTH_RESULTS"),
+                                             result_io.write_results(by_year, "SYNTH_BY_YEAR")], repeat, verbose)
+    record("write_results", wall, n_rows=len(res) + len(by_year))
+
+    wall, all_synth = time_stage(lambda: result_io.read_results(result_files), repeat, verbose)
+    record("read_results", wall, n_rows=len(all_synth))
+
+    wall, _ = time_stage(lambda: result_io.combine_results(result_io.read_results(result_files), compiled_dir),
+                         repeat, verbose)
+    record("combine_results", wall, n_rows=len(all_synth))
+
+    # checksum of the results, so a faster commit can be checked for the same answer
+    checksum = hashlib.sha1(pd.util.hash_pandas_object(
+        res.sort_values(["year", "SITE_CODE"]).astype(str), index=False).to_numpy().tobytes()).hexdigest()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "params": {"cells": n_cells, "years": n_years, "repeat": repeat, "seed": seed},
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "shapely": shapely.__version__,
+            "geopandas": gpd.__version__,
+        },
+        "results_checksum": checksum,
+        "stages": stages,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the presence/coverage category/compile path on synthetic data")
+    parser.add_argument("--cells", type=int, default=10000, help="number of shoreline cells (containers)")
+    parser.add_argument("--years", type=int, default=5, help="number of survey years")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best time is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=os.path.join(PROJECT_ROOT, "bench_work"),
+                        help="folder for the synthetic inputs and caches (inputs are reused between runs)")
+    parser.add_argument("--out", help="output JSON file (default bench_results/<commit>_<cells>x<years>.json)")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the tools")
+    args = parser.parse_args()
+
+    print(f"Benchmarking {args.cells} cells x {args.years} years...")
+    bench = run(args.cells, args.years, args.work_dir, args.repeat, args.seed, args.verbose)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{bench['commit']}_{args.cells}x{args.years}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(bench, f, indent=2)
+    print(f"Written to {out}")
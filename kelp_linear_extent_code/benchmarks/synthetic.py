@@ -0,0 +1,180 @@
+# synthetic inputs for the benchmarks
+# Builds a wiggly shoreline and the reference layers that the linearize scripts expect, at any scale:
+#   lines.gpkg         all_lines_clean_v3 style shoreline segments (SITE_CODE, length_m)
+#   containers.gpkg    kelp_containers_v3 style polygons around each segment (SITE_CODE)
+#   cov_cat.gpkg       cov_cat_containers style subdivided containers (SITE_CODE, length_m)
+#   kelp_<year>.gpkg   kelp bed polygons offshore of the shoreline, beds persist between years
+#   svy_<year>.gpkg    survey boundaries, a random set of shoreline stretches for each year
+#   kelp_all.gpkg      all years in one layer with a year_ field (for calc_by_year)
+# result_tables builds linearize result tables (no geometry) for the compile step
+# Only needs numpy/pandas/shapely/geopandas, so it runs anywhere
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+CRS = "EPSG:32610"
+
+# shoreline segment length (m), vertices per segment (= cov cat subdivisions), container width (m)
+CELL_LENGTH = 50.0
+SUBDIVISIONS = 4
+CONTAINER_WIDTH = 100.0
+
+
+def shoreline(n_cells, seed=0):
+    """
+    Returns the (n_cells * SUBDIVISIONS + 1, 2) vertex array of a wiggly shoreline
+    The heading is a smoothed random walk, so the line has bays and headlands at a few scales
+    """
+    rng = np.random.default_rng(seed)
+    n_pts = n_cells * SUBDIVISIONS + 1
+    turns = rng.normal(0, 0.15, n_pts - 1)
+    kernel = np.ones(25) / 25
+    heading = np.cumsum(np.convolve(turns, kernel, mode="same"))
+    step = CELL_LENGTH / SUBDIVISIONS
+    xy = np.zeros((n_pts, 2))
+    xy[1:, 0] = np.cumsum(step * np.cos(heading))
+    xy[1:, 1] = np.cumsum(step * np.sin(heading))
+    return xy + [500000.0, 5200000.0]
+
+
+def site_codes(n_cells):
+    return np.array([f"SYN{i:07d}" for i in range(n_cells)], dtype=object)
+
+
+def reference_layers(xy, n_cells):
+    """
+    Builds the lines, containers and cov cat containers GeoDataFrames from the shoreline vertices
+    """
+    codes = site_codes(n_cells)
+
+    # one linestring per cell, SUBDIVISIONS + 1 vertices each
+    idx = np.arange(n_cells)[:, None] * SUBDIVISIONS + np.arange(SUBDIVISIONS + 1)
+    lines = shapely.linestrings(xy[idx])
+    lines_gdf = gpd.GeoDataFrame({"SITE_CODE": codes, "length_m": shapely.length(lines)}, geometry=lines, crs=CRS)
+
+    containers = shapely.buffer(lines, CONTAINER_WIDTH, cap_style="flat")
+    cont_gdf = gpd.GeoDataFrame({"SITE_CODE": codes}, geometry=containers, crs=CRS)
+
+    # every edge of a cell is one cov cat segment
+    edges = shapely.linestrings(np.stack([xy[:-1], xy[1:]], axis=1))
+    cc = shapely.buffer(edges, CONTAINER_WIDTH, cap_style="flat")
+    cc_gdf = gpd.GeoDataFrame({"SITE_CODE": np.repeat(codes, SUBDIVISIONS), "length_m": shapely.length(edges)},
+                              geometry=cc, crs=CRS)
+
+    return lines_gdf, cont_gdf, cc_gdf
+
+
+def kelp_beds(xy, n_cells, years, bed_fraction=0.15, persistence=0.7, seed=0):
+    """
+    Builds kelp bed polygons for each year
+    Beds sit at fixed spots offshore (a fraction of the cells) and show up in a given year with probability persistence
+    * returns a GeoDataFrame with a year_ field
+    """
+    rng = np.random.default_rng(seed + 1)
+    n_beds = max(1, int(n_cells * bed_fraction))
+    cell = rng.choice(n_cells, n_beds, replace=False)
+    vert = cell * SUBDIVISIONS + rng.integers(0, SUBDIVISIONS, n_beds)
+
+    # offshore normal of the shoreline at each bed
+    d = xy[vert + 1] - xy[vert]
+    normal = np.stack([-d[:, 1], d[:, 0]], axis=1) / np.hypot(d[:, 0], d[:, 1])[:, None]
+    centre = xy[vert] + normal * rng.uniform(10, 70, n_beds)[:, None]
+    radius = rng.uniform(3, 30, n_beds)
+
+    geoms, year_vals = [], []
+    for year in years:
+        present = rng.random(n_beds) < persistence
+        # bed size changes a little from year to year
+        r = radius[present] * rng.uniform(0.6, 1.4, present.sum())
+        geoms.append(shapely.buffer(shapely.points(centre[present]), r, quad_segs=4))
+        year_vals.append(np.full(present.sum(), year, dtype=np.int64))
+
+    return gpd.GeoDataFrame({"year_": np.concatenate(year_vals)}, geometry=np.concatenate(geoms), crs=CRS)
+
+
+def survey_areas(xy, n_cells, years, coverage=0.8, stretch=200, seed=0):
+    """
+    Builds one survey boundary per year: random stretches of shoreline (about stretch cells long) covering
+    roughly the given fraction of the shoreline
+    * returns a dict of {year: GeoDataFrame}
+    """
+    rng = np.random.default_rng(seed + 2)
+    n_stretch = max(1, n_cells // stretch)
+    bounds = np.linspace(0, n_cells, n_stretch + 1).astype(int)
+
+    svy = {}
+    for year in years:
+        keep = np.flatnonzero(rng.random(n_stretch) < coverage)
+        if len(keep) == 0:
+            keep = np.array([0])
+        parts = [shapely.linestrings(xy[bounds[i] * SUBDIVISIONS:bounds[i + 1] * SUBDIVISIONS + 1]) for i in keep]
+        polys = shapely.buffer(np.array(parts, dtype=object), CONTAINER_WIDTH * 1.5, cap_style="flat")
+        svy[year] = gpd.GeoDataFrame({"stretch": keep}, geometry=polys, crs=CRS)
+    return svy
+
+
+def generate(out_dir, n_cells, n_years, seed=0):
+    """
+    Writes a full synthetic input set to out_dir
+    * **out_dir**: folder for the GeoPackages
+    * **n_cells**: number of shoreline cells (containers)
+    * **n_years**: number of survey years
+    * returns a dict of paths: lines, containers, cov_cat, kelp_all and {year: path} dicts kelp and svy
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    years = list(range(2025 - n_years, 2025))
+    xy = shoreline(n_cells, seed)
+
+    paths = {
+        "lines": os.path.join(out_dir, "lines.gpkg"),
+        "containers": os.path.join(out_dir, "containers.gpkg"),
+        "cov_cat": os.path.join(out_dir, "cov_cat.gpkg"),
+        "kelp_all": os.path.join(out_dir, "kelp_all.gpkg"),
+        "kelp": {y: os.path.join(out_dir, f"kelp_{y}.gpkg") for y in years},
+        "svy": {y: os.path.join(out_dir, f"svy_{y}.gpkg") for y in years},
+    }
+
+    lines, cont, cc = reference_layers(xy, n_cells)
+    lines.to_file(paths["lines"])
+    cont.to_file(paths["containers"])
+    cc.to_file(paths["cov_cat"])
+
+    kelp = kelp_beds(xy, n_cells, years, seed=seed)
+    kelp.to_file(paths["kelp_all"])
+    for y in years:
+        kelp[kelp["year_"] == y].to_file(paths["kelp"][y])
+
+    for y, gdf in survey_areas(xy, n_cells, years, seed=seed).items():
+        gdf.to_file(paths["svy"][y])
+
+    return paths
+
+
+def result_tables(n_rows, n_sites, sources, seed=0, na_coverage=0.2):
+    """
+    Linearize result tables (SITE_CODE/year/source/presence/coverage_cat) for the compile step, one per source
+    Sites are shared between sources and years repeat, so most recent selection has ties to resolve
+    * **n_rows**: total number of rows, split evenly between the sources
+    * **n_sites**: number of distinct SITE_CODEs
+    * **sources**: list of source names
+    * **na_coverage**: share of rows with no coverage category (presence-only sources)
+    * returns a dict of {source: dataframe}
+    """
+    rng = np.random.default_rng(seed + 3)
+    codes = site_codes(n_sites)
+    tables = {}
+    for source in sources:
+        n = n_rows // len(sources)
+        presence = rng.integers(0, 2, n)
+        cov_cat = rng.integers(0, 5, n).astype(float)
+        cov_cat[rng.random(n) < na_coverage] = np.nan
+        tables[source] = pd.DataFrame({
+            "SITE_CODE": codes[rng.integers(0, n_sites, n)],
+            "year": rng.integers(1990, 2026, n),
+            "source": source,
+            "presence": presence,
+            "coverage_cat": cov_cat,
+        })
+    return tables
@@ -0,0 +1,385 @@
+# reference layer cache
+# kelp_containers_v3, cov_cat_containers and all_lines_clean_v3 are read from LinearExtent.gdb once and stored in
+# reference_cache/ as GeoParquet (WKB geometry) + numpy bounds arrays. Later runs load those instead of the gdb.
+# The cache is keyed on the gdb modification time and the layer schema, so edits to the lines/containers rebuild it.
+# Per (source, year) presence/coverage results are kept in reference_cache/years/, keyed on a hash of that year's kelp
+# and survey boundary geometry, so living sources only recompute new or edited years.
+# Files are written to a temp file and swapped in with os.replace. Derived tables and year results have their key in the
+# file name, so older versions are never deleted while a worker may be reading them: refresh() (run by pipeline.py
+# before any worker starts) prunes them.
+# Run this script directly to (re)build the cache for all reference layers.
+# geopandas is imported where layers are read, so the cache keys and per year results need only pandas/numpy/shapely.
+import os
+import re
+import glob
+import json
+import hashlib
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import shapely
+from kelp_linear_extent_code import instrument
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# folder for the cached layers and derived reference tables, in the project root next to scratch.gdb
+CACHE_DIR = os.path.join(PROJECT_ROOT, "reference_cache")
+
+LINES_AND_CONTAINERS = os.path.join(PROJECT_ROOT, "LinearExtent.gdb", "lines_and_containers")
+REFERENCE_LAYERS = [
+    os.path.join(LINES_AND_CONTAINERS, "kelp_containers_v3"),
+    os.path.join(LINES_AND_CONTAINERS, "cov_cat_containers"),
+    os.path.join(LINES_AND_CONTAINERS, "all_lines_clean_v3"),
+]
+
+# trees built in this process, so every tool call after the first reuses them
+_trees = {}
+
+# source keys worked out in this process, by (data source, layer, modification time)
+_source_keys = {}
+
+# paths and reading ---------------------------------------------------------------------------------------
+def split_fc_path(fc):
+    """
+    Splits an arcpy style feature class path into the (data source, layer) pair that GDAL expects
+    * **fc**: path to a feature class in a file gdb (feature datasets are fine) or to a shapefile
+    * returns (path to .gdb, feature class name) for gdb feature classes and (path, None) for everything else
+    """
+    parts = re.split(r"[\\/]+", str(fc))
+    for i, part in enumerate(parts):
+        if part.lower().endswith(".gdb") and i < len(parts) - 1:
+            return os.sep.join(parts[:i + 1]), parts[-1]
+    return str(fc), None
+
+
+def fc_name(fc):
+    """
+    Returns the name of a feature class (or shapefile without extension), same as arcpy.Describe(fc).name for gdb fcs
+    """
+    ds, layer = split_fc_path(fc)
+    if layer is not None:
+        return layer
+    return os.path.splitext(os.path.basename(ds))[0]
+
+
+def read_fc(fc, columns=None, where=None, geometry=True):
+    """
+    Reads a feature class or shapefile to a GeoDataFrame, bypassing the cache
+    * **fc**: path to the feature class, arcpy style paths are accepted
+    * **columns**: optional list of fields to read, the others are never loaded
+    * **where**: optional SQL where clause, applied by GDAL while reading
+    * **geometry**: False skips the geometry and returns a plain pandas dataframe
+    """
+    import geopandas as gpd
+    ds, layer = split_fc_path(fc)
+    kwargs = {}
+    if columns is not None:
+        kwargs["columns"] = list(columns)
+    if where is not None:
+        kwargs["where"] = where
+    if not geometry:
+        return pd.DataFrame(gpd.read_file(ds, layer=layer, ignore_geometry=True, **kwargs))
+    return gpd.read_file(ds, layer=layer, **kwargs)
+
+
+def read_table(tbl, columns=None, where=None):
+    """
+    Reads a gdb table (or the attributes of a feature class) to a pandas dataframe, without geometry or arcpy
+    * **tbl**: path to the table, arcpy style paths are accepted
+    * **columns**, **where**: see read_fc
+    """
+    return read_fc(tbl, columns, where, geometry=False)
+
+
+# cache keys ----------------------------------------------------------------------------------------------
+def source_mtime(fc):
+    """
+    Latest modification time of the data source. A file gdb is a folder, so this checks every file inside it except the
+    *.lock files ArcGIS creates and deletes whenever it opens the gdb (same as pipeline.fingerprint). The folder's own
+    time is left out too, it changes with every lock file
+    """
+    ds, _ = split_fc_path(fc)
+    if os.path.isdir(ds):
+        return max([os.path.getmtime(f) for f in glob.glob(os.path.join(ds, "*")) if not f.endswith(".lock")],
+                   default=0.0)
+    return os.path.getmtime(ds)
+
+
+def schema_hash(fc):
+    """
+    Hash of the field names/types, geometry type and crs of a layer (read from the layer header only)
+    """
+    ds, layer = split_fc_path(fc)
+    try:
+        import pyogrio
+        info = pyogrio.read_info(ds, layer=layer)
+        schema = [list(info["fields"]), [str(d) for d in info["dtypes"]], info["geometry_type"], info["crs"]]
+    except ImportError:
+        import fiona
+        with fiona.open(ds, layer=layer) as src:
+            schema = [src.schema, src.crs.to_string()]
+    return hashlib.sha1(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def source_key(fc):
+    """
+    Cache key for a layer: data source modification time + schema hash
+    The schema is only read again when the modification time changes (any schema edit changes it too), so checking a
+    layer that is already loaded costs a stat of its files
+    """
+    ds, layer = split_fc_path(fc)
+    mtime = source_mtime(fc)
+    if (ds, layer, mtime) not in _source_keys:
+        key = f"{ds}|{layer}|{mtime}|{schema_hash(fc)}"
+        _source_keys[(ds, layer, mtime)] = hashlib.sha1(key.encode()).hexdigest()
+    return _source_keys[(ds, layer, mtime)]
+
+
+def _cache_paths(fc):
+    base = os.path.join(CACHE_DIR, fc_name(fc))
+    return {
+        "layer": f"{base}.parquet",
+        "bounds": f"{base}_bounds.npy",
+        "key": f"{base}.json",
+    }
+
+
+def is_cached(fc):
+    """
+    True if reference_cache/ holds an up to date copy of the layer
+    """
+    paths = _cache_paths(fc)
+    if not all(os.path.exists(p) for p in paths.values()):
+        return False
+    with open(paths["key"]) as f:
+        stored = json.load(f)
+    return stored["key"] == source_key(fc)
+
+
+def _atomic_write(path, write_fn, keyed=False):
+    # write to a unique temp file and swap it in, so parallel pipeline workers never read a half written file.
+    # keyed: the file name holds the key of its content, so if another process has the file open (Windows can't replace
+    # it then) the copy that is already there is just as good
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        write_fn(tmp)
+        os.replace(tmp, path)
+    except PermissionError:
+        if not (keyed and os.path.exists(path)):
+            raise
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# build and load ------------------------------------------------------------------------------------------
+@instrument.stage("cache_build")
+def build(fc):
+    """
+    Reads a layer from its source and writes it to the cache (GeoParquet + bounds array + key file)
+    """
+    paths = _cache_paths(fc)
+    print(f"Caching {fc}...")
+    gdf = read_fc(fc)
+    instrument.count(layer=fc_name(fc), n_out=len(gdf))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    bounds = shapely.bounds(np.asarray(gdf.geometry.values, dtype=object))
+    key = {"source": str(fc), "key": source_key(fc), "n_features": len(gdf)}
+
+    def write_bounds(p):
+        with open(p, "wb") as f:
+            np.save(f, bounds)
+
+    def write_key(p):
+        with open(p, "w") as f:
+            json.dump(key, f, indent=2)
+
+    _atomic_write(paths["layer"], lambda p: gdf.to_parquet(p, index=False))
+    _atomic_write(paths["bounds"], write_bounds)
+    # key file last, so the cache only counts as valid once the layer and bounds are in place
+    _atomic_write(paths["key"], write_key)
+
+    print(f"Cached {len(gdf)} features to {paths['layer']}")
+    return gdf
+
+
+def load_layer(fc):
+    """
+    Returns a reference layer as a GeoDataFrame, from reference_cache/ if it is up to date, otherwise from the source
+    (and the cache is refreshed). Row order is the same as the source layer.
+    * **fc**: path to the feature class
+    """
+    if not is_cached(fc):
+        return build(fc)
+    import geopandas as gpd
+    path = _cache_paths(fc)["layer"]
+    print(f"Loading {fc_name(fc)} from cache: {path}")
+    return gpd.read_parquet(path, memory_map=True)
+
+
+def load_columns(fc, columns):
+    """
+    Returns just the given attribute columns of a reference layer as a pandas dataframe, from the cached parquet file
+    (geometry and the other columns are never read)
+    """
+    if not is_cached(fc):
+        build(fc)
+    return pd.read_parquet(_cache_paths(fc)["layer"], columns=list(columns))
+
+
+def load_bounds(fc):
+    """
+    Returns the (n, 4) xmin/ymin/xmax/ymax array of a cached layer, memory mapped
+    """
+    if not is_cached(fc):
+        build(fc)
+    return np.load(_cache_paths(fc)["bounds"], mmap_mode="r")
+
+
+def load_tree(fc):
+    """
+    Returns (GeoDataFrame, STRtree) for a reference layer. The tree is bulk loaded from the cached geometries and
+    kept for the rest of the process, so repeated calls are free.
+    The tree itself is not stored: shapely has no on-disk STRtree (pickling one rebuilds it from its geometries), so the
+    cache keeps what it is built from and pipeline.py builds it once per worker process (see runner.init_process)
+    """
+    key = (str(fc), source_key(fc))
+    if key not in _trees:
+        gdf = load_layer(fc)
+        _trees[key] = (gdf, shapely.STRtree(np.asarray(gdf.geometry.values, dtype=object)))
+    return _trees[key]
+
+
+def derived_key(fc, depends=()):
+    """
+    Cache key for a derived table: the key of its layer, combined with the keys of any other layers it is built from
+    """
+    if not depends:
+        return source_key(fc)
+    key = "|".join(source_key(f) for f in [fc, *depends])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def load_derived(fc, name, build_fn, depends=()):
+    """
+    Returns a table derived from a reference layer (eg. coverage category weights), stored in the cache next to the layer
+    and rebuilt whenever the layer changes
+    * **fc**: path to the source feature class
+    * **name**: short name for the table, used in the file name
+    * **build_fn**: function that takes the layer GeoDataFrame and returns a pandas dataframe
+    * **depends**: other layers build_fn reads, the table is also rebuilt when one of them changes
+    """
+    key = derived_key(fc, depends)
+    path = os.path.join(CACHE_DIR, f"{fc_name(fc)}_{name}_{key[:12]}.parquet")
+    if os.path.exists(path):
+        print(f"Using stored {name} table: {path}")
+        return pd.read_parquet(path)
+
+    print(f"Calculating {name} table for {fc_name(fc)}...")
+    df = build_fn(load_layer(fc))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _atomic_write(path, lambda p: df.to_parquet(p, index=False), keyed=True)
+    print(f"Written to {path}")
+    return df
+
+
+# per year results ----------------------------------------------------------------------------------------
+def year_key(*parts):
+    """
+    Hash for one year of results. Geometry arrays are hashed by WKB, independent of feature order;
+    anything else (reference layer keys, tool settings) by its string
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray) and part.dtype == object:
+            part = part[~shapely.is_missing(part)]
+            for wkb in sorted(shapely.to_wkb(part)):
+                h.update(wkb)
+        else:
+            h.update(str(part).encode())
+        h.update(b"|")
+    return h.hexdigest()
+
+
+def _year_path(source, kind, name, key):
+    return os.path.join(CACHE_DIR, "years", source, f"{kind}_{name}_{key[:16]}.parquet")
+
+
+def load_year_result(source, kind, name, key):
+    """
+    Returns a stored per year result dataframe, or None if there is none for this key
+    * **source**: data source name (dataset_name in the linearize scripts)
+    * **kind**: "presence" or "cov_cat"
+    * **name**: fc name the result was calculated for (year is the last 4 characters)
+    * **key**: hash from year_key
+    """
+    path = _year_path(source, kind, name, key)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    return None
+
+
+def store_year_result(source, kind, name, key, df):
+    """
+    Stores a per year result dataframe. Older results for the same source/kind/name are left for prune()
+    """
+    path = _year_path(source, kind, name, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _atomic_write(path, lambda p: df.to_parquet(p, index=False), keyed=True)
+
+
+# stale files ---------------------------------------------------------------------------------------------
+# key suffix of the derived table (12 characters) and year result (16 characters) file names
+_KEYED = re.compile(r"^(.+)_[0-9a-f]{12}(?:[0-9a-f]{4})?\.parquet$")
+
+# temp files older than this (seconds) are left over from a crashed write
+TMP_MAX_AGE = 3600
+
+
+def prune():
+    """
+    Deletes superseded derived tables and year results (all but the newest file of each table/source/kind/name) and
+    temp files left by crashed writes. Only safe while no other process uses the cache, see refresh
+    """
+    files = glob.glob(os.path.join(CACHE_DIR, "*.parquet")) + glob.glob(os.path.join(CACHE_DIR, "years", "*", "*.parquet"))
+    newest = {}
+    for f in files:
+        m = _KEYED.match(os.path.basename(f))
+        if m is None:
+            continue
+        group = os.path.join(os.path.dirname(f), m.group(1))
+        newest.setdefault(group, []).append(f)
+
+    n_removed = 0
+    for versions in newest.values():
+        for f in sorted(versions, key=os.path.getmtime)[:-1]:
+            os.remove(f)
+            n_removed += 1
+
+    now = time.time()
+    for f in glob.glob(os.path.join(CACHE_DIR, "*.tmp")) + glob.glob(os.path.join(CACHE_DIR, "years", "*", "*.tmp")):
+        if now - os.path.getmtime(f) > TMP_MAX_AGE:
+            os.remove(f)
+            n_removed += 1
+    if n_removed:
+        print(f"Removed {n_removed} stale files from {CACHE_DIR}")
+
+
+def refresh():
+    """
+    Rebuilds the cache of every reference layer that changed since it was cached, and prunes stale derived tables and
+    year results (pipeline.py runs this before starting any worker)
+    """
+    prune()
+    for fc in REFERENCE_LAYERS:
+        if is_cached(fc):
+            print(f"{fc_name(fc)} cache is up to date")
+        else:
+            build(fc)
+
+
+if __name__ == "__main__":
+    refresh()
@@ -1,7 +1,13 @@
 # Combine linear extent data synthesis results and join to lines
+# The line geometry is read once and shared by both outputs. all_records is written as a geometry-once layout:
+# the lines fc (SITE_CODE + geometry) with a related all_records_tbl table (one row per site/year/source) and a
+# relationship class on SITE_CODE. Run with --flat-all-records to also write the flattened all_records fc
+# (one copy of the line per record)
 
 # set environment -----------------------------------------------------------------------
 
+import sys
+import argparse
 import arcpy
 import pandas as pd
 from pathlib import Path
@@ -9,18 +15,20 @@ import os
 from arcgis import GeoSeriesAccessor, GeoAccessor # noqa: F401
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT) # this lets the project function library be found as a module
+
+import kelp_linear_extent_code.result_io as result_io # noqa: E402 # result table schema
+import kelp_linear_extent_code.instrument as instrument # noqa: E402 # run log, see instrument.py
+import kelp_linear_extent_code.runner as runner # noqa: E402 # source context, see runner.py
 
 arcpy.env.overwriteOutput = True
 
 # load data -------------------------------------------------------------------------------
 
 # INPUTS
-# Kelp data summarize within results tables
+# Kelp data summarize within results tables (<dataset_name>_result.parquet, see result_io.py)
 synth_folder = Path(PROJECT_ROOT) / "kelp_data_linear_outputs"
 
-# linear extent fc
-lines = os.path.join(PROJECT_ROOT, "LinearExtent.gdb//lines_and_containers//all_lines_clean_v3")
-
 # metadata
 most_rec_meta = os.path.join(PROJECT_ROOT, "kelp_reference//linear_extent_most_recent_v2.xml")
 all_records_meta = os.path.join(PROJECT_ROOT, "kelp_reference//linear_extent_all_records.xml")
@@ -29,180 +37,115 @@ all_records_meta = os.path.join(PROJECT_ROOT, "kelp_reference//linear_extent_all
 OUT_PATH = os.path.join(PROJECT_ROOT, "kelp_data_compiled")
 OUT_GDB = "kelp_data_compiled.gdb"
 most_rec_fc = os.path.join(OUT_PATH, OUT_GDB, "most_recent")
+lines_fc = os.path.join(OUT_PATH, OUT_GDB, "lines")
+all_records_tbl = os.path.join(OUT_PATH, OUT_GDB, "all_records_tbl")
+all_records_rel = os.path.join(OUT_PATH, OUT_GDB, "lines_all_records")
 all_records_fc = os.path.join(OUT_PATH, OUT_GDB, "all_records")
 
-# create output gdb if needed
-if not arcpy.Exists(os.path.join(OUT_PATH, OUT_GDB)):
-    print("Creating output gdb")
-    arcpy.management.CreateFileGDB(OUT_PATH, OUT_GDB)
-else:
-    print("Out gbd exists. Outputs may overwrite existing fcs.")
-
-tbls = list(synth_folder.glob("*.csv"))
-print("Synth results tables available:")
-for t in tbls:
-    print(t)
-
-print(f"Using {lines} as line segment feature class")
-
 # define functions -----------------------------------------------------------------------
 
 def reset_ws():
     arcpy.env.workspace = os.getcwd()
 
 
-def csv_to_pd(tbls):
+@instrument.stage("read_synth")
+def read_synth(tbls):
     """
-    convert linearized output csvs to a list of pd dataframes
+    read all linearized output tables to one pd dataframe in a single dataset scan
+    the tables share one schema, so no type clean up is needed
     """
     pd.set_option("display.max_columns", 7)
 
-    dfs = []
-
-    for t in tbls:
-        df = pd.read_csv(t)
-        print(f"{t} converted to dataframe:")
-        print(df.head())
-        print(df.dtypes)
-        print(f"Total records: {len(df)}")
-        dfs.append(df)
+    all_synth = result_io.read_results(tbls)
+    print(all_synth.groupby("source", observed=True).size().rename("records"))
+    print(all_synth.dtypes)
+    print(f"Total records: {len(all_synth)}")
 
-    return dfs
+    return all_synth
 
 
-def combine_results(synth_dfs, OUT_PATH):
+@instrument.stage("load_lines")
+def load_lines(lines):
     """
-    combine list of pd dfs into most recent and all records .csvs  
-    in folder specified with OUT_PATH
+    load the line features once, with just SITE_CODE and geometry
     """
-    pd.set_option("display.max_rows", 7)
-    #### Bind rows ####
-    all_synth = pd.concat(synth_dfs)
-    print("Joined results df: ")
-    print(all_synth.head(5))
-
-    # handle instances where presence and coverage_cat disagree
-    # if presence == 0 and coverage_cat > 0, make coverage_cat 0
-    # if presence == 1 and coverage_cat == 0, make coverage_cat 1
-    all_synth["coverage_cat"] = all_synth.apply(
-        lambda row: 0
-        if row["presence"] == 0 and (pd.isna(row["coverage_cat"]) or row["coverage_cat"] > 0)
-        else 1
-        if row["presence"] == 1 and (row["coverage_cat"] == 0)
-        else row["coverage_cat"],
-        axis=1,
-    )
+    print(f"Loading {lines}...")
+    sdf = pd.DataFrame.spatial.from_featureclass(lines, fields=["SITE_CODE"])
+    instrument.count(n_out=len(sdf))
+    print(f"{len(sdf)} line features")
+    return sdf
 
-    # drop extra column
-    all_synth = all_synth.drop(["Unnamed: 0"], axis=1)
 
-    # drop rows where source is null
-    all_synth = all_synth.dropna(subset=["source"], axis=0)
-
-    # rename abundance
-    all_synth.rename(columns={"coverage_cat": "coverage_category"}, inplace=True)
-
-    # add the source_url field
-    print("Adding the source_urls in from the file source_urls.csv")
-    source_url = pd.read_csv(os.path.join(PROJECT_ROOT, "kelp_reference", "source_urls.csv"))
-    all_synth = all_synth.merge(
-        source_url[["source", "source_url"]], on="source", how="left"
-    )
-
-    # save this as the 'all_records" table.
-    os.makedirs(OUT_PATH, exist_ok=True)
-    all_synth.to_csv(os.path.join(OUT_PATH, "all_records.csv"))
-    print("Compiled all results and written to csv: all_records.csv")
-    print(f"Total records: {len(all_synth)}")
-
-    #### Select most recent year for each site_code ####
-    # identify non-numeric or NA rows
-    non_numeric_years = all_synth[
-        all_synth["year"].isna() | ~all_synth["year"].astype(str).str.isdigit()
-    ]
-
-    # print them
-    print(non_numeric_years)
-
-    # find most recent year for each SITE_CODE
-    most_recent_year = all_synth.groupby("SITE_CODE")["year"].transform("max")
-
-    # grab those rows
-    most_recent = all_synth[all_synth["year"] == most_recent_year]
-
-    # check if site_code is unique
-    if not most_recent["SITE_CODE"].is_unique:
-        dupes = most_recent[
-        most_recent.duplicated("SITE_CODE", keep=False)
-        ].sort_values("SITE_CODE")
-        print(f"{len(dupes)} sites have more than 1 record for the most recent year:")
-        print(dupes)
-        print("Selecting source with maximum coverage...")
-    else:
-        print("All sites have unique records for most recent year")
-
-    # count number of records for most recent year
-    most_recent.loc[:, "n_records_most_rec"] = most_recent.groupby("SITE_CODE")[
-        "SITE_CODE"
-    ].transform("count")
-
-    # for years with multiple records, select row with max proportional_presence
-    most_recent["coverage_category"].fillna(
-        -9999, inplace=True
-    )  # replace NULL values with -9999 so the below code works
-    most_rec_max = most_recent[
-        most_recent["coverage_category"]
-        == most_recent.groupby("SITE_CODE")["coverage_category"].transform("max")
-    ]
-
-    # Set index to site_code
-    most_rec_max = most_rec_max.set_index("SITE_CODE")
-
-    print("Preview of most recent year table:")
-    print(most_rec_max.head(5))
-
-    # write to a csv
-    most_rec_max.to_csv(os.path.join(OUT_PATH, "most_recent.csv"))
-    print("Written to csv: most_recent.csv")
+def read_results(tbl):
+    """
+    load a compiled csv without the index columns written by to_csv
+    """
+    tbl_df = pd.read_csv(tbl)
+    tbl_df = tbl_df.drop(columns=[c for c in tbl_df.columns if c.startswith("Unnamed")])
+    print(f"{len(tbl_df)} records in {tbl}")
+    return tbl_df
 
 
-def join_results_to_lines(tbl, lines, out_lines):
+@instrument.stage("join_results_to_lines")
+def join_results_to_lines(tbl, lines_sdf, out_lines):
     """
     join compiled csvs to line features 
+    * **tbl**: compiled csv
+    * **lines_sdf**: line features from load_lines
+    * **out_lines**: output fc, one copy of the line for every record
     """
     #### Join to line segments fc ####
-    # note to self: need to delete the extra fields length_m and SITE_CODE_1 from the outputs
-    # also: could use fieldmapping to set the field types more appropriately here
-
-    print(f"Converting {tbl} and lines to pd dataframes...")
-    # convert lines to a sdf
-    sdf = pd.DataFrame.spatial.from_featureclass(lines)
-
-    # load tbl to dataframe
-    tbl_df = pd.read_csv(tbl)
-    print(f"{len(tbl_df)} records in table")
+    # only SITE_CODE is loaded from the lines, so there are no extra fields to delete afterwards
+    tbl_df = read_results(tbl)
 
     # join one-to-many
     print("Merging...")
-    joined = pd.merge(sdf, tbl_df, how="outer", on="SITE_CODE")
+    joined = pd.merge(lines_sdf, tbl_df, how="outer", on="SITE_CODE")
+    instrument.count(n_in=len(tbl_df), n_out=len(joined))
     print(f"Resulting table has {len(joined)} records")
     print(joined.head())
 
     # write to feature class
     print("Writing to feature class...")
-    joined.spatial.to_featureclass(location=out_lines, overwrite=True)
+    joined.spatial.to_featureclass(location=out_lines, overwrite=True, sanitize_columns=False)
     print(f"Feature class created: {out_lines}")
 
-    # Write csv to gdb table
-    print("Writing to table...")
 
-    # tidy output feature class
-    print("Removing unnecessary fields...")
-    arcpy.management.DeleteField(
-        out_lines, ["length_m", "unnamed_01", "unnamed_0", "sum_Area_Hectares", "sum_Length_METERS"]
+@instrument.stage("relate_results_to_lines")
+def relate_results_to_lines(tbl, lines_sdf, out_lines, out_table, out_rel):
+    """
+    write compiled csv as a table related to the line features, so each line geometry is stored once
+    * **tbl**: compiled csv
+    * **lines_sdf**: line features from load_lines
+    * **out_lines**: output fc with SITE_CODE and geometry
+    * **out_table**: output table with the records
+    * **out_rel**: output relationship class, one line to many records on SITE_CODE
+    """
+    print("Writing lines...")
+    lines_sdf.spatial.to_featureclass(location=out_lines, overwrite=True, sanitize_columns=False)
+    print(f"Feature class created: {out_lines}")
+
+    # text columns need a fixed width for the numpy table conversion
+    tbl_df = read_results(tbl)
+    print("Writing to table...")
+    column_dtypes = {}
+    for col in tbl_df.columns:
+        if tbl_df[col].dtype == object:
+            tbl_df[col] = tbl_df[col].fillna("").astype(str)
+            column_dtypes[col] = f"<U{max(tbl_df[col].str.len().max(), 1)}"
+    if arcpy.Exists(out_table):
+        arcpy.management.Delete(out_table)
+    arcpy.da.NumPyArrayToTable(tbl_df.to_records(index=False, column_dtypes=column_dtypes), out_table)
+    print(f"Table created: {out_table}")
+
+    print("Creating relationship class...")
+    arcpy.management.CreateRelationshipClass(
+        out_lines, out_table, out_rel, "SIMPLE", "records", "line", "NONE", "ONE_TO_MANY", "NONE",
+        "SITE_CODE", "SITE_CODE"
     )
-    arcpy.management.AlterField(out_lines, "site_code", "SITE_CODE", "SITE_CODE")
+    print(f"Relationship class created: {out_rel}")
 
+@instrument.stage("apply_metadata")
 def apply_metadata(feature_class, metadata_file_path):
     # Create a metadata object for the feature class
     metadata_object = arcpy.metadata.Metadata(feature_class)
@@ -217,27 +160,69 @@ def apply_metadata(feature_class, metadata_file_path):
         f"Metadata from file {metadata_file_path} has been successfully applied to {feature_class}."
     )
 
-# create most recent  ------------------------------------------------------------------
-reset_ws()
 
-synth_dfs = csv_to_pd(tbls)
+def run(context, flat_all_records=False):
+    """
+    compile the linearized results and write the most recent and all records outputs
+    * **context**: runner.Context, the lines come from context.lines
+    * **flat_all_records**: also write the flattened all_records fc
+    """
+    # linear extent fc
+    lines = context.lines
+
+    # create output gdb if needed
+    if not arcpy.Exists(os.path.join(OUT_PATH, OUT_GDB)):
+        print("Creating output gdb")
+        arcpy.management.CreateFileGDB(OUT_PATH, OUT_GDB)
+    else:
+        print("Out gbd exists. Outputs may overwrite existing fcs.")
+
+    tbls = sorted(synth_folder.glob("*_result.parquet"))
+    print("Synth results tables available:")
+    for t in tbls:
+        print(t)
+
+    # create most recent  ------------------------------------------------------------------
+    reset_ws()
+
+    all_synth = read_synth(tbls)
+
+    result_io.combine_results(all_synth, OUT_PATH)
+
+    print(f"Using {lines} as line segment feature class")
+    lines_sdf = load_lines(lines)
+
+    join_results_to_lines(tbl=os.path.join(OUT_PATH, "most_recent.csv"), 
+                          lines_sdf=lines_sdf, 
+                          out_lines=most_rec_fc)
+
+    # create the all records dataset ----------------------------------------------------
 
-combine_results(synth_dfs, OUT_PATH)
+    relate_results_to_lines(tbl=os.path.join(OUT_PATH, "all_records.csv"),
+                            lines_sdf=lines_sdf,
+                            out_lines=lines_fc,
+                            out_table=all_records_tbl,
+                            out_rel=all_records_rel)
 
-join_results_to_lines(tbl=os.path.join(OUT_PATH, "most_recent.csv"), 
-                      lines=lines, 
-                      out_lines=most_rec_fc)
+    if flat_all_records:
+        join_results_to_lines(tbl=os.path.join(OUT_PATH, "all_records.csv"),
+                              lines_sdf=lines_sdf,
+                              out_lines=all_records_fc)
 
-# create the all records dataset ----------------------------------------------------
+    # Append metadata ----------------------------------------------------------------------
 
-join_results_to_lines(tbl=os.path.join(OUT_PATH, "all_records.csv"),
-                      lines=lines,
-                      out_lines=all_records_fc)
+    apply_metadata(most_rec_fc, most_rec_meta)
+    apply_metadata(all_records_tbl, all_records_meta)
+    if flat_all_records:
+        apply_metadata(all_records_fc, all_records_meta)
 
-# Append metadata ----------------------------------------------------------------------
+    # that's it -------------------------------------------------------------------------------
+    print("Fin.")
 
-apply_metadata(most_rec_fc, most_rec_meta)
-apply_metadata(all_records_fc, all_records_meta)
 
-# that's it -------------------------------------------------------------------------------
-print("Fin.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combine linearized results and join them to the lines")
+    parser.add_argument("--flat-all-records", action="store_true",
+                        help="also write all_records as a flat fc with one line per record")
+    args = parser.parse_args()
+    run(runner.Context("compile_linear_data"), flat_all_records=args.flat_all_records)
@@ -1,34 +1,63 @@
 
 # function library
+# arcpy and arcgis are imported on first use of an arcpy-backed function (see _arcpy), so the shapely/tabular tools
+# re-exported here (calc_results, calc_by_year, calc_lines, calc_raster, write_results) import with pandas/numpy/shapely only and run without ArcGIS
 import os
-import arcpy
+import hashlib
+import functools
 import pandas as pd
 import numpy as np
-from arcgis.features import GeoAccessor, GeoSeriesAccessor # noqa: F401
+from kelp_linear_extent_code import cache
+from kelp_linear_extent_code import geo_fns
+from kelp_linear_extent_code import raster_fns
+from kelp_linear_extent_code import result_io
+from kelp_linear_extent_code import instrument
 
-arcpy.env.overwriteOutput = True
+# default scratch gdb is in the project root
+# pipeline.py runs sources in parallel and gives each one its own gdb with the KELP_SCRATCH_WS environment variable
+DEFAULT_SCRATCH_WS = os.environ.get("KELP_SCRATCH_WS", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scratch.gdb"))
 
 # utilities ---------------------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=None)
+def _arcpy():
+    """
+    Imports arcpy the first time an arcpy-backed function runs, along with the arcgis GeoAccessor that adds the
+    .spatial accessor to dataframes, and sets overwriteOutput once
+    """
+    with instrument.stage("import_arcpy"):
+        import arcpy
+        from arcgis.features import GeoAccessor, GeoSeriesAccessor # noqa: F401
+    arcpy.env.overwriteOutput = True
+    return arcpy
+
 # store parent folder workspace in function 
 def reset_ws(PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))): 
     """
     Resets the arcpy workspace to the project root folder
     By default, the root folder is the the folder that contains the kelp_linear_extent package (three folders up from current script)
     """
+    arcpy = _arcpy()
     arcpy.env.workspace = PROJECT_ROOT
 
 # configure a scratch workspace
-def config_scratch(PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))):
+@instrument.stage("config_scratch")
+def config_scratch(PROJECT_ROOT = None):
     """
     Creates a scratch.gdb or clears scratch.gdb if it already exists.
     Scratch ws will be in project root by default. is the folder containing the kelp_linear_extent package.
+    If KELP_SCRATCH_WS is set (pipeline.py does this for parallel runs), that gdb is used instead.
     Optionally specify a different parent folder for scratch.gdb using PROJECT_ROOT = "".
     Returns the scratch workspace as a file path, to be used as a variable elsewhere in the script. 
     """
-    SCRATCH_WS = os.path.join(PROJECT_ROOT, "scratch.gdb")
+    arcpy = _arcpy()
+    if PROJECT_ROOT is None:
+        SCRATCH_WS = DEFAULT_SCRATCH_WS
+    else:
+        SCRATCH_WS = os.path.join(PROJECT_ROOT, "scratch.gdb")
     print("Configuring scratch workspace...")
     if not arcpy.Exists(SCRATCH_WS):
-        arcpy.management.CreateFileGDB(PROJECT_ROOT, "scratch.gdb")
+        os.makedirs(os.path.dirname(SCRATCH_WS), exist_ok=True)
+        arcpy.management.CreateFileGDB(os.path.dirname(SCRATCH_WS), os.path.basename(SCRATCH_WS))
         print(f"Created new gdb at {SCRATCH_WS}")
     else:
         print(f"Scratch workspace already exists at {SCRATCH_WS}. Clearing files... ")
@@ -37,10 +66,11 @@ def config_scratch(PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspat
     return SCRATCH_WS
 
 # clear scratch workspace
-def clear_scratch(SCRATCH_WS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scratch.gdb")):   
+def clear_scratch(SCRATCH_WS = DEFAULT_SCRATCH_WS):   
     """
     Clears the default scratch workspace. Useful at the end of analysis. Optionally, set to a different gdb to delete all feature classes. 
     """
+    arcpy = _arcpy()
     arcpy.env.workspace = SCRATCH_WS
     scratch_fcs = arcpy.ListFeatureClasses()
     for fc in scratch_fcs:
@@ -48,17 +78,117 @@ def clear_scratch(SCRATCH_WS = os.path.join(os.path.dirname(os.path.dirname(os.p
         print(f"Deleted feature class: {fc}")
 
 
+# load only the fields that are used
+def read_fields(fc, fields, where=None, geometry=False, backend="arcpy"):
+    """
+    Reads selected fields of a feature class or table to a dataframe, instead of the whole layer
+    * **fc**: feature class or table
+    * **fields**: list of field names to read
+    * **where**: optional where clause, eg. "surveyed = 1"
+    * **geometry**: also read the geometry (a spatially enabled dataframe on arcpy, a GeoDataFrame on gdal)
+    * **backend**: "arcpy" (default) reads with a SearchCursor, "gdal" reads with pyogrio/fiona (see cache.read_fc),
+    no ArcGIS needed
+    """
+    if backend == "gdal":
+        return cache.read_fc(fc, fields, where, geometry)
+    elif backend != "arcpy":
+        raise ValueError(f"Unknown backend: {backend}")
+    arcpy = _arcpy()
+
+    if geometry:
+        return pd.DataFrame.spatial.from_featureclass(fc, fields=list(fields), where_clause=where)
+    with arcpy.da.SearchCursor(fc, list(fields), where_clause=where) as cursor:
+        return pd.DataFrame.from_records(list(cursor), columns=list(fields))
+
+
+# attribute join without AddJoin/CalculateField
+@instrument.stage("join_field")
+def join_field(keys, table, key_field, value_field):
+    """
+    Looks up a field of another table for every key in one hashed lookup, the in-memory version of
+    AddJoin + CalculateField + RemoveJoin
+    * **keys**: array or series of join keys, eg. the UNIT_ID column of the kelp lines
+    * **table**: dataframe with key_field and value_field (see read_fields)
+    * returns an array of value_field in the order of keys, NaN where there is no match (first match wins, like AddJoin)
+    """
+    table = table.drop_duplicates(key_field)
+    idx = pd.Index(table[key_field]).get_indexer(keys)
+    values = table[value_field].to_numpy()
+    matched = idx >= 0
+    instrument.count(n_in=len(idx), n_matched=int(np.sum(matched)))
+    print(f"Joined {value_field}: {np.sum(matched)} of {len(idx)} matched on {key_field}")
+    if not len(values):  # empty table, nothing to index
+        return np.full(len(idx), np.nan)
+    return np.where(matched, values[np.maximum(idx, 0)], np.nan)
+
+
+# filter kelp features as they are read instead of copying the fc and deleting rows with an UpdateCursor
+# eg. fns.KelpFilter(fc, where="FLOATKELP <> 'ABSENT'") or fns.KelpFilter(fc, min_area=3.6), passed in place of the fc
+KelpFilter = geo_fns.KelpFilter
+
+
+def kelp_layer(fc):
+    """
+    arcpy backend side of KelpFilter: a feature layer over the fc with the predicates as its definition query,
+    so the joins only see the matching features and nothing is copied. Plain feature classes are returned as is
+    * **fc**: kelp feature class or KelpFilter
+    * note: the layer has the fc's name, so Describe(layer).name still ends with the year
+    """
+    if not isinstance(fc, KelpFilter):
+        return fc
+    arcpy = _arcpy()
+
+    clauses = []
+    if fc.where is not None:
+        clauses.append(f"({fc.where})")
+    if fc.min_area is not None:
+        clauses.append(f"{arcpy.Describe(fc.fc).areaFieldName} >= {fc.min_area}")
+    layer = cache.fc_name(fc.fc)
+    with instrument.stage("MakeFeatureLayer", year=layer[-4:]):
+        arcpy.management.MakeFeatureLayer(fc.fc, layer, " AND ".join(clauses) or None)
+    print(f"Filtered {layer}: {arcpy.management.GetCount(layer)[0]} features")
+    return layer
+
+
+def geometry_key(fc):
+    """
+    Hash of the geometry of a feature class: its spatial reference and the WKB of every shape, sorted so feature order
+    does not matter (same idea as geo_fns.survey_masks). Two survey boundary fcs with the same key clip the same way
+    """
+    arcpy = _arcpy()
+    h = hashlib.sha1(arcpy.Describe(fc).spatialReference.exportToString().encode())
+    with arcpy.da.SearchCursor(fc, ["SHAPE@WKB"]) as cursor:
+        for wkb in sorted(bytes(row[0]) for row in cursor if row[0] is not None):
+            h.update(wkb)
+    return h.hexdigest()
+
+
 # main tools ------------------------------------------------------------------------------------
 # function to calculate presence
-def calc_presence(fc_list, containers, SCRATCH_WS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scratch.gdb"), 
-                    variable_survey_area=False): 
+@instrument.stage("calc_presence")
+def calc_presence(fc_list, containers, SCRATCH_WS = DEFAULT_SCRATCH_WS, 
+                    variable_survey_area=False, backend="arcpy", source_name=None, cache_name=None): 
     """
-    * **fc_list**: list of feature class of kelp beds OR paired list of kelp feature classes, kelp survey area if variable_survey_area=True
+    * **fc_list**: list of feature class of kelp beds OR paired list of kelp feature classes, kelp survey area if variable_survey_area=True.
+    Kelp fcs can be KelpFilters
     * **containers**: for summarize within ALREADY CLIPPED TO SURVEY EXTENT if variable_survey_area=False
     * **SCRATCH_WS**: workspace for outputting spatial join results; defaults to path from config_scratch
     * **variable_survey_area**: defaults to FALSE if the same area was surveyed every year. Change to TRUE if any years had different survey area
+    * **backend**: "arcpy" (default) runs one SpatialJoin per fc into SCRATCH_WS. 
+    "shapely" runs one in-memory STRtree query for all fcs (see geo_fns.calc_presence) and nothing is written to scratch
+    * **source_name**: required for the shapely backend, string to be used as source name in table
+    * **cache_name**: shapely backend only. Name for the per year result cache, unchanged years are not recalculated
+    * note: the shapely backend returns the list of presence dataframes directly, so skip df_from_fc
     """
 
+    if backend == "shapely":
+        if source_name is None:
+            raise ValueError("source_name is required when backend='shapely'")
+        return geo_fns.calc_presence(fc_list, containers, source_name, variable_survey_area, cache_name)
+    elif backend != "arcpy":
+        raise ValueError(f"Unknown backend: {backend}")
+    arcpy = _arcpy()
+
     # intialize list of output fcs
     pres_fcs = []
 
@@ -68,7 +198,13 @@ def calc_presence(fc_list, containers, SCRATCH_WS = os.path.join(os.path.dirname
     # if each year/survey needs its own survey area: 
     if variable_survey_area:
 
+        # containers clipped to each distinct survey boundary (by geometry, so copies of one boundary in different fcs
+        # count once), shared by every year that uses that boundary
+        svy_keys = {}
+        clipped_by_svy = {}
+
         for kelp_fc, svy_fc in fc_list: 
+            kelp_fc = kelp_layer(kelp_fc)
 
             print("Checking Spatial References...")
             kelp_sr = arcpy.Describe(kelp_fc).spatialReference
@@ -86,11 +222,20 @@ def calc_presence(fc_list, containers, SCRATCH_WS = os.path.join(os.path.dirname
             print(f"Kelp data: {kelp_fc}")
             print(f"Survey boundary: {svy_fc}")
 
-            # clip containers to survey area footprint
-            print("Clipping containers to survey boundary...")
-            containers_clip = "in_memory/containers_clip"
-            arcpy.analysis.Clip(containers, svy_fc, containers_clip)
-            print(f"Output clipped containers: {containers_clip}")
+            # clip containers to survey area footprint, once per boundary
+            if svy_fc not in svy_keys:
+                svy_keys[svy_fc] = geometry_key(svy_fc)
+            svy_key = svy_keys[svy_fc]
+            if svy_key not in clipped_by_svy:
+                print("Clipping containers to survey boundary...")
+                containers_clip = f"in_memory/containers_clip{len(clipped_by_svy)}"
+                with instrument.stage("Clip", year=kelp_fc[-4:]):
+                    arcpy.analysis.Clip(containers, svy_fc, containers_clip)
+                clipped_by_svy[svy_key] = containers_clip
+                print(f"Output clipped containers: {containers_clip}")
+            else:
+                print("Using containers already clipped to this survey boundary")
+            containers_clip = clipped_by_svy[svy_key]
             
             # get the describe object for the kelp feature class
             fc_desc = arcpy.Describe(kelp_fc)
@@ -102,11 +247,12 @@ def calc_presence(fc_list, containers, SCRATCH_WS = os.path.join(os.path.dirname
             print(f"Running spatial join for {fc_desc.name}...")
             try:
                 # run summarize within
-                arcpy.analysis.SpatialJoin(
-                    target_features = containers_clip,
-                    join_features = kelp_fc,
-                    out_feature_class = out_fc
-                ) # save results in scratch gdb 
+                with instrument.stage("SpatialJoin", year=fc_desc.name[-4:]):
+                    arcpy.analysis.SpatialJoin(
+                        target_features = containers_clip,
+                        join_features = kelp_fc,
+                        out_feature_class = out_fc
+                    ) # save results in scratch gdb 
 
                 print("Presence analysis complete for " + fc_desc.name)
             except arcpy.ExecuteError: 
@@ -116,14 +262,16 @@ def calc_presence(fc_list, containers, SCRATCH_WS = os.path.join(os.path.dirname
             except Exception as e:
                 print(e.args[0])
                 break
-            
-            # delete the intermediate clipped container fc 
+
+        # delete the intermediate clipped container fcs
+        for containers_clip in clipped_by_svy.values():
             arcpy.management.Delete(containers_clip)
-            arcpy.management.ClearWorkspaceCache()
+        arcpy.management.ClearWorkspaceCache()
 
     # if survey area is constant across years, containers are clipped upstream in the linearizing script
     else:
         for fc in fc_list:
+            fc = kelp_layer(fc)
 
             # get the describe object for the feature class
             fc_desc = arcpy.Describe(fc)
@@ -145,11 +293,12 @@ def calc_presence(fc_list, containers, SCRATCH_WS = os.path.join(os.path.dirname
             print(f"Running presence analysis for {fc_desc.name}...")
             try:
                 # run spatial join
-                arcpy.analysis.SpatialJoin(
-                    target_features = containers,
-                    join_features = fc,
-                    out_feature_class = out_fc
-                ) # save results in scratch gdb 
+                with instrument.stage("SpatialJoin", year=fc_desc.name[-4:]):
+                    arcpy.analysis.SpatialJoin(
+                        target_features = containers,
+                        join_features = fc,
+                        out_feature_class = out_fc
+                    ) # save results in scratch gdb 
 
                 print(f"Presence analysis complete for {fc_desc.name}")
             except arcpy.ExecuteError:
@@ -162,7 +311,30 @@ def calc_presence(fc_list, containers, SCRATCH_WS = os.path.join(os.path.dirname
     # return list of resulting feature classes        
     return pres_fcs
                     
+# presence + coverage category merged to one results table, from a single query per kelp layer
+# (shapely only, see geo_fns.calc_results)
+calc_results = geo_fns.calc_results
+
+# same for every year of a multi-year fc in one pass, no SplitByAttributes needed
+# (shapely only, see geo_fns.calc_by_year)
+calc_by_year = geo_fns.calc_by_year
+
+# line kelp sources (ShoreZone): presence, cov cat and year per site from the lines within a distance tolerance,
+# no buffering (shapely only, see geo_fns.calc_lines)
+calc_lines = geo_fns.calc_lines
+
+# year with the most kelp area (polygons) or length (lines) in each site, from in-memory intersections instead of a
+# PairwiseIntersect fc (shapely only, see geo_fns.year_by_overlap)
+year_by_overlap = geo_fns.year_by_overlap
+
+# classified kelp rasters (one per year) straight to presence/cov cat, no vectorizing (GDAL, see raster_fns.py)
+calc_raster = raster_fns.calc_raster
+
+# write a result table as <dataset_name>_result.parquet with the shared result schema (see result_io)
+write_results = result_io.write_results
+
 # feature class to dataframe
+@instrument.stage("df_from_fc")
 def df_from_fc(in_features, source_name):
 
     """
@@ -171,6 +343,7 @@ def df_from_fc(in_features, source_name):
     * **source_name**: string to be used as source name in table
     * note: input features MUST have year as last 4 characters of name for this to work 
     """
+    arcpy = _arcpy()
     pres_col = "Join_Count"
     # if each year/survey needs its own survey area: 
     sdf_list = []
@@ -178,9 +351,8 @@ def df_from_fc(in_features, source_name):
         
         fc_desc = arcpy.Describe(feature)
 
-        sdf = pd.DataFrame.spatial.from_featureclass(feature) 
+        sdf = read_fields(feature, ["SITE_CODE", pres_col]) # no geometry or joined kelp attributes
 
-        
         sdf['year'] = fc_desc.name[-4:]
         sdf['source'] = source_name
         sdf['presence'] = np.where(sdf[pres_col] > 0, 1, 0)
@@ -189,17 +361,33 @@ def df_from_fc(in_features, source_name):
         sdf_list.append(sdf)
         print("Converted " + fc_desc.name + " to sdf and added to list")
 
+    instrument.count(n_in=len(sdf_list), n_out=sum(len(sdf) for sdf in sdf_list))
     return sdf_list    
 
 # tool for calculating coverage category of polygon kelp beds along line segments
-def calc_cov_cat(cov_cat_containers, kelp_fcs, SCRATCH_WS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scratch.gdb")):
+@instrument.stage("calc_cov_cat")
+def calc_cov_cat(cov_cat_containers, kelp_fcs, SCRATCH_WS = DEFAULT_SCRATCH_WS, 
+                 backend="arcpy", cache_name=None, area_weighted=False):
     """
     Calculates coverage category for polygon kelp presence features 
     * **cov_cat_containers**: feature class with the subdivided containers
     * **kelp_fcs**: list of feature classes with kelp presence polygons to be analyzed
-    * note, lines must be ONLY presence lines (filter out absence lines upstream)
+    * note, lines must be ONLY presence lines (filter out absence lines upstream, or pass a KelpFilter)
     * **PROJECT_ROOT**: path to the parent folder 
+    * **backend**: "arcpy" (default) runs one SpatialJoin per fc into SCRATCH_WS.
+    "shapely" queries all fcs at once in memory with precomputed segment weights (see geo_fns.calc_cov_cat), no cc* fcs are written
+    * **cache_name**: shapely backend only. Name for the per year result cache, unchanged years are not recalculated
+    * **area_weighted**: shapely backend only. Adds coverage_frac, the length weighted share of each site's segments
+    covered by kelp (see geo_fns.cover_fractions), so slivers no longer count the same as full cover
     """
+    if backend == "shapely":
+        return geo_fns.calc_cov_cat(cov_cat_containers, kelp_fcs, cache_name, area_weighted)
+    elif backend != "arcpy":
+        raise ValueError(f"Unknown backend: {backend}")
+    if area_weighted:
+        raise ValueError("area_weighted is only available with backend='shapely'")
+    arcpy = _arcpy()
+
     arcpy.env.overwriteOutput = True
     
     #initial result sdf list 
@@ -208,6 +396,7 @@ def calc_cov_cat(cov_cat_containers, kelp_fcs, SCRATCH_WS = os.path.join(os.path
 
     # spatial join --> do NOT clip cov cat containers to survey area, 
     for fc in kelp_fcs:
+        fc = kelp_layer(fc)
 
         # get the describe object for the feature class
         fc_desc = arcpy.Describe(fc)
@@ -219,11 +408,12 @@ def calc_cov_cat(cov_cat_containers, kelp_fcs, SCRATCH_WS = os.path.join(os.path
         try: 
             print(f"Running Coverage Category calculation for {fc_desc.name}...")
             print(f"Results will be written to {out_fc}")
-            arcpy.analysis.SpatialJoin(
-                target_features=cov_cat_containers,
-                join_features=fc,
-                out_feature_class=out_fc
-            )
+            with instrument.stage("SpatialJoin", year=fc_desc.name[-4:]):
+                arcpy.analysis.SpatialJoin(
+                    target_features=cov_cat_containers,
+                    join_features=fc,
+                    out_feature_class=out_fc
+                )
             print(f"Result written to {out_fc}")
         except arcpy.ExecuteError:
             print(arcpy.GetMessages())
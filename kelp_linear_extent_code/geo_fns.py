@@ -0,0 +1,857 @@
+# geometry function library
+# shapely/geopandas versions of the fns.py tools - no arcpy required, so these run on any machine
+import hashlib
+import numpy as np
+import pandas as pd
+import shapely
+from kelp_linear_extent_code import cache
+from kelp_linear_extent_code import instrument
+from kelp_linear_extent_code import linref
+from kelp_linear_extent_code.cache import fc_name, read_fc
+
+# utilities ---------------------------------------------------------------------------------------------
+def match_crs(gdf, crs, name):
+    """
+    Projects a GeoDataFrame to the container crs if needed (arcpy's joins do this on the fly)
+    """
+    if gdf.crs != crs:
+        print(f"WARNING: SPATIAL REFERENCES DO NOT MATCH for {name}. Projecting to container crs...")
+        gdf = gdf.to_crs(crs)
+    return gdf
+
+
+def valid_geoms(gdf):
+    """
+    Returns the geometries of a GeoDataFrame as a shapely array and a mask of the rows with a non-empty geometry
+    """
+    g = np.asarray(gdf.geometry.values, dtype=object)
+    return g, ~(shapely.is_missing(g) | shapely.is_empty(g))
+
+
+# filters ------------------------------------------------------------------------------------------------
+class KelpFilter:
+    """
+    A kelp feature class with attribute/area predicates applied as it is read, instead of copying it and deleting rows.
+    Can be passed anywhere the kelp tools take a kelp fc (fns.calc_presence, fns.calc_cov_cat, calc_results...)
+    * **fc**: kelp feature class
+    * **where**: optional SQL where clause, eg. "FLOATKELP <> 'ABSENT'". Pushed down to GDAL here, and to a feature
+    layer on the arcpy backend (see fns.kelp_layer)
+    * **min_area**: optional, features with a smaller area (map units) are dropped with a mask over the area array
+    """
+
+    def __init__(self, fc, where=None, min_area=None):
+        self.fc = fc
+        self.where = where
+        self.min_area = min_area
+
+    def __repr__(self):
+        return f"KelpFilter({self.fc!r}, where={self.where!r}, min_area={self.min_area!r})"
+
+
+def kelp_name(fc):
+    """
+    fc_name that also takes a KelpFilter (the name of the filtered fc, so the year suffix is kept)
+    """
+    if isinstance(fc, KelpFilter):
+        return fc_name(fc.fc)
+    return fc_name(fc)
+
+
+def read_kelp(fc, crs):
+    """
+    Reads a kelp feature class (or KelpFilter) and returns its non-empty geometries in the container crs
+    """
+    if not isinstance(fc, KelpFilter):
+        g, keep = valid_geoms(match_crs(read_fc(fc), crs, fc_name(fc)))
+        return g[keep]
+
+    g, keep = valid_geoms(match_crs(read_fc(fc.fc, where=fc.where), crs, kelp_name(fc)))
+    g = g[keep]
+    if fc.min_area is not None:
+        big = shapely.area(g) >= fc.min_area
+        print(f"Dropping {np.sum(~big)} features with area < {fc.min_area} from {kelp_name(fc)}")
+        g = g[big]
+    return g
+
+
+def stack_fcs(fcs, crs):
+    """
+    Reads a list of kelp feature classes and stacks their geometries into one array for bulk queries
+    * **fcs**: list of feature classes or KelpFilters
+    * **crs**: crs of the containers, kelp data is projected to match if needed
+    * returns (geometry array, array with the position in fcs that each geometry came from)
+    """
+    geoms = []
+    owner = []
+    for i, fc in enumerate(fcs):
+        g = read_kelp(fc, crs)
+        geoms.append(g)
+        owner.append(np.full(len(g), i, dtype=np.int64))
+
+    if not geoms:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.int64)
+    return np.concatenate(geoms), np.concatenate(owner)
+
+
+def hit_matrix(tree, geoms, owner, n_groups, distance=None):
+    """
+    Runs one bulk intersects query and returns a (n_groups, n_tree_geometries) boolean hit matrix
+    * **tree**: shapely STRtree of the container geometries
+    * **geoms**: stacked kelp geometries (see stack_fcs)
+    * **owner**: group (year/fc) of each kelp geometry
+    * **n_groups**: number of groups
+    * **distance**: optional tolerance (map units), geometries this close count as hits (same as buffering the kelp)
+    """
+    hits = np.zeros((n_groups, len(tree.geometries)), dtype=bool)
+    if len(geoms) == 0:
+        return hits
+    if distance is None:
+        kelp_idx, tree_idx = tree.query(geoms, predicate="intersects")
+    else:
+        kelp_idx, tree_idx = tree.query(geoms, predicate="dwithin", distance=distance)
+    hits[owner[kelp_idx], tree_idx] = True
+    return hits
+
+
+def read_svy(svy_fc, crs):
+    """
+    Reads a survey boundary feature class and returns it as a single (unioned) geometry in the given crs
+    """
+    svy = match_crs(read_fc(svy_fc), crs, fc_name(svy_fc))
+    return shapely.union_all(np.asarray(svy.geometry.values, dtype=object))
+
+
+def survey_mask(cont_geoms, svy_geom):
+    """
+    Which containers a survey boundary keeps, the equivalent of clipping the containers to it, as boolean masks
+    * **cont_geoms**: container geometries
+    * **svy_geom**: survey boundary geometry (see read_svy)
+    * returns (keep, partial, partial_tree): containers with some area inside the boundary, the ones of those only partly
+    inside, and an STRtree of the clipped part of the partial ones (None if there are none)
+    """
+    clipped = shapely.intersection(cont_geoms, svy_geom)
+    keep = ~shapely.is_empty(clipped) & (shapely.area(clipped) > 0)
+    partial = keep.copy()
+    partial[keep] = ~shapely.covered_by(cont_geoms[keep], svy_geom)
+    partial_tree = shapely.STRtree(clipped[partial]) if partial.any() else None
+    return keep, partial, partial_tree
+
+
+def survey_masks(cont_geoms, svy_geoms):
+    """
+    survey_mask for a list of boundaries (one per kelp group), calculated once per distinct boundary: years that share a
+    boundary (the same object, or the same geometry read from another fc) share its masks
+    * returns a list with the masks of each group
+    """
+    by_id = {}
+    by_hash = {}
+    masks = []
+    for svy_geom in svy_geoms:
+        if id(svy_geom) not in by_id:
+            key = hashlib.sha1(shapely.to_wkb(svy_geom)).hexdigest()
+            if key not in by_hash:
+                by_hash[key] = survey_mask(cont_geoms, svy_geom)
+            by_id[id(svy_geom)] = by_hash[key]
+        masks.append(by_id[id(svy_geom)])
+    if svy_geoms:
+        print(f"Clipped containers to {len(by_hash)} distinct survey boundaries for {len(svy_geoms)} kelp groups")
+    return masks
+
+
+# engines -------------------------------------------------------------------------------------------
+# these work on stacked kelp geometries + the group (fc or year) of each geometry, so every year is answered by one query
+def presence_frames(cont, tree, kelp_geoms, kelp_owner, names, source_name, svy_geoms=None, cache_name=None, ref_key=None,
+                    hits=None):
+    """
+    Presence for any number of kelp groups at once, the engine behind calc_presence and calc_results
+    * **cont**, **tree**: containers GeoDataFrame and its STRtree (see cache.load_tree)
+    * **kelp_geoms**, **kelp_owner**: stacked kelp geometries and the group of each one (see stack_fcs)
+    * **names**: name of each group, year is the last 4 characters
+    * **source_name**: string to be used as source name in table
+    * **svy_geoms**: optional survey boundary geometry for each group, the containers are clipped to it
+    * **cache_name**, **ref_key**: per year result cache name and cache key of the containers, see calc_presence
+    * **hits**: optional (n_groups, n_containers) hit matrix that is already known (see rollup_hits), skips the container query
+    * returns a list of SITE_CODE/year/source/presence dataframes, one per group
+    """
+    cont_geoms = np.asarray(cont.geometry.values, dtype=object)
+    hits_given = hits is not None
+
+    # look up years that are already calculated
+    sdf_list = [None] * len(names)
+    keys = [None] * len(names)
+    if cache_name is not None:
+        for i, name in enumerate(names):
+            svy = np.array([svy_geoms[i]], dtype=object) if svy_geoms is not None else "no survey area"
+            keys[i] = cache.year_key("presence", ref_key, kelp_geoms[kelp_owner == i], svy)
+            sdf_list[i] = cache.load_year_result(cache_name, "presence", name, keys[i])
+            if sdf_list[i] is not None:
+                sdf_list[i]["source"] = source_name
+                print(f"Using stored presence result for {name}")
+    todo = [i for i in range(len(names)) if sdf_list[i] is None]
+
+    # one bulk query for every group still to do
+    if hits is None:
+        print(f"Running presence query for {len(todo)} kelp groups...")
+        todo_mask = np.isin(kelp_owner, todo)
+        hits = hit_matrix(tree, kelp_geoms[todo_mask], kelp_owner[todo_mask], len(names))
+
+    # equivalent of clipping the containers to each survey boundary, once per distinct boundary
+    masks = None
+    if svy_geoms is not None:
+        masks = dict(zip(todo, survey_masks(cont_geoms, [svy_geoms[i] for i in todo])))
+
+    for i in todo:
+        name = names[i]
+        rows = np.arange(len(cont))
+        pres = hits[i]
+
+        if masks is not None:
+            keep, partial, partial_tree = masks[i]
+            rows = np.flatnonzero(keep)
+
+            # containers only partly inside the boundary: recheck hits against the clipped part
+            if partial_tree is not None and pres[partial].any():
+                partial_idx = np.flatnonzero(partial)
+                _, sub_idx = partial_tree.query(kelp_geoms[kelp_owner == i], predicate="intersects")
+                pres = pres.copy()
+                pres[partial_idx] = False
+                pres[partial_idx[np.unique(sub_idx)]] = True
+
+        sdf = pd.DataFrame({
+            "SITE_CODE": cont["SITE_CODE"].values[rows],
+            "year": name[-4:],
+            "source": source_name,
+            "presence": pres[rows].astype(int),
+        })
+        if cache_name is not None:
+            cache.store_year_result(cache_name, "presence", name, keys[i], sdf)
+        sdf_list[i] = sdf
+        print(f"Presence analysis complete for {name}")
+
+    if not hits_given:
+        instrument.count(n_in=len(kelp_geoms), n_out=sum(len(sdf) for sdf in sdf_list), years=[name[-4:] for name in names])
+    return sdf_list
+
+
+def cov_cat_frames(tree, weights, kelp_geoms, kelp_owner, names, cache_name=None, ref_key=None, seg_size=None):
+    """
+    Coverage category for any number of kelp groups at once, the engine behind calc_cov_cat
+    * **tree**: STRtree of cov_cat_containers (see cache.load_tree)
+    * **weights**: weight table from load_cov_cat_weights
+    * **kelp_geoms**, **kelp_owner**, **names**: stacked kelp geometries, group of each one and group names, see presence_frames
+    * **cache_name**, **ref_key**: per year result cache name and cache key of cov_cat_containers
+    * **seg_size**: optional (area, length) arrays of the segments, adds the coverage_frac column (see cover_fractions)
+    * returns a list of SITE_CODE/coverage_cat/fc_name dataframes, one per group
+    """
+    sites = cov_cat_sites(weights)
+
+    # look up years that are already calculated
+    df_list = [None] * len(names)
+    keys = [None] * len(names)
+    if cache_name is not None:
+        for i, name in enumerate(names):
+            keys[i] = cache.year_key("cov_cat", ref_key, kelp_geoms[kelp_owner == i])
+            df_list[i] = cache.load_year_result(cache_name, "cov_cat", name, keys[i])
+            if df_list[i] is not None:
+                df_list[i]["coverage_cat"] = pd.Categorical(df_list[i]["coverage_cat"], categories=[0, 1, 2, 3, 4])
+                print(f"Using stored coverage category result for {name}")
+    todo = [i for i in range(len(names)) if df_list[i] is None]
+
+    print(f"Running coverage category query for {len(todo)} kelp groups...")
+    todo_mask = np.isin(kelp_owner, todo)
+    if seg_size is not None:
+        hits, frac = cover_fractions(tree, seg_size, kelp_geoms[todo_mask], kelp_owner[todo_mask], len(names))
+        site_frac = cov_frac_from_fractions(frac, weights)
+    else:
+        hits = hit_matrix(tree, kelp_geoms[todo_mask], kelp_owner[todo_mask], len(names))
+    cats = cov_cat_from_hits(hits, weights)
+
+    for i in todo:
+        df = pd.DataFrame({
+            "SITE_CODE": sites,
+            "coverage_cat": pd.Categorical(cats[i], categories=[0, 1, 2, 3, 4]),
+            "fc_name": names[i],
+        })
+        if seg_size is not None:
+            df.insert(2, "coverage_frac", site_frac[i])
+        if cache_name is not None:
+            cache.store_year_result(cache_name, "cov_cat", names[i], keys[i], df)
+        df_list[i] = df
+
+    instrument.count(n_in=len(kelp_geoms), n_out=sum(len(df) for df in df_list), years=[name[-4:] for name in names])
+    return df_list
+
+
+# main tools ------------------------------------------------------------------------------------
+def calc_presence(fc_list, containers, source_name, variable_survey_area=False, cache_name=None):
+    """
+    In-memory version of fns.calc_presence + fns.df_from_fc
+    Loads the containers once, builds a single STRtree and answers "does any kelp polygon intersect this container"
+    for every input fc with one bulk query
+    * **fc_list**: list of kelp feature classes OR paired list of kelp feature classes, kelp survey area if variable_survey_area=True
+    * **containers**: containers, ALREADY CLIPPED TO SURVEY EXTENT if variable_survey_area=False
+    * **source_name**: string to be used as source name in table
+    * **variable_survey_area**: clips the containers to each survey area, same as fns.calc_presence
+    * **cache_name**: optional name for the per year result cache (usually the dataset name). Years whose kelp and survey
+    boundary geometry have not changed since the last run are read from the cache instead of being recalculated
+    * returns a list of SITE_CODE/year/source/presence dataframes, same as df_from_fc
+    * note: input features MUST have year as last 4 characters of name for this to work
+    """
+    fc_list = list(fc_list)
+    if variable_survey_area:
+        kelp_fcs = [kelp for kelp, svy in fc_list]
+        svy_fcs = [svy for kelp, svy in fc_list]
+    else:
+        kelp_fcs = fc_list
+
+    print(f"Loading containers: {containers}")
+    cont, tree = cache.load_tree(containers)
+    kelp_geoms, kelp_owner = stack_fcs(kelp_fcs, cont.crs)
+
+    svy_geoms = None
+    if variable_survey_area:
+        print("Reading survey boundaries...")
+        svy_by_fc = {svy_fc: read_svy(svy_fc, cont.crs) for svy_fc in dict.fromkeys(svy_fcs)}
+        svy_geoms = [svy_by_fc[svy_fc] for svy_fc in svy_fcs]
+
+    ref_key = cache.source_key(containers) if cache_name is not None else None
+    return presence_frames(cont, tree, kelp_geoms, kelp_owner, [kelp_name(fc) for fc in kelp_fcs], source_name,
+                           svy_geoms, cache_name, ref_key)
+
+
+# coverage category -------------------------------------------------------------------------------
+def cov_cat_weights(cov_cat):
+    """
+    Builds the coverage category weight table for the subdivided containers
+    * **cov_cat**: dataframe of cov_cat_containers (needs SITE_CODE and length_m), in layer order
+    * returns a dataframe with one row per segment: SITE_CODE, site_idx (position of SITE_CODE in the sorted site list) and
+    weight (length_m / total length of the SITE_CODE)
+    """
+    site_idx, sites = pd.factorize(cov_cat["SITE_CODE"], sort=True)
+    length = np.nan_to_num(cov_cat["length_m"].to_numpy(dtype=float))
+
+    total_length = np.bincount(site_idx[site_idx >= 0], weights=length[site_idx >= 0], minlength=len(sites))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = np.where(site_idx >= 0, length / total_length[site_idx], 0)
+
+    return pd.DataFrame({
+        "SITE_CODE": cov_cat["SITE_CODE"].values,
+        "site_idx": site_idx,
+        "weight": np.nan_to_num(weight),
+    })
+
+
+def load_cov_cat_weights(cov_cat_containers):
+    """
+    Returns the weight table for cov_cat_containers, computed once and stored in the reference cache
+    The table is rebuilt whenever the cov_cat_containers layer is edited
+    * **cov_cat_containers**: path to the cov_cat_containers feature class
+    """
+    return cache.load_derived(cov_cat_containers, "weights", cov_cat_weights)
+
+
+def cov_cat_sites(weights):
+    """
+    Sorted SITE_CODEs of a weight table, the column order of cov_cat_from_hits
+    """
+    return np.sort(weights.loc[weights["site_idx"] >= 0, "SITE_CODE"].unique())
+
+
+def cov_cat_from_hits(hits, weights):
+    """
+    Vectorized coverage category for any number of years/fcs at once
+    * **hits**: (n_groups, n_segments) boolean array, True where kelp touches the cov cat segment
+    * **weights**: weight table from cov_cat_weights
+    * returns a (n_groups, n_sites) array of coverage categories 0-4, sites in the sorted SITE_CODE order of the weight table
+    """
+    site_idx = weights["site_idx"].to_numpy()
+    weight = weights["weight"].to_numpy()
+    n_sites = site_idx.max() + 1 if len(site_idx) else 0
+    n_groups = hits.shape[0]
+
+    # sum of weights of the hit segments, one bincount for every (group, site)
+    grp, seg = np.nonzero(hits & (site_idx >= 0))
+    sum_w_pres = np.bincount(grp * n_sites + site_idx[seg], weights=weight[seg], minlength=n_groups * n_sites)
+
+    # (-inf, 0] = 0, (0, 0.25] = 1, (0.25, 0.5] = 2, (0.5, 0.75] = 3, (0.75, inf) = 4
+    cats = np.digitize(sum_w_pres, [0, 0.25, 0.5, 0.75], right=True)
+    return cats.reshape(n_groups, n_sites)
+
+
+def cover_fractions(tree, seg_size, kelp_geoms, kelp_owner, n_groups):
+    """
+    Hit matrix plus the fraction of each segment covered by kelp, for every group from the same bulk query
+    The candidate pairs of the query are clipped to their segment in one batched call, and the pieces of the same group
+    and segment are unioned before they are measured, so kelp features that overlap each other (eg. two surveys of the
+    same bed in one year) are counted once
+    * **tree**: STRtree of cov_cat_containers
+    * **seg_size**: (area, length) arrays of the segments, see segment_sizes
+    * **kelp_geoms**, **kelp_owner**, **n_groups**: see hit_matrix
+    * returns ((n_groups, n_segments) hit matrix, (n_groups, n_segments) covered fraction). The fraction is kelp area /
+    segment area for polygon kelp and kelp length / segment length_m for line kelp (capped at 1 if a group has both)
+    """
+    seg_geoms = tree.geometries
+    n_segs = len(seg_geoms)
+    hits = np.zeros((n_groups, n_segs), dtype=bool)
+    frac = np.zeros((n_groups, n_segs))
+    if len(kelp_geoms) == 0:
+        return hits, frac
+
+    k_idx, s_idx = tree.query(kelp_geoms, predicate="intersects")
+    hits[kelp_owner[k_idx], s_idx] = True
+    pieces = shapely.intersection(kelp_geoms[k_idx], seg_geoms[s_idx])
+    polygonal = shapely.get_dimensions(kelp_geoms[k_idx]) == 2
+
+    # one piece per (group, segment, polygon/line): most keys have a single piece, the rest are unioned
+    keys, inv, n_pieces = np.unique((kelp_owner[k_idx] * n_segs + s_idx) * 2 + polygonal, return_inverse=True,
+                                    return_counts=True)
+    merged = np.empty(len(keys), dtype=object)
+    single = n_pieces[inv] == 1
+    merged[inv[single]] = pieces[single]
+    order = np.argsort(inv, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(n_pieces)[:-1]])
+    for k in np.flatnonzero(n_pieces > 1):
+        merged[k] = shapely.union_all(pieces[order[starts[k]:starts[k] + n_pieces[k]]])
+
+    key_poly = (keys % 2).astype(bool)
+    key_pair = keys // 2
+    seg_area, seg_length = seg_size
+    size = np.where(key_poly, shapely.area(merged), shapely.length(merged))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = size / np.where(key_poly, seg_area[key_pair % n_segs], seg_length[key_pair % n_segs])
+    share = np.nan_to_num(share, posinf=0.0)
+    frac = np.bincount(key_pair, weights=share, minlength=n_groups * n_segs)
+    return hits, np.minimum(frac, 1.0).reshape(n_groups, n_segs)
+
+
+def cov_frac_from_fractions(frac, weights):
+    """
+    Site coverage fraction: the length weighted mean of the covered fraction of its segments
+    * **frac**: (n_groups, n_segments) covered fractions from cover_fractions
+    * **weights**: weight table from cov_cat_weights
+    * returns a (n_groups, n_sites) array in the site order of cov_cat_from_hits
+    """
+    site_idx = weights["site_idx"].to_numpy()
+    weight = weights["weight"].to_numpy()
+    n_sites = site_idx.max() + 1 if len(site_idx) else 0
+    n_groups = frac.shape[0]
+
+    seg = np.flatnonzero(site_idx >= 0)
+    grp = np.repeat(np.arange(n_groups), len(seg))
+    seg = np.tile(seg, n_groups)
+    sums = np.bincount(grp * n_sites + site_idx[seg], weights=frac[grp, seg] * weight[seg], minlength=n_groups * n_sites)
+    return sums.reshape(n_groups, n_sites)
+
+
+def segment_sizes(cov_cat):
+    """
+    (area, length_m) arrays of the cov cat segments, the denominators of cover_fractions
+    """
+    area = shapely.area(np.asarray(cov_cat.geometry.values, dtype=object))
+    length = np.nan_to_num(cov_cat["length_m"].to_numpy(dtype=float))
+    return area, length
+
+
+def calc_cov_cat(cov_cat_containers, kelp_fcs, cache_name=None, area_weighted=False):
+    """
+    In-memory version of fns.calc_cov_cat
+    Queries all kelp fcs against the cov cat segments in one bulk STRtree query and categorizes with the stored weights
+    * **cov_cat_containers**: feature class with the subdivided containers
+    * **kelp_fcs**: list of feature classes with kelp presence polygons to be analyzed
+    * **cache_name**: optional name for the per year result cache, see calc_presence
+    * **area_weighted**: also return coverage_frac, the share of each site's segments actually covered by kelp
+    (area for polygons, length for lines, weighted by segment length), next to the touch based coverage_cat
+    * returns SITE_CODE, coverage_cat, fc_name for every fc, same as fns.calc_cov_cat
+    """
+    print(f"Loading coverage category containers: {cov_cat_containers}")
+    cov_cat, tree = cache.load_tree(cov_cat_containers)
+    weights = load_cov_cat_weights(cov_cat_containers)
+    kelp_geoms, kelp_owner = stack_fcs(kelp_fcs, cov_cat.crs)
+
+    ref_key = cache.source_key(cov_cat_containers) if cache_name is not None else None
+    if ref_key is not None and area_weighted:
+        ref_key = f"{ref_key}|area_weighted_union"
+    seg_size = segment_sizes(cov_cat) if area_weighted else None
+    df_list = cov_cat_frames(tree, weights, kelp_geoms, kelp_owner, [kelp_name(fc) for fc in kelp_fcs], cache_name, ref_key,
+                             seg_size)
+
+    result = pd.concat(df_list, ignore_index=True)
+    print("Coverage category result preview:")
+    print(result.head())
+
+    return result
+
+
+# presence + coverage category ------------------------------------------------------------------
+# cov_cat_containers subdivide kelp_containers, so a container is touched by kelp exactly when one of its segments is.
+# Presence is rolled up from the segment hits, so each kelp group needs a single tree query for both results.
+# That only holds for containers that are the union of their site's segments: containers that were clipped (or edited)
+# since the segments were made are told apart by area and queried directly
+# relative difference between a container's area and the total area of its site's segments above which it is queried
+ROLLUP_TOLERANCE = 0.001
+
+
+def rollup_hits(seg_hits, weights, seg_area, cont, kelp_geoms, kelp_owner):
+    """
+    Container level hit matrix from the cov cat segment hits
+    * **seg_hits**: (n_groups, n_segments) hit matrix against cov_cat_containers
+    * **weights**: weight table from load_cov_cat_weights
+    * **seg_area**: area of each cov cat segment
+    * **cont**: containers GeoDataFrame, clipped or not
+    * **kelp_geoms**, **kelp_owner**: stacked kelp geometries and their group, queried against the containers that have no
+    segments or do not match them (see ROLLUP_TOLERANCE)
+    * returns a (n_groups, n_containers) boolean hit matrix, same as hit_matrix on the container tree
+    """
+    n_groups = seg_hits.shape[0]
+    site_idx = weights["site_idx"].to_numpy()
+    sites = cov_cat_sites(weights)
+
+    # any hit segment = site hit
+    site_hits = np.zeros((n_groups, len(sites)), dtype=bool)
+    grp, seg = np.nonzero(seg_hits & (site_idx >= 0))
+    site_hits[grp, site_idx[seg]] = True
+
+    # containers that cover the same area as their site's segments
+    cont_geoms = np.asarray(cont.geometry.values, dtype=object)
+    cont_site = pd.Index(sites).get_indexer(cont["SITE_CODE"])
+    site_area = np.bincount(site_idx[site_idx >= 0], weights=seg_area[site_idx >= 0], minlength=len(sites))
+    cont_area = shapely.area(cont_geoms)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        same = np.abs(cont_area - site_area[np.maximum(cont_site, 0)]) <= ROLLUP_TOLERANCE * cont_area
+    rolled = (cont_site >= 0) & same
+    hits = np.zeros((n_groups, len(cont)), dtype=bool)
+    hits[:, rolled] = site_hits[:, cont_site[rolled]]
+
+    # the rest (clipped containers, or containers with no segments) are queried directly
+    direct = np.flatnonzero(~rolled)
+    if len(direct):
+        print(f"{len(direct)} containers do not match their coverage category segments (clipped or edited), "
+              f"querying them directly")
+        sub_tree = shapely.STRtree(cont_geoms[direct])
+        kelp_idx, sub_idx = sub_tree.query(kelp_geoms, predicate="intersects")
+        hits[kelp_owner[kelp_idx], direct[sub_idx]] = True
+    instrument.count(n_rolled_up=int(rolled.sum()), n_direct=len(direct))
+
+    return hits
+
+
+def result_frames(cont, cc_tree, weights, kelp_geoms, kelp_owner, names, source_name, svy_geoms=None,
+                  cache_name=None, ref_key=None, shoreline=None):
+    """
+    Presence and coverage category for any number of kelp groups from one query against the cov cat segments,
+    the engine behind calc_results and calc_by_year
+    * **cont**: containers GeoDataFrame
+    * **cc_tree**, **weights**: STRtree of cov_cat_containers and its weight table
+    * **kelp_geoms**, **kelp_owner**, **names**, **source_name**, **svy_geoms**: see presence_frames
+    * **cache_name**, **ref_key**: per year result cache name and cache key of both reference layers
+    * **shoreline**: optional linref.Shoreline, the segment hits come from the 1-D interval sweep instead of cc_tree
+    * returns a list of SITE_CODE/year/source/presence/coverage_cat dataframes, one per group
+    """
+    df_list = [None] * len(names)
+    keys = [None] * len(names)
+    if cache_name is not None:
+        for i, name in enumerate(names):
+            svy = np.array([svy_geoms[i]], dtype=object) if svy_geoms is not None else "no survey area"
+            keys[i] = cache.year_key("result", ref_key, kelp_geoms[kelp_owner == i], svy)
+            df_list[i] = cache.load_year_result(cache_name, "result", name, keys[i])
+            if df_list[i] is not None:
+                df_list[i]["source"] = source_name
+                df_list[i]["coverage_cat"] = pd.Categorical(df_list[i]["coverage_cat"], categories=[0, 1, 2, 3, 4])
+                print(f"Using stored result for {name}")
+    todo = [i for i in range(len(names)) if df_list[i] is None]
+    instrument.count(n_in=len(kelp_geoms), years=[name[-4:] for name in names], n_cached=len(names) - len(todo))
+    if not todo:
+        instrument.count(n_out=sum(len(df) for df in df_list))
+        return df_list
+
+    # renumber the groups still to do 0..len(todo)-1
+    group = np.full(len(names), -1)
+    group[todo] = np.arange(len(todo))
+    todo_mask = np.isin(kelp_owner, todo)
+    geoms = kelp_geoms[todo_mask]
+    owner = group[kelp_owner[todo_mask]]
+
+    print(f"Running presence/coverage category query for {len(todo)} kelp groups...")
+    if shoreline is not None:
+        seg_hits = linref.segment_hits(shoreline, geoms, owner, len(todo))
+    else:
+        seg_hits = hit_matrix(cc_tree, geoms, owner, len(todo))
+    cats = cov_cat_from_hits(seg_hits, weights)
+    sites = cov_cat_sites(weights)
+
+    pres_list = presence_frames(cont, None, geoms, owner, [names[i] for i in todo], source_name,
+                                [svy_geoms[i] for i in todo] if svy_geoms is not None else None,
+                                hits=rollup_hits(seg_hits, weights, shapely.area(cc_tree.geometries), cont, geoms, owner))
+
+    for j, i in enumerate(todo):
+        cov_cat = pd.DataFrame({
+            "SITE_CODE": sites,
+            "coverage_cat": pd.Categorical(cats[j], categories=[0, 1, 2, 3, 4]),
+        })
+        df = pd.merge(pres_list[j], cov_cat, how="left", on="SITE_CODE")
+        if cache_name is not None:
+            cache.store_year_result(cache_name, "result", names[i], keys[i], df)
+        df_list[i] = df
+
+    instrument.count(n_out=sum(len(df) for df in df_list))
+    return df_list
+
+
+@instrument.stage("calc_results")
+def calc_results(fc_list, containers, cov_cat_containers, source_name, variable_survey_area=False, cache_name=None,
+                 shoreline=None):
+    """
+    Presence and coverage category in one pass, replaces calc_presence + calc_cov_cat + pd.merge in the linearize scripts
+    Each kelp geometry is queried once against the cov cat segments and presence is rolled up from the segment hits
+    (containers that were clipped and no longer match their segments are queried directly, see rollup_hits)
+    * **fc_list**: list of kelp feature classes OR paired list of kelp feature classes, kelp survey area if variable_survey_area=True
+    * **containers**: containers, ALREADY CLIPPED TO SURVEY EXTENT if variable_survey_area=False
+    * **cov_cat_containers**: feature class with the subdivided containers
+    * **source_name**: string to be used as source name in table
+    * **variable_survey_area**: clips the containers to each survey area, same as calc_presence
+    * **cache_name**: optional name for the per year result cache, see calc_presence
+    * **shoreline**: optional linref.Shoreline (context.shoreline() in the linearize scripts) to use the linear referenced
+    engine for the segment hits, see linref.py
+    * returns one SITE_CODE/year/source/presence/coverage_cat dataframe, year as str
+    * note: input features MUST have year as last 4 characters of name for this to work
+    """
+    fc_list = list(fc_list)
+    if variable_survey_area:
+        kelp_fcs = [kelp for kelp, svy in fc_list]
+        svy_fcs = [svy for kelp, svy in fc_list]
+    else:
+        kelp_fcs = fc_list
+
+    print(f"Loading containers: {containers}")
+    cont = cache.load_layer(containers)
+    cc, cc_tree = cache.load_tree(cov_cat_containers)
+    weights = load_cov_cat_weights(cov_cat_containers)
+    kelp_geoms, kelp_owner = stack_fcs(kelp_fcs, cc.crs)
+
+    svy_geoms = None
+    if variable_survey_area:
+        print("Reading survey boundaries...")
+        svy_by_fc = {svy_fc: read_svy(svy_fc, cont.crs) for svy_fc in dict.fromkeys(svy_fcs)}
+        svy_geoms = [svy_by_fc[svy_fc] for svy_fc in svy_fcs]
+
+    ref_key = f"{cache.source_key(containers)}|{cache.source_key(cov_cat_containers)}" if cache_name is not None else None
+    if ref_key is not None and shoreline is not None:
+        ref_key = f"{ref_key}|linear|{shoreline.key}"
+    results = pd.concat(result_frames(cont, cc_tree, weights, kelp_geoms, kelp_owner, [kelp_name(fc) for fc in kelp_fcs],
+                                      source_name, svy_geoms, cache_name, ref_key, shoreline), ignore_index=True)
+    print("Result preview:")
+    print(results.head())
+
+    return results
+
+
+# multi-year feature classes ----------------------------------------------------------------------
+@instrument.stage("calc_by_year")
+def calc_by_year(kelp_fc, year_field, containers, cov_cat_containers, source_name,
+                 svy_fcs=None, svy_from=None, min_area=None, cache_name=None, shoreline=None):
+    """
+    Presence and coverage category for every year of a multi-year kelp feature class in a single pass.
+    Replaces SplitByAttributes + one calc_presence/calc_cov_cat join per T<year> fc: the unsplit fc is read once,
+    queried once against the cov cat segments and the hits are grouped by year (see result_frames).
+    * **kelp_fc**: kelp feature class with all years
+    * **year_field**: name of the year attribute
+    * **containers**: containers for presence (clipped to each year's survey area if svy_fcs or svy_from is given)
+    * **cov_cat_containers**: feature class with the subdivided containers
+    * **source_name**: string to be used as source name in table
+    * **svy_fcs**: optional dict of {year: survey boundary fc}. Years with kelp but no survey boundary are skipped with a
+    warning
+    * **svy_from**: optional survey boundary fc with no year attribute. Each year's survey area is made of the features that
+    year's kelp touches (same as a 1:m SpatialJoin of boundaries to kelp split by year)
+    * **min_area**: optional, kelp features with a smaller area (map units) are dropped AFTER the survey areas are found,
+    eg. the small absence polygons that mark a surveyed site with no kelp
+    * **cache_name**: optional name for the per year result cache, see calc_presence
+    * **shoreline**: optional linref.Shoreline, see calc_results
+    * returns one SITE_CODE/year/source/presence/coverage_cat dataframe, year as str (same as calc_results)
+    """
+    print(f"Loading containers: {containers}")
+    cont = cache.load_layer(containers)
+    cc, cc_tree = cache.load_tree(cov_cat_containers)
+    weights = load_cov_cat_weights(cov_cat_containers)
+
+    print(f"Reading {kelp_fc}...")
+    kelp = match_crs(read_fc(kelp_fc), cont.crs, fc_name(kelp_fc))
+    kelp_geoms, keep = valid_geoms(kelp)
+    keep &= kelp[year_field].notna().to_numpy()
+    kelp_geoms = kelp_geoms[keep]
+
+    # years as strings, the same way SplitByAttributes names its outputs
+    year_vals = kelp.loc[keep, year_field]
+    if pd.api.types.is_numeric_dtype(year_vals):
+        year_vals = year_vals.astype(int)
+    kelp_owner, years = pd.factorize(year_vals.astype(str), sort=True)
+    names = [f"T{y}" for y in years]
+    print(f"Years in dataset: {list(years)}")
+
+    # survey area for each year
+    svy_geoms = None
+    if svy_fcs is not None:
+        svy_fcs = {str(y): fc for y, fc in svy_fcs.items()}
+        missing = [y for y in years if y not in svy_fcs]
+        if missing:
+            print(f"WARNING: no survey boundary for years {missing}, skipping them")
+            instrument.count(years_skipped=missing)
+            kept = np.flatnonzero(~years.isin(missing))
+            group = np.full(len(years), -1)
+            group[kept] = np.arange(len(kept))
+            has_svy = group[kelp_owner] >= 0
+            kelp_geoms, kelp_owner = kelp_geoms[has_svy], group[kelp_owner[has_svy]]
+            years = years[kept]
+            names = [names[i] for i in kept]
+        svy_by_fc = {fc: read_svy(fc, cont.crs) for fc in dict.fromkeys(svy_fcs.values())}
+        svy_geoms = [svy_by_fc[svy_fcs[y]] for y in years]
+    elif svy_from is not None:
+        bnd = match_crs(read_fc(svy_from), cont.crs, fc_name(svy_from))
+        bnd_geoms, _ = valid_geoms(bnd)
+        k_idx, b_idx = shapely.STRtree(bnd_geoms).query(kelp_geoms, predicate="intersects")
+        svy_geoms = [shapely.union_all(bnd_geoms[np.unique(b_idx[kelp_owner[k_idx] == i])]) for i in range(len(years))]
+
+    # drop absence polygons
+    if min_area is not None:
+        big = shapely.area(kelp_geoms) >= min_area
+        print(f"Dropping {np.sum(~big)} features with area < {min_area}")
+        kelp_geoms = kelp_geoms[big]
+        kelp_owner = kelp_owner[big]
+
+    ref_key = f"{cache.source_key(containers)}|{cache.source_key(cov_cat_containers)}" if cache_name is not None else None
+    if ref_key is not None and shoreline is not None:
+        ref_key = f"{ref_key}|linear|{shoreline.key}"
+    results = pd.concat(result_frames(cont, cc_tree, weights, kelp_geoms, kelp_owner, names, source_name,
+                                      svy_geoms, cache_name, ref_key, shoreline), ignore_index=True)
+    print("Result preview:")
+    print(results.head())
+
+    return results
+
+
+# area/length weighted summaries ----------------------------------------------------------------------
+# for choices that depend on how much kelp is in a container rather than whether it touches it (eg. ShoreZone's year),
+# without writing a PairwiseIntersect fc: one STRtree query, vectorized intersection sizes, segmented reductions
+def overlap_pairs(tree, tree_geoms, geoms, distance=None):
+    """
+    Candidate (kelp, container) pairs from one bulk STRtree query and the size of their overlap
+    * **tree**, **tree_geoms**: STRtree of the containers and its geometries (see cache.load_tree)
+    * **geoms**: kelp geometries
+    * **distance**: optional buffer distance (map units), the kelp is buffered by it (round ends) before it is
+    intersected, like arcpy Buffer + PairwiseIntersect
+    * returns (kelp index, container index, overlap) arrays. Overlap is the intersection area for polygon (or buffered)
+    kelp and the intersection length for line kelp
+    """
+    if distance is not None:
+        geoms = shapely.buffer(geoms, distance)
+    g_idx, t_idx = tree.query(geoms, predicate="intersects")
+    pieces = shapely.intersection(geoms[g_idx], tree_geoms[t_idx])
+    polygonal = shapely.get_dimensions(geoms[g_idx]) == 2
+    overlap = np.where(polygonal, shapely.area(pieces), shapely.length(pieces))
+    return g_idx, t_idx, overlap
+
+
+def argmax_by_site(site, group, weight):
+    """
+    Group with the largest total weight in each site, a segmented reduction over the (site, group) totals of the pairs
+    * **site**, **group**: integer codes (>= 0) of the site and group (eg. year) of each pair
+    * **weight**: weight of each pair, eg. the overlap from overlap_pairs
+    * returns (site codes, winning group codes) for every site with pairs. Ties go to the lowest group code, like
+    groupby + idxmax
+    """
+    if len(site) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    n_groups = int(group.max()) + 1
+    keys, inv = np.unique(site * n_groups + group, return_inverse=True)
+    total = np.bincount(inv, weights=weight, minlength=len(keys))
+
+    k_site, k_group = keys // n_groups, keys % n_groups
+    order = np.lexsort((k_group, -total, k_site))
+    _, first = np.unique(k_site[order], return_index=True)
+    return k_site[order][first], k_group[order][first]
+
+
+def year_by_overlap(cont, tree, geoms, year, distance=None):
+    """
+    Year with the most kelp (area for polygons, length for lines) in each site's containers, the in memory version of
+    PairwiseIntersect + groupby(SITE_CODE, year) area sum + idxmax
+    * **cont**, **tree**: containers GeoDataFrame and its STRtree
+    * **geoms**: kelp geometries
+    * **year**: year of each kelp geometry, NaN ones are left out
+    * **distance**: optional buffer distance, see overlap_pairs. Kelp within the distance of a container but not in it
+    counts with the area of its buffer inside the container
+    * returns a SITE_CODE/year dataframe, one row per site with kelp overlapping it (touching only does not count).
+    Ties go to the earliest year
+    """
+    has_year = pd.notna(year)
+    geoms, year = geoms[has_year], year[has_year]
+    cont_geoms = np.asarray(cont.geometry.values, dtype=object)
+    g_idx, c_idx, overlap = overlap_pairs(tree, cont_geoms, geoms, distance)
+
+    site_codes, sites = pd.factorize(cont["SITE_CODE"], sort=True)
+    year_codes, years = pd.factorize(year, sort=True)
+    ok = (site_codes[c_idx] >= 0) & (overlap > 0)
+    best_site, best_year = argmax_by_site(site_codes[c_idx][ok], year_codes[g_idx][ok], overlap[ok])
+    return pd.DataFrame({
+        "SITE_CODE": np.asarray(sites)[best_site],
+        "year": np.asarray(years)[best_year],
+    })
+
+
+# line sources ------------------------------------------------------------------------------------
+# kelp mapped as lines along the shore (ShoreZone). Presence and cov cat match the lines to the containers/segments within
+# a distance tolerance, the same answer as buffering them into polygons first but without the buffer or
+# RemoveOverlapMultiple. The year needs the buffered area, so only that step buffers the lines (in memory)
+@instrument.stage("calc_lines")
+def calc_lines(lines, year_field, presence_field, containers, cov_cat_containers, source_name, tolerance):
+    """
+    Presence, coverage category and year per site for a line kelp source, in one pass
+    * **lines**: GeoDataFrame of kelp lines, presence AND absence lines (see fns.read_fields with geometry=True)
+    * **year_field**: year attribute of the lines
+    * **presence_field**: 1 for kelp lines, 0 for absence lines
+    * **containers**: containers for presence
+    * **cov_cat_containers**: feature class with the subdivided containers
+    * **source_name**: string to be used as source name in table
+    * **tolerance**: distance (map units) lines reach out from, eg. 10 for what a 10 m buffer used to cover
+    * returns one SITE_CODE/coverage_cat/presence/year/source dataframe, one row per container with a line within the
+    tolerance. Each site's year is the year with the most buffered line area (tolerance, round ends) inside the
+    container, like the Buffer + PairwiseIntersect it replaces (see year_by_overlap). Unlike RemoveOverlapMultiple,
+    where buffers of two lines overlap the overlap counts for both lines instead of being split along the centre line,
+    which only matters when two years have close totals. Presence and cov cat use the kelp lines of all years
+    """
+    print(f"Loading containers: {containers}")
+    cont, cont_tree = cache.load_tree(containers)
+    cc, cc_tree = cache.load_tree(cov_cat_containers)
+    weights = load_cov_cat_weights(cov_cat_containers)
+
+    lines = match_crs(lines, cont.crs, source_name)
+    geoms, keep = valid_geoms(lines)
+    geoms = geoms[keep]
+    year = lines[year_field].to_numpy()[keep]
+    present = lines[presence_field].to_numpy()[keep] == 1
+    print(f"{len(geoms)} lines, {np.sum(present)} with kelp")
+
+    # year: the year with the most buffered area in each site, presence and absence lines
+    site_year = year_by_overlap(cont, cont_tree, geoms, year, distance=tolerance)
+
+    # presence: any kelp line within the tolerance of the container
+    owner = np.zeros(np.sum(present), dtype=np.int64)
+    presence = pd.DataFrame({
+        "SITE_CODE": cont["SITE_CODE"].values,
+        "presence": hit_matrix(cont_tree, geoms[present], owner, 1, distance=tolerance)[0].astype(int),
+    })
+
+    # coverage category: kelp lines within the tolerance of each segment
+    seg_hits = hit_matrix(cc_tree, geoms[present], owner, 1, distance=tolerance)
+    cov_cat = pd.DataFrame({
+        "SITE_CODE": cov_cat_sites(weights),
+        "coverage_cat": pd.Categorical(cov_cat_from_hits(seg_hits, weights)[0], categories=[0, 1, 2, 3, 4]),
+    })
+
+    result = pd.merge(presence, cov_cat, how="left", on="SITE_CODE")
+    result = pd.merge(result, site_year, how="inner", on="SITE_CODE")
+    result["source"] = source_name
+    instrument.count(n_in=len(geoms), n_out=len(result))
+    print("Result preview:")
+    print(result.head())
+
+    return result[["SITE_CODE", "coverage_cat", "presence", "year", "source"]]
@@ -0,0 +1,239 @@
+# run instrumentation
+# Records wall time, CPU time, memory and feature counts for the steps of a run to a JSON-lines run log, so we can see
+# where the time goes (eg. which arcpy tool dominates a source) instead of reading timestamps off the console.
+#   stage: context manager / decorator around a function or tool call
+#       with instrument.stage("RemoveOverlapMultiple", n_in=n): ...
+#       @instrument.stage("calc_presence")
+#   section: marks the start of a script section (prep, presence, export...), runs until the next section or exit,
+#       so the linearize scripts don't need re-indenting
+#   count: adds feature counts/years to the stage that is running, from inside the function
+# The log goes to KELP_RUN_LOG (pipeline.py sets one per source, in pipeline_logs/) or pipeline_logs/run_log.jsonl.
+# KELP_SOURCE names the data source, pipeline.py sets it to the script name.
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUN_LOG = os.path.join(PROJECT_ROOT, "pipeline_logs", "run_log.jsonl")
+
+_local = threading.local()
+_lock = threading.Lock()
+_section = {}
+
+
+def run_log():
+    return os.environ.get("KELP_RUN_LOG", DEFAULT_RUN_LOG)
+
+
+def default_source():
+    return os.environ.get("KELP_SOURCE", os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@functools.lru_cache(maxsize=None)
+def _psutil_process(pid):
+    """
+    psutil handle of this process, imported the first time memory is sampled (keyed on the pid, so a forked worker
+    does not sample its parent)
+    """
+    import psutil
+    return psutil.Process(pid)
+
+
+def _process():
+    return _psutil_process(os.getpid())
+
+
+def rss_mb():
+    return _process().memory_info().rss / 1e6
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process so far (MB)
+    """
+    info = _process().memory_info()
+    if hasattr(info, "peak_wset"):  # windows
+        return info.peak_wset / 1e6
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / 1e6  # linux reports KiB
+    except ImportError:
+        return info.rss / 1e6
+
+
+def write_record(record):
+    path = run_log()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    line = json.dumps(record, default=str)
+    with _lock, open(path, "a") as f:
+        f.write(line + "\n")
+
+
+class stage:
+    """
+    Times a step and writes it to the run log. Works as a context manager or a decorator
+    * **name**: step name (function or tool name)
+    * **source**: data source, defaults to the enclosing stage's source or KELP_SOURCE
+    * **year**: optional survey year
+    * any other keyword (n_in, n_out, ...) is stored in the record
+    """
+
+    def __init__(self, name, source=None, year=None, **fields):
+        self.name = name
+        self.source = source
+        self.year = year
+        self.fields = fields
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(self.name, self.source, self.year, **self.fields):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        self.record = {
+            "stage": self.name,
+            "source": self.source or (parent["source"] if parent else default_source()),
+            "year": self.year,
+            "section": _section.get("name"),
+            "parent": parent["stage"] if parent else None,
+            "depth": len(stack),
+            **self.fields,
+        }
+        stack.append(self.record)
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        _stack().pop()
+        self.record.update({
+            "wall_s": round(time.perf_counter() - self.t0, 4),
+            "cpu_s": round(time.process_time() - self.cpu0, 4),
+            "rss_mb": round(rss_mb(), 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "status": "ok" if exc_type is None else f"error: {exc_type.__name__}",
+            "pid": os.getpid(),
+            "finished": datetime.now().isoformat(),
+        })
+        write_record(self.record)
+        return False
+
+
+def count(**fields):
+    """
+    Adds fields (n_in, n_out, years...) to the innermost running stage, eg. instrument.count(n_in=len(kelp_geoms))
+    """
+    stack = _stack()
+    if stack:
+        stack[-1].update(fields)
+
+
+def section(name, source=None):
+    """
+    Starts a new script section, ending the previous one. The last section ends when the script exits
+    * **name**: section name, eg. "prep", "presence", "export"
+    * **source**: data source, defaults to KELP_SOURCE
+    """
+    if "started" not in _section:
+        # time from process start to the first section: interpreter start up and imports (arcpy, arcgis...)
+        _section["started"] = True
+        write_record({
+            "stage": "startup",
+            "source": source or default_source(),
+            "year": None,
+            "section": None,
+            "parent": None,
+            "depth": 0,
+            "kind": "section",
+            "wall_s": round(time.time() - _process().create_time(), 4),
+            "cpu_s": round(time.process_time(), 4),
+            "rss_mb": round(rss_mb(), 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "status": "ok",
+            "pid": os.getpid(),
+            "finished": datetime.now().isoformat(),
+        })
+    end_section()
+    _section["name"] = name
+    _section["stage"] = stage(name, source, kind="section")
+    _section["stage"].__enter__()
+
+
+def skip_startup():
+    """
+    Leaves out the startup record, for processes that run several sources and time their own start up (see runner.py)
+    """
+    _section["started"] = True
+
+
+def end_section():
+    """
+    Ends the running section, if any (called automatically at exit)
+    """
+    if "stage" in _section:
+        current = _section.pop("stage")
+        current.__exit__(None, None, None)
+        _section.pop("name", None)
+
+
+atexit.register(end_section)
+
+
+# reading the log ---------------------------------------------------------------------------------------------
+def read_log(paths):
+    """
+    Reads one or more run logs to a list of records
+    """
+    records = []
+    for path in paths:
+        if os.path.exists(path):
+            with open(path) as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def summary(records):
+    """
+    Prints a per source table: wall/CPU time, peak memory, and the slowest section and step with their share of the time
+    * **records**: run log records (see read_log)
+    """
+    by_source = {}
+    for r in records:
+        by_source.setdefault(r["source"], []).append(r)
+
+    print(f"{'source':<28}{'wall s':>9}{'cpu s':>9}{'peak MB':>9}  {'slowest section':<28}{'slowest step'}")
+    for source, recs in sorted(by_source.items(), key=lambda x: -sum(r["wall_s"] for r in x[1] if r["depth"] == 0)):
+        top = [r for r in recs if r["depth"] == 0]
+        wall = sum(r["wall_s"] for r in top)
+        cpu = sum(r["cpu_s"] for r in top)
+        peak = max(r["peak_rss_mb"] for r in recs)
+        sections = [r for r in top if r.get("kind") == "section"]
+
+        # innermost steps (tools, not the functions that call them), summed by name: eg. every year's Clip together
+        parents = {r["parent"] for r in recs}
+        step_time = {}
+        for r in recs:
+            if r.get("kind") != "section" and r["stage"] not in parents:
+                step_time[r["stage"]] = step_time.get(r["stage"], 0) + r["wall_s"]
+
+        def share(name, t):
+            return f"{name} ({100 * t / wall:.0f}%)" if wall else name
+
+        slow_section = share(*max(((r["stage"], r["wall_s"]) for r in sections), key=lambda x: x[1])) if sections else "-"
+        slow_step = share(*max(step_time.items(), key=lambda x: x[1])) if step_time else "-"
+        print(f"{str(source):<28}{wall:>9.1f}{cpu:>9.1f}{peak:>9.0f}  {slow_section:<28}{slow_step}")
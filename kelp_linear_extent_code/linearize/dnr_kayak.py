@@ -9,14 +9,14 @@
 
 # This dataset is a little funky in that there are small 'absence' polygons at sites where there was an annual survey to confirm there was no kelp 
 # Different sites surveyed each year --> if there is no absence polygon, it wasn't surveyed
-# Note --> check to make sure that the annual survey boundary features T2013-T2024 were successfully deleted from the kayak.gdb before running 
+# Each year's survey area = the site boundaries touched by that year's kelp/absence polygons, found in memory by fns.calc_by_year
+# (older versions of this script split T2013-T2025 boundary fcs into the kayak.gdb, those can be deleted)
 
 # set environment -------------------------------------------------------
 
 import sys
 import os
 import arcpy
-import pandas as pd
 from arcgis.features import GeoAccessor, GeoSeriesAccessor # noqa: F401 # these are used to create sedfs
 
 # project root is the folder within which the entire kelp_linear_extent module is located (2 levels up from this file)
@@ -26,117 +26,45 @@ print(PROJECT_ROOT)
 sys.path.append(PROJECT_ROOT) # this lets the project function library be found as a module
 
 import kelp_linear_extent_code.fns as fns # noqa: E402 # project function library
+import kelp_linear_extent_code.instrument as instrument # noqa: E402 # run log, see instrument.py
+import kelp_linear_extent_code.runner as runner # noqa: E402 # source context, see runner.py
 
 arcpy.env.overwriteOutput = True # overwrite outputs 
 
-# set workspace to parent folder
-fns.reset_ws()
-
-# set up scratch workspace
-SCRATCH_WS = fns.config_scratch()
-
-# USER INPUT -----------------------------------------------------------
-
-dataset_name = "WADNR_Kayak" # this will be appended to data records 
-containers = os.path.join(PROJECT_ROOT, "LinearExtent.gdb\\lines_and_containers\\kelp_containers_v3")
-cov_cat_containers = os.path.join(PROJECT_ROOT, "LinearExtent.gdb\\lines_and_containers\\cov_cat_containers")
-kelp_data_path = os.path.join(PROJECT_ROOT, "kelp_data_sources\\DNR_bull_kelp_kayak_2025.gdb") 
-
-# prep data ------------------------------------------------------------
-fc = os.path.join(kelp_data_path, "bed_perimeter_surveys_2013_2025_aggregates")
-
-print(f"Using {containers} as container features")
-print(f"Dataset to be linearized: {fc}")
-
-# split kelp beds by year
-arcpy.analysis.SplitByAttributes(fc, SCRATCH_WS, ['year_'])
-arcpy.env.workspace = SCRATCH_WS
-split_fcs = arcpy.ListFeatureClasses("T*")
-print("Kayak data split into one feature class per year:")
-for f in split_fcs: 
-    print(f)
-fns.reset_ws()
-
-# append file path
-split_fcs = [os.path.join(SCRATCH_WS, f"{fc}") for fc in split_fcs]
-
-# copy kayak site boundaries to scratch (all in one feature class, no year attribute)
-site_bnd_orig = f"{kelp_data_path}\\site_boundaries_2025_SPS_all"
-site_bnd = os.path.join(SCRATCH_WS, "site_bnd")
-arcpy.management.CopyFeatures(site_bnd_orig, site_bnd)
-
-# spatial join kelp beds (1:m) - small absence polygons denote absence surveys
-print("Joining kelp beds to boundaries to get year...")
-site_bnd_join = os.path.join(SCRATCH_WS, "site_bnd_join")
-arcpy.analysis.SpatialJoin(site_bnd, fc, site_bnd_join, "JOIN_ONE_TO_MANY")
-print(arcpy.GetMessages())
-
-# split by year, writing into data source gdb to avoid naming confusions since name is T* for split ops
-# first clear out split fcs in case these already exist
-arcpy.env.workspace = kelp_data_path
-site_bnd_old = arcpy.ListFeatureClasses("T*")
-for fc in site_bnd_old: 
-    print(f"Deleting old site boundary: {fc}")
-    arcpy.management.Delete(fc)
-fns.reset_ws()
-
-arcpy.analysis.SplitByAttributes(site_bnd_join, kelp_data_path, ['year_'])
-arcpy.env.workspace = kelp_data_path
-site_bnd_split = arcpy.ListFeatureClasses("T*")
-site_bnd_split = [f"{kelp_data_path}\\{fc}" for fc in site_bnd_split]
-fns.reset_ws()
-
-# delete absence polygons (where Shape_Area < VALUE)
-for fc in split_fcs: 
-    with arcpy.da.UpdateCursor(fc, ["SHAPE@", "Shape_Area"]) as cursor:
-        for row in cursor:
-            # Check if Shape_Area is less than 3.6
-            if row[1] < 3.6:
-                # Delete the feature
-                cursor.deleteRow()
-                print(f"Deleted feature with area {row[1]} in {fc}")
-
-# compile results to list
-fc_list = list(zip(split_fcs, site_bnd_split))
-print("Data to be analyzed: ")
-for kelp, svy in fc_list:
-    print(f"Kelp data: {kelp}")
-    print(f"Survey boundary: {svy}")
-
-# calculate presence ---------------------------------------
-print("Calculating presence...")
-pres_fcs = fns.calc_presence(fc_list, containers, variable_survey_area=True)
-print(f"Out fcs: {pres_fcs}")
-
-# convert to dfs
-print("Converting to sdfs...")
-sdf_list = fns.df_from_fc(pres_fcs, dataset_name)
-
-print("This is the structure of the sdfs:")
-print(sdf_list[1].head())
-
-# merge to one df
-print("Combining to one dataframe")
-presence = pd.concat(sdf_list)
-
-# calculate coverage category  --------------------------------------
-print("Calculating coverage category...")
-cov_cat = fns.calc_cov_cat(cov_cat_containers, split_fcs)
-
-# add the year col
-cov_cat['year'] = cov_cat['fc_name'].str[-4:]
-cov_cat = cov_cat.drop(columns=['fc_name'])
-print("Coverage category data: ")
-print(cov_cat.head())
-
-# combine and export -----------------------------------------
-results = pd.merge(presence, cov_cat, how="left", on=["SITE_CODE", "year"])
-
-# Write to csv
-os.makedirs(f"{PROJECT_ROOT}\\kelp_data_linear_outputs", exist_ok=True)
-out_results = os.path.join(PROJECT_ROOT, f"kelp_data_linear_outputs\\{dataset_name}_result.csv")
-results.to_csv(out_results)
-print(f"Saved as csv here: {out_results}")
-
-fns.clear_scratch()
- 
\ No newline at end of file
+
+def run(context):
+    # set workspace to parent folder
+    fns.reset_ws()
+
+    # USER INPUT -----------------------------------------------------------
+
+    dataset_name = "WADNR_Kayak" # this will be appended to data records 
+    containers = context.containers
+    cov_cat_containers = context.cov_cat_containers
+    kelp_data_path = os.path.join(PROJECT_ROOT, "kelp_data_sources\\DNR_bull_kelp_kayak_2025.gdb") 
+
+    # prep data ------------------------------------------------------------
+    instrument.section("prep")
+    fc = os.path.join(kelp_data_path, "bed_perimeter_surveys_2013_2025_aggregates")
+
+    # kayak site boundaries (all in one feature class, no year attribute)
+    site_bnd = f"{kelp_data_path}\\site_boundaries_2025_SPS_all"
+
+    print(f"Using {containers} as container features")
+    print(f"Dataset to be linearized: {fc}")
+    print(f"Site boundaries: {site_bnd}")
+
+    # calculate presence and coverage category ---------------------------
+    instrument.section("presence_cov_cat")
+    # one pass over all years: survey area per year from the site boundaries, then absence polygons (Shape_Area < 3.6) are
+    # dropped before presence/cov cat. Only years that are new or edited since the last run are calculated
+    print("Calculating presence and coverage category...")
+    results = fns.calc_by_year(fc, "year_", containers, cov_cat_containers, dataset_name,
+                               svy_from=site_bnd, min_area=3.6, cache_name=dataset_name)
+
+    # Write results
+    fns.write_results(results, dataset_name)
+
+
+if __name__ == "__main__":
+    run(runner.Context(os.path.splitext(os.path.basename(__file__))[0]))
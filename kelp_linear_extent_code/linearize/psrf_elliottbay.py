@@ -12,7 +12,6 @@
 import sys
 import os
 import arcpy
-import pandas as pd
 from arcgis.features import GeoAccessor, GeoSeriesAccessor # noqa: F401 # these are used to create sedfs
 
 # project root is the folder within which the entire kelp_linear_extent module is located (2 levels up from this file)
@@ -22,85 +21,62 @@ print(PROJECT_ROOT)
 sys.path.append(PROJECT_ROOT) # this lets the project function library be found as a module
 
 import kelp_linear_extent_code.fns as fns # noqa: E402 # project function library
+import kelp_linear_extent_code.instrument as instrument # noqa: E402 # run log, see instrument.py
+import kelp_linear_extent_code.runner as runner # noqa: E402 # source context, see runner.py
 
 arcpy.env.overwriteOutput = True # overwrite outputs 
 
-# set workspace to parent folder
-fns.reset_ws()
 
-# set up scratch workspace
-SCRATCH_WS = fns.config_scratch()
+def run(context):
+    # set workspace to parent folder
+    fns.reset_ws()
 
-# USER INPUT -----------------------------------------------------------
+    # USER INPUT -----------------------------------------------------------
 
-dataset_name = "PSRF_Elliott_Bay_Linear_Surveys"
-containers = os.path.join(PROJECT_ROOT, "LinearExtent.gdb\\lines_and_containers\\kelp_containers_v3")
-cov_cat_containers = os.path.join(PROJECT_ROOT, "LinearExtent.gdb\\lines_and_containers\\cov_cat_containers")
-kelp_data_path = os.path.join(PROJECT_ROOT, "kelp_data_sources\\PSRF_BulbCount_datashare.gdb") 
+    dataset_name = "PSRF_Elliott_Bay_Linear_Surveys"
+    containers = context.containers
+    cov_cat_containers = context.cov_cat_containers
+    kelp_data_path = os.path.join(PROJECT_ROOT, "kelp_data_sources\\PSRF_BulbCount_datashare.gdb") 
 
-# prep data -------------------------------------------------------------
-print(f"Using {containers} as container features")
+    # prep data -------------------------------------------------------------
+    instrument.section("prep")
+    print(f"Using {containers} as container features")
 
 
-# get list of kelp fcs
-arcpy.env.workspace = kelp_data_path
-kelp_fcs = arcpy.ListFeatureClasses("POSKelp*")
-for fc in kelp_fcs: 
-    print(fc)
-kelp_fcs = [os.path.join(kelp_data_path, fc) for fc in kelp_fcs]
+    # get list of kelp fcs
+    arcpy.env.workspace = kelp_data_path
+    kelp_fcs = arcpy.ListFeatureClasses("POSKelp*")
+    for fc in kelp_fcs: 
+        print(fc)
+    kelp_fcs = [os.path.join(kelp_data_path, fc) for fc in kelp_fcs]
 
-# get list of survey boundaries
-svy_bnd_fcs = arcpy.ListFeatureClasses("survey*")
-for fc in svy_bnd_fcs:
-    print(fc)
-svy_bnd_fcs = [os.path.join(kelp_data_path, fc) for fc in svy_bnd_fcs]
+    # get list of survey boundaries
+    svy_bnd_fcs = arcpy.ListFeatureClasses("survey*")
+    for fc in svy_bnd_fcs:
+        print(fc)
+    svy_bnd_fcs = [os.path.join(kelp_data_path, fc) for fc in svy_bnd_fcs]
 
-# create paired list of kelp fcs and svy bnds
-fc_list = [(kelp_fcs[0], svy_bnd_fcs[0]),
-           (kelp_fcs[1], svy_bnd_fcs[1]),
-           (kelp_fcs[2], svy_bnd_fcs[1]),
-           (kelp_fcs[3], svy_bnd_fcs[1]),
-           (kelp_fcs[4], svy_bnd_fcs[1])] 
+    # create paired list of kelp fcs and svy bnds
+    fc_list = [(kelp_fcs[0], svy_bnd_fcs[0]),
+               (kelp_fcs[1], svy_bnd_fcs[1]),
+               (kelp_fcs[2], svy_bnd_fcs[1]),
+               (kelp_fcs[3], svy_bnd_fcs[1]),
+               (kelp_fcs[4], svy_bnd_fcs[1])] 
 
-print("Input datasets to be linearized:")
-for kelp, svy in fc_list:
-    print(f"Kelp data: {kelp}")   
-    print(f"Survey boundary: {svy}")     
+    print("Input datasets to be linearized:")
+    for kelp, svy in fc_list:
+        print(f"Kelp data: {kelp}")   
+        print(f"Survey boundary: {svy}")     
 
-# calculate presence ---------------------------------------------------
+    # calculate presence and coverage category -----------------------------
+    instrument.section("presence_cov_cat")
 
-print("Calculating presence...")
-pres_fcs = fns.calc_presence(fc_list, containers, variable_survey_area=True)
+    print("Calculating presence and coverage category...")
+    results = fns.calc_results(fc_list, containers, cov_cat_containers, dataset_name, variable_survey_area=True)
 
-# convert to sdfs
-print("Converting results to data frames...")
-sdf_list = fns.df_from_fc(pres_fcs, dataset_name)
+    # Write results
+    fns.write_results(results, dataset_name)
 
-print("This is the structure of the sdfs:")
-print(sdf_list[1].head())
 
-# merge results to one df 
-presence = pd.concat(sdf_list)
-print("Presence data merged to one df")
-print(presence.head())
-
-# calculate coverage category ------------------------------------------
-
-print("Calculating coverage category...")
-cov_cat = fns.calc_cov_cat(cov_cat_containers, kelp_fcs)
-
-cov_cat['year'] = cov_cat['fc_name'].str[-4:]
-cov_cat = cov_cat.drop(columns=['fc_name'])
-print("Compiled coverage category results:")
-print(cov_cat.head())
-
-# combine and export --------------------------------------------------
-results = pd.merge(presence, cov_cat, how="left", on=["SITE_CODE", "year"])
-
-# Write to csv
-os.makedirs(f"{PROJECT_ROOT}\\kelp_data_linear_outputs", exist_ok=True)
-out_results = os.path.join(PROJECT_ROOT, f"kelp_data_linear_outputs\\{dataset_name}_result.csv")
-results.to_csv(out_results)
-print(f"Saved as csv here: {out_results}")
-
-fns.clear_scratch()
\ No newline at end of file
+if __name__ == "__main__":
+    run(runner.Context(os.path.splitext(os.path.basename(__file__))[0]))
@@ -7,56 +7,66 @@
 
 # set up env ----------------------------------------
 
+import sys
 import os
-import pandas as pd
-from arcgis import GeoAccessor, GeoSeriesAccessor # noqa: F401
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 print("Project working directory:")
 print(PROJECT_ROOT)
+sys.path.append(PROJECT_ROOT) # this lets the project function library be found as a module
 
-# USER INPUTS --------------------------------------------
+import kelp_linear_extent_code.cache as cache # noqa: E402 # reference layer cache
+import kelp_linear_extent_code.result_io as result_io # noqa: E402 # result table schema
+import kelp_linear_extent_code.instrument as instrument # noqa: E402 # run log, see instrument.py
+import kelp_linear_extent_code.runner as runner # noqa: E402 # source context, see runner.py
 
-dataset_name = "Berry_et_al_2021"
-kelp_obs = os.path.join(PROJECT_ROOT, "kelp_data_sources\\bull_kelp_sps_1878_2017.gdb\\kelp_all_obs")
-kelp_df = pd.DataFrame.spatial.from_table(kelp_obs)
 
-lines_fc = os.path.join(PROJECT_ROOT, "LinearExtent.gdb\\lines_and_containers\\all_lines_clean_v3")
-lines_df = pd.DataFrame.spatial.from_featureclass(lines_fc)
+def run(context):
+    # USER INPUTS --------------------------------------------
 
-print("")
-print(kelp_df.head())
+    dataset_name = "Berry_et_al_2021"
+    kelp_obs = os.path.join(PROJECT_ROOT, "kelp_data_sources\\bull_kelp_sps_1878_2017.gdb\\kelp_all_obs")
+    kelp_df = cache.read_table(kelp_obs, ["SITE_CODE", "kelp", "surveydate"]) # no arcpy/arcgis needed for this source
 
-# QAQC --------------------------------------------------
+    lines_fc = context.lines
+    lines_df = cache.load_columns(lines_fc, ["SITE_CODE"]) # only SITE_CODE from the cached lines, no geometry
 
-## compare site_codes to ensure no mismatches
-sps_codes = kelp_df['SITE_CODE'].unique()
-line_codes = kelp_df['SITE_CODE'].unique()
-diff_codes = list(set(sps_codes).difference(line_codes))
-print(f"Non-matching codes: {diff_codes}")
+    print("")
+    print(kelp_df.head())
 
-# reformat ---------------------------------------------
+    # QAQC --------------------------------------------------
+    instrument.section("qaqc")
 
-kelp_df["presence"] = kelp_df["kelp"].astype(int)
-kelp_df["year"] = kelp_df["surveydate"].astype(int)
-kelp_df["source"] = dataset_name
+    ## compare site_codes to ensure no mismatches
+    sps_codes = kelp_df['SITE_CODE'].unique()
+    line_codes = lines_df['SITE_CODE'].unique()
+    diff_codes = list(set(sps_codes).difference(line_codes))
+    print(f"Non-matching codes: {diff_codes}")
 
-out_table = kelp_df[['SITE_CODE', 'source', 'year', 'presence']]
-print("Reformatted table:")
-print(out_table.head())
+    # reformat ---------------------------------------------
+    instrument.section("reformat")
 
-# drop 2017 records, since we are using those directly --
-# (they are the same as WADNR_sps_boat...)
+    kelp_df["presence"] = kelp_df["kelp"].astype(int)
+    kelp_df["year"] = kelp_df["surveydate"].astype(int)
+    kelp_df["source"] = dataset_name
 
-print('Years of data available: ')
-print(out_table["year"].unique())
-print('Removing 2017...')
-out_table = out_table[out_table["year"] != 2017]
-print(out_table["year"].unique())
+    out_table = kelp_df[['SITE_CODE', 'source', 'year', 'presence']]
+    print("Reformatted table:")
+    print(out_table.head())
 
-# write out ---------------------------------------------
-os.makedirs(f"{PROJECT_ROOT}\\kelp_data_linear_outputs", exist_ok=True)
-out_results = os.path.join(PROJECT_ROOT, f"kelp_data_linear_outputs\\{dataset_name}_result.csv")
-out_table.to_csv(out_results)
-print(f"Saved as csv here: {out_results}")
- 
+    # drop 2017 records, since we are using those directly --
+    # (they are the same as WADNR_sps_boat...)
+
+    print('Years of data available: ')
+    print(out_table["year"].unique())
+    print('Removing 2017...')
+    out_table = out_table[out_table["year"] != 2017]
+    print(out_table["year"].unique())
+
+    # write out ---------------------------------------------
+    instrument.section("export")
+    result_io.write_results(out_table, dataset_name)
+
+
+if __name__ == "__main__":
+    run(runner.Context(os.path.splitext(os.path.basename(__file__))[0]))
@@ -10,7 +10,6 @@
 import sys
 import os
 import arcpy
-import pandas as pd
 from arcgis.features import GeoAccessor, GeoSeriesAccessor # noqa: F401 # these are used to create sedfs
 
 # project root is the folder within which the entire kelp_linear_extent module is located (2 levels up from this file)
@@ -20,102 +19,85 @@ print(PROJECT_ROOT)
 sys.path.append(PROJECT_ROOT) # this lets the project function library be found as a module
 
 import kelp_linear_extent_code.fns as fns # noqa: E402 # project function library
+import kelp_linear_extent_code.instrument as instrument # noqa: E402 # run log, see instrument.py
+import kelp_linear_extent_code.runner as runner # noqa: E402 # source context, see runner.py
 
 arcpy.env.overwriteOutput = True # overwrite outputs 
 
-# set workspace to parent folder
-fns.reset_ws()
 
-# set up scratch workspace
-SCRATCH_WS = fns.config_scratch()
+def run(context):
+    # set workspace to parent folder
+    fns.reset_ws()
 
-# USER INPUT -----------------------------------------------------------
+    # set up scratch workspace
+    SCRATCH_WS = fns.config_scratch()
 
-dataset_name = "VashonNatureCenter_Kayak"
-years = ["2023", "2024", "2025"] # list years for which data is currently available
-kelp_data_path =  os.path.join(PROJECT_ROOT, "kelp_data_sources\\VNC\\VNC.gdb")
-containers = os.path.join(PROJECT_ROOT, "LinearExtent.gdb\\lines_and_containers\\kelp_containers_v3")
-cov_cat_containers = os.path.join(PROJECT_ROOT, "LinearExtent.gdb\\lines_and_containers\\cov_cat_containers")
+    # USER INPUT -----------------------------------------------------------
 
-# prep data ------------------------------------------------------------
+    dataset_name = "VashonNatureCenter_Kayak"
+    years = ["2023", "2024", "2025"] # list years for which data is currently available
+    kelp_data_path =  os.path.join(PROJECT_ROOT, "kelp_data_sources\\VNC\\VNC.gdb")
+    containers = context.containers
+    cov_cat_containers = context.cov_cat_containers
 
-# merge kelp beds by year
-arcpy.env.workspace = kelp_data_path
-kelp_fc_names = arcpy.ListFeatureClasses()
-print("The following feature classes are available:")
-for fc in kelp_fc_names:
-    print(fc)
+    # prep data ------------------------------------------------------------
+    instrument.section("prep")
 
-kelp_fc_list = [f"{kelp_data_path}//{fc_name}" for fc_name in kelp_fc_names] # append parent path
+    # merge kelp beds by year
+    arcpy.env.workspace = kelp_data_path
+    kelp_fc_names = arcpy.ListFeatureClasses()
+    print("The following feature classes are available:")
+    for fc in kelp_fc_names:
+        print(fc)
 
-fns.reset_ws()
+    kelp_fc_list = [f"{kelp_data_path}//{fc_name}" for fc_name in kelp_fc_names] # append parent path
 
-merged_fc_list = []
+    fns.reset_ws()
 
-for year in years:
+    merged_fc_list = []
 
-    # merge
-    year_fcs = [fc for fc in kelp_fc_list if year in fc]
-    merged_fc = f"{SCRATCH_WS}//kelp_{year}_WGS84"
-    print(f"Merging {year_fcs} into {merged_fc}...")
-    arcpy.management.Merge(year_fcs, merged_fc)
+    for year in years:
 
-    # project to state plane s
-    desc = arcpy.Describe(containers)
-    spatialref = desc.spatialReference # grab sr from containers
-    print(f"Projecting {merged_fc} to {spatialref.name}")
-    merged_fc_sp = f"{SCRATCH_WS}//kelp_{year}"
-    arcpy.management.Project(merged_fc, merged_fc_sp, spatialref)
+        # merge
+        year_fcs = [fc for fc in kelp_fc_list if year in fc]
+        merged_fc = f"{SCRATCH_WS}//kelp_{year}_WGS84"
+        print(f"Merging {year_fcs} into {merged_fc}...")
+        arcpy.management.Merge(year_fcs, merged_fc)
 
-    merged_fc_list.append(merged_fc_sp)
+        # project to state plane s
+        desc = arcpy.Describe(containers)
+        spatialref = desc.spatialReference # grab sr from containers
+        print(f"Projecting {merged_fc} to {spatialref.name}")
+        merged_fc_sp = f"{SCRATCH_WS}//kelp_{year}"
+        arcpy.management.Project(merged_fc, merged_fc_sp, spatialref)
 
-    
-print("Merged feature classes:")
-for fc in merged_fc_list:
-    print(fc)
+        merged_fc_list.append(merged_fc_sp)
 
-# project 
 
+    print("Merged feature classes:")
+    for fc in merged_fc_list:
+        print(fc)
 
-# calculate presence ---------------------------------------------------
-print("Calculating presence....")
-pres_fcs = fns.calc_presence(merged_fc_list, containers)
-print(f"Out fcs: {pres_fcs}")
+    # project 
 
-fns.reset_ws()
 
-# convert to table
-print("Converting results to dataframes...")
-sdf_list = fns.df_from_fc(pres_fcs, dataset_name)
+    # calculate presence and coverage category -------------------------------------
+    instrument.section("presence_cov_cat")
+    print("Calculating presence and coverage category....")
+    # only years that are new or edited since the last run are calculated, the rest come from the per year result cache
+    results = fns.calc_results(merged_fc_list, containers, cov_cat_containers, dataset_name, cache_name=dataset_name)
+    print(f"Number of rows: {len(results)}")
+    # drop any rows where presence = 0 because we are treating this as presence-only
+    print("Dropping rows where presence = 0... treating data as presence only")
+    results = results[results["presence"] != 0]
+    print(f"Number of rows: {len(results)}")
 
-# compile to one df
-presence = pd.concat(sdf_list)
-print(f"Number of rows: {len(presence)}")
-# drop any rows where presence = 0 because we are treating this as presence-only
-print("Dropping rows where presence = 0... treating data as presence only")
-presence = presence[presence["presence"] != 0]
-print(f"Number of rows: {len(presence)}")
+    # Write results
+    fns.write_results(results, dataset_name)
 
-# calculate coverage category --------------------------------------------------
-print("Calculating coverage category...")
-cov_cat = fns.calc_cov_cat(cov_cat_containers, merged_fc_list)
+    # clear workspace
+    fns.clear_scratch()
 
-# add year col
-cov_cat["year"] = cov_cat["fc_name"].str[-4:]
-cov_cat = cov_cat.drop(columns=["fc_name"])
-print("Coverage category data: ")
-print(cov_cat.head())
 
-# compile and export --------------------------------------------------
-results = pd.merge(presence, cov_cat, how="left", on=["SITE_CODE", "year"])
-print("Compiled results:")
-print(results.head())
-
-# write to csv
-os.makedirs(f"{PROJECT_ROOT}\\kelp_data_linear_outputs", exist_ok=True)
-out_results = os.path.join(PROJECT_ROOT, f"kelp_data_linear_outputs\\{dataset_name}_result.csv")
-results.to_csv(out_results)
-print(f"Saved as csv here: {out_results}")
-
-# clear workspace
-fns.clear_scratch()
\ No newline at end of file
+if __name__ == "__main__":
+    run(runner.Context(os.path.splitext(os.path.basename(__file__))[0]))
@@ -0,0 +1,215 @@
+# linear referenced shoreline
+# The product is one line per SITE_CODE (all_lines_clean_v3), so presence and coverage category can be answered in 1-D
+# instead of with polygon joins:
+#   measures: the site lines are laid end to end on one shoreline axis (with a gap, so neighbouring sites never touch)
+#       and every cov cat segment becomes the [start, end] range of its site's line that it covers. Built once and
+#       stored in the reference cache, rebuilt when the lines or cov cat containers change
+#   kelp_intervals: each kelp polygon/line is cut by the containers it touches and each piece is projected onto that
+#       site's line, so a kelp layer becomes a set of measure intervals. This is the only 2-D step, once per kelp feature
+#   interval_hits: the intervals of every year are merged and swept against the segment ranges with a sort and a
+#       searchsorted, O(n log n) in the number of intervals
+# The segment hits are the same (n_groups, n_segments) matrix geo_fns.hit_matrix gives for the cov cat STRtree, so
+# geo_fns.result_frames rolls presence up and categorizes coverage from them unchanged
+# (calc_results/calc_by_year with shoreline=context.shoreline()).
+# Measures are projections onto the line: presence per site is the same as the polygon joins, but kelp that only touches
+# the far corner of a cov cat segment can be counted on the neighbouring segment instead.
+import numpy as np
+import pandas as pd
+import shapely
+from kelp_linear_extent_code import cache
+from kelp_linear_extent_code import instrument
+
+# space (map units) between sites on the shoreline axis, and between years when they are swept together
+GAP = 1.0
+
+# shorelines loaded in this process (see load_shoreline)
+_shorelines = {}
+
+
+# measures -------------------------------------------------------------------------------------------------
+def site_lines(lines):
+    """
+    One line per SITE_CODE, parts of the same site merged
+    * **lines**: GeoDataFrame of the shoreline lines (needs SITE_CODE)
+    * returns (sorted SITE_CODE array, line geometry array)
+    """
+    codes = lines["SITE_CODE"].to_numpy(dtype=object)
+    geoms = np.asarray(lines.geometry.values, dtype=object)
+    keep = pd.notna(codes) & ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    site_idx, sites = pd.factorize(codes[keep], sort=True)
+    geoms = geoms[keep]
+
+    out = np.empty(len(sites), dtype=object)
+    n_parts = np.bincount(site_idx, minlength=len(sites))
+    single = n_parts[site_idx] == 1
+    out[site_idx[single]] = geoms[single]
+    for i in np.flatnonzero(n_parts > 1):
+        out[i] = shapely.line_merge(shapely.union_all(geoms[site_idx == i]))
+    return np.asarray(sites, dtype=object), out
+
+
+def project_extent(geoms, lines):
+    """
+    Measure range of each geometry along a line: the min and max position of its vertices projected onto the line
+    * **geoms**: geometry array
+    * **lines**: line to project each geometry onto (same length as geoms)
+    * returns (start, end) arrays, NaN for empty geometries
+    """
+    start = np.full(len(geoms), np.nan)
+    end = np.full(len(geoms), np.nan)
+    coords, idx = shapely.get_coordinates(geoms, return_index=True)
+    if len(coords) == 0:
+        return start, end
+    m = shapely.line_locate_point(lines[idx], shapely.points(coords))
+    rows, first = np.unique(idx, return_index=True)  # idx is sorted, one run of vertices per geometry
+    start[rows] = np.minimum.reduceat(m, first)
+    end[rows] = np.maximum.reduceat(m, first)
+    return start, end
+
+
+def segment_measures(cov_cat, lines):
+    """
+    Builds the measure table of the cov cat segments
+    * **cov_cat**: GeoDataFrame of cov_cat_containers (needs SITE_CODE), in layer order
+    * **lines**: GeoDataFrame of the shoreline lines
+    * returns one row per segment, in layer order: SITE_CODE, start and end along the site's line (NaN if the site has no
+    line), and site_length
+    """
+    sites, site_geoms = site_lines(lines)
+    site_pos = pd.Index(sites).get_indexer(cov_cat["SITE_CODE"])
+    seg_geoms = np.asarray(cov_cat.geometry.values, dtype=object)
+    ok = (site_pos >= 0) & ~(shapely.is_missing(seg_geoms) | shapely.is_empty(seg_geoms))
+    line = site_geoms[site_pos[ok]]
+
+    # the part of the line inside the segment, or the segment's own vertices if it misses the line
+    piece = shapely.intersection(seg_geoms[ok], line)
+    piece = np.where(shapely.is_empty(piece), seg_geoms[ok], piece)
+    start = np.full(len(cov_cat), np.nan)
+    end = np.full(len(cov_cat), np.nan)
+    start[ok], end[ok] = project_extent(piece, line)
+
+    site_length = np.full(len(cov_cat), np.nan)
+    site_length[ok] = shapely.length(line)
+    if (~ok).any():
+        print(f"WARNING: {np.sum(~ok)} cov cat segments have no shoreline line, they are never hit by the linear engine")
+
+    return pd.DataFrame({
+        "SITE_CODE": cov_cat["SITE_CODE"].values,
+        "start": start,
+        "end": end,
+        "site_length": site_length,
+    })
+
+
+# shoreline ------------------------------------------------------------------------------------------------
+class Shoreline:
+    """
+    The linear referenced shoreline: site lines on one measure axis, cov cat segment ranges and the containers kelp is
+    cut by. Use load_shoreline, which builds it once per process
+    * **lines**, **containers**, **cov_cat_containers**: paths to the reference layers
+    """
+
+    def __init__(self, lines, containers, cov_cat_containers):
+        measures = cache.load_derived(cov_cat_containers, "measures",
+                                      lambda cc: segment_measures(cc, cache.load_layer(lines)), depends=[lines])
+        self.key = cache.derived_key(cov_cat_containers, [lines, containers])
+
+        # site offsets on the shoreline axis, sites in SITE_CODE order
+        sites, site_geoms = site_lines(cache.load_layer(lines))
+        length = shapely.length(site_geoms)
+        self.sites = sites
+        self.site_lines = site_geoms
+        self.site_offset = np.concatenate([[0.0], np.cumsum(length + GAP)[:-1]])
+        self.axis_length = float(np.sum(length + GAP))
+
+        # segment ranges on the axis, in cov cat layer order (NaN = never hit)
+        seg_site = pd.Index(sites).get_indexer(measures["SITE_CODE"])
+        offset = np.where(seg_site >= 0, self.site_offset[seg_site], np.nan)
+        self.seg_start = measures["start"].to_numpy() + offset
+        self.seg_end = measures["end"].to_numpy() + offset
+
+        # containers, for cutting the kelp into per site pieces
+        cont, self.cont_tree = cache.load_tree(containers)
+        self.cont_geoms = np.asarray(cont.geometry.values, dtype=object)
+        self.cont_site = pd.Index(sites).get_indexer(cont["SITE_CODE"])
+
+
+def load_shoreline(lines, containers, cov_cat_containers):
+    """
+    Returns the Shoreline for a set of reference layers, built once and kept for the rest of the process
+    """
+    key = (str(lines), str(containers), str(cov_cat_containers), cache.derived_key(cov_cat_containers, [lines, containers]))
+    if key not in _shorelines:
+        with instrument.stage("load_shoreline"):
+            _shorelines[key] = Shoreline(lines, containers, cov_cat_containers)
+    return _shorelines[key]
+
+
+# kelp -----------------------------------------------------------------------------------------------------
+def kelp_intervals(shoreline, kelp_geoms, kelp_owner):
+    """
+    Reduces kelp geometries to measure intervals on the shoreline axis
+    * **shoreline**: Shoreline (see load_shoreline)
+    * **kelp_geoms**, **kelp_owner**: stacked kelp geometries and the group of each one (see geo_fns.stack_fcs)
+    * returns (group, start, end) arrays, one interval per kelp piece in a container
+    """
+    k_idx, c_idx = shoreline.cont_tree.query(kelp_geoms, predicate="intersects")
+    site = shoreline.cont_site[c_idx]
+    k_idx, c_idx, site = k_idx[site >= 0], c_idx[site >= 0], site[site >= 0]
+
+    pieces = shapely.intersection(kelp_geoms[k_idx], shoreline.cont_geoms[c_idx])
+    start, end = project_extent(pieces, shoreline.site_lines[site])
+    ok = ~np.isnan(start)
+    offset = shoreline.site_offset[site[ok]]
+    return kelp_owner[k_idx[ok]], start[ok] + offset, end[ok] + offset
+
+
+def merge_intervals(start, end):
+    """
+    Merges overlapping or touching intervals
+    * returns sorted, disjoint (start, end) arrays
+    """
+    order = np.argsort(start, kind="stable")
+    start, end = start[order], end[order]
+    reach = np.maximum.accumulate(end)
+    first = np.flatnonzero(np.concatenate([[True], start[1:] > reach[:-1]]))
+    return start[first], np.maximum.reduceat(end, first)
+
+
+def interval_hits(shoreline, group, start, end, n_groups):
+    """
+    Which cov cat segments the kelp intervals of each group touch
+    Every group gets its own copy of the shoreline axis, so all groups are merged and swept at once
+    * **shoreline**: Shoreline
+    * **group**, **start**, **end**: kelp intervals (see kelp_intervals)
+    * **n_groups**: number of groups
+    * returns a (n_groups, n_segments) boolean hit matrix, same as geo_fns.hit_matrix on the cov cat tree
+    """
+    n_segs = len(shoreline.seg_start)
+    if len(start) == 0:
+        return np.zeros((n_groups, n_segs), dtype=bool)
+
+    span = shoreline.axis_length + GAP
+    m_start, m_end = merge_intervals(start + group * span, end + group * span)
+
+    group_offset = (np.arange(n_groups) * span)[:, None]
+    q_start = shoreline.seg_start[None, :] + group_offset
+    q_end = shoreline.seg_end[None, :] + group_offset
+
+    # last merged interval starting at or before the segment end, it reaches the segment if it ends at or after its start
+    j = np.searchsorted(m_start, q_end, side="right") - 1
+    hits = (j >= 0) & (m_end[np.maximum(j, 0)] >= q_start)
+    return hits & ~np.isnan(q_start)
+
+
+@instrument.stage("linear_hits")
+def segment_hits(shoreline, kelp_geoms, kelp_owner, n_groups):
+    """
+    Cov cat segment hit matrix from the linear referenced shoreline, a drop in for geo_fns.hit_matrix(cc_tree, ...)
+    * **shoreline**: Shoreline (see load_shoreline)
+    * **kelp_geoms**, **kelp_owner**: stacked kelp geometries and the group of each one
+    * **n_groups**: number of groups
+    """
+    group, start, end = kelp_intervals(shoreline, kelp_geoms, kelp_owner)
+    instrument.count(n_in=len(kelp_geoms), n_intervals=len(start))
+    return interval_hits(shoreline, group, start, end, n_groups)
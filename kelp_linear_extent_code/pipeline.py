@@ -1,81 +1,283 @@
 # Load modules
 # 2026 notes: specify /linearize/ path
+# Each linearize script is a module with a run(context) function, run in this process or on a pool of worker
+# processes (python pipeline.py --workers 8), so arcpy/arcgis are imported once per process (see runner.py).
+# Each worker gets its own scratch gdb through the KELP_SCRATCH_WS environment variable (see fns.config_scratch)
+# and with more than one worker the output of each script is written to pipeline_logs/<script>.log
+# Sources whose inputs have not changed since their last successful run are skipped (see manifest.json in
+# kelp_data_linear_outputs). Use --force to rerun everything, or --force costr_aqres.py dnr_kayak.py for specific sources
+# (an unknown script name is an error)
+# Each script writes stage timings/memory/feature counts to pipeline_logs/<script>.jsonl (see instrument.py),
+# summarized in a table at the end of the run
+# --profile (or KELP_PROFILE=cprofile/pyinstrument) runs each script under a profiler, see profiling.py. Profiles go to
+# profiles/ and the top functions by self time are printed at the end of the run
+# The main block is under if __name__ == "__main__", because pool workers import this file when they start
 
-import subprocess
+import os
+import sys
+import json
+import hashlib
+import argparse
 from pathlib import Path
 from datetime import datetime
 
-start_time = datetime.now()
+sys.path.append(str(Path(__file__).resolve().parent.parent)) # this lets the project function library be found as a module
+import kelp_linear_extent_code.instrument as instrument # noqa: E402 # run log, see instrument.py
+import kelp_linear_extent_code.profiling as profiling # noqa: E402 # profiler wrapper, see profiling.py
+import kelp_linear_extent_code.runner as runner # noqa: E402 # in-process source runner, see runner.py
 
 # All data sources should be copied into /kelp_data_sources folder
 # Check the notes at the top of each script for any file naming info or pre-processing
 
 base_dir = Path(__file__).resolve().parent
-print(f"Working in directory: {base_dir}")
-
-def run_script(py_file):
-    subprocess.run(["python", py_file])
+PROJECT_ROOT = base_dir.parent
 
+SOURCE_DIR = PROJECT_ROOT / "kelp_data_sources"
+OUT_DIR = PROJECT_ROOT / "kelp_data_linear_outputs"
+COMPILED_DIR = PROJECT_ROOT / "kelp_data_compiled"
+MANIFEST = OUT_DIR / "manifest.json"
+LOG_DIR = PROJECT_ROOT / "pipeline_logs"
 
 # Historical/"one time" datasources, no updates anticipated
-# No need to rerun unless lines/containers/source datasets have been editted since 06/2025
+# No need to rerun unless lines/containers/source datasets have been editted since 06/2025 -> the manifest checks this
+# each script is listed with the dataset names of the result tables it writes to kelp_data_linear_outputs
+# and the files/folders in kelp_data_sources it reads
+historical_sources = {
+    "cps_sps_boat.py": {"outputs": ["WADNR_sps_boat_survey", "WADNR_cps_boat_survey"],
+                        "inputs": ["bull_kelp_cps_2019.gdb", "SS_kelp.gdb"]},
+    "cps_uas.py": {"outputs": ["WADNR_Suquamish_CPS_UAS_surveys"],
+                   "inputs": ["Suquamish_UAS_survey_bed_extents.gdb"]},
+    "shorezone.py": {"outputs": ["WADNR_ShoreZone"],
+                     "inputs": ["state_DNR_ShoreZone"]},
+    "seattle_1984.py": {"outputs": ["WADNR_1984_Seattle_Imagery"],
+                        "inputs": ["WestSeattleMagnolia1984"]},
+    "sps_historical.py": {"outputs": ["Berry_et_al_2021"],
+                          "inputs": ["bull_kelp_sps_1878_2017.gdb"]},
+}
+
+# Living datasources
+# Rerun as updates occur
+living_sources = {
+    "costr_aqres.py": {"outputs": ["WADNR_COSTR_AQRES"],
+                       "inputs": ["WA_floating_kelp_coast_strait_reserves.gdb"]},
+    "dnr_kayak.py": {"outputs": ["WADNR_Kayak"],
+                     "inputs": ["DNR_bull_kelp_kayak_2025.gdb"]},
+    "fixed_wing.py": {"outputs": ["WADNR_KAM"],
+                      "inputs": ["fixed_wing_aerial_imagery"]},
+    "mrc_kayak.py": {"outputs": ["MRC_Kayak"],
+                     "inputs": ["mrc_kayak_data"]},
+    "samish_sji.py": {"outputs": ["Samish_AerialSurveys"],
+                      "inputs": ["Samish_spatial_data_2021_delivery"]},
+    "psrf_elliottbay.py": {"outputs": ["PSRF_Elliott_Bay_Linear_Surveys"],
+                           "inputs": ["PSRF_BulbCount_datashare.gdb"]},
+    "vnc_kayak.py": {"outputs": ["VashonNatureCenter_Kayak"],
+                     "inputs": ["VNC"]},
+}
+
+sources = {**historical_sources, **living_sources}
+
+
+def run_log(script):
+    return LOG_DIR / f"{Path(script).stem}.jsonl"
+
+
+def source_job(script, to_log, profile=None, **kwargs):
+    """
+    Arguments for runner.run_source: the script's run log is started fresh in pipeline_logs/<script>.jsonl,
+    and its output goes to pipeline_logs/<script>.log if to_log
+    """
+    LOG_DIR.mkdir(exist_ok=True)
+    run_log(script).unlink(missing_ok=True)
+    log_file = LOG_DIR / f"{Path(script).stem}.log" if to_log else None
+    return script, dict(log_file=log_file, run_log=run_log(script), profile=profile, **kwargs)
+
+
+def result_files(script):
+    return [OUT_DIR / f"{name}_result.parquet" for name in sources[script]["outputs"]]
+
+
+# the function library: every module in the package folder except the two entry points (compile_linear_data.py has its
+# own fingerprint), so a new module is fingerprinted without being added here
+library_modules = sorted(p for p in base_dir.glob("*.py") if p.name not in ("pipeline.py", "compile_linear_data.py"))
+
+# shared inputs of every linearize script: the lines/containers and the function library
+reference_inputs = [PROJECT_ROOT / "LinearExtent.gdb"] + library_modules
+
+
+def fingerprint(paths):
+    """
+    Fingerprint of a list of files/folders
+    .py files are hashed by content. Data (gdbs, shapefile folders) is hashed by file name, size and modification time,
+    which catches any edit without reading gigabytes of data on every run. Missing paths are part of the fingerprint too
+    """
+    h = hashlib.sha256()
+    for path in map(Path, paths):
+        h.update(str(path).encode())
+        if path.is_file() and path.suffix == ".py":
+            h.update(path.read_bytes())
+        elif path.is_file():
+            st = path.stat()
+            h.update(f"{st.st_size}|{st.st_mtime_ns}".encode())
+        elif path.is_dir():
+            for f in sorted(p for p in path.rglob("*") if p.is_file() and not p.name.endswith(".lock")):
+                st = f.stat()
+                h.update(f"{f.relative_to(path)}|{st.st_size}|{st.st_mtime_ns}".encode())
+        else:
+            h.update(b"missing")
+    return h.hexdigest()
+
+
+def source_fingerprint(script):
+    inputs = [base_dir / "linearize" / script] + reference_inputs + [SOURCE_DIR / p for p in sources[script]["inputs"]]
+    return fingerprint(inputs)
+
+
+def compile_fingerprint():
+    results = [f for script in sources for f in result_files(script)]
+    return fingerprint(results + [base_dir / "compile_linear_data.py", PROJECT_ROOT / "kelp_reference" / "source_urls.csv"])
 
-historical_sources = [
-    "cps_sps_boat.py",
-    "cps_uas.py",
-    "shorezone.py",
-    "seattle_1984.py",
-    "sps_historical.py",
-]
 
-for script in historical_sources:
+def load_manifest():
+    if MANIFEST.exists():
+        with open(MANIFEST) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest):
+    OUT_DIR.mkdir(exist_ok=True)
+    with open(MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def is_up_to_date(script, manifest):
+    entry = manifest.get(script)
+    return (entry is not None
+            and entry["fingerprint"] == source_fingerprint(script)
+            and all(f.exists() for f in result_files(script)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run all linearize scripts and compile the results")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of linearize scripts to run at once (1 = run in sequence and print to console)")
+    parser.add_argument("--force", nargs="*", metavar="SCRIPT",
+                        help="rerun sources even if their inputs are unchanged (all sources if no scripts are listed)")
+    parser.add_argument("--csv", action="store_true",
+                        help="also write each result table as csv next to the parquet file (see result_io.py)")
+    parser.add_argument("--profile", nargs="?", const="cprofile", choices=profiling.PROFILERS,
+                        default=os.environ.get("KELP_PROFILE") or None,
+                        help="run each script under a profiler (default cprofile), profiles and flamegraphs go to profiles/")
+    parser.add_argument("--profile-top", type=int, default=15, help="number of hotspots to print per script with --profile")
+    args = parser.parse_args()
+    if args.force:
+        # script names with or without .py
+        args.force = [f"{Path(script).stem}.py" for script in args.force]
+        unknown = [script for script in args.force if script not in sources]
+        if unknown:
+            parser.error(f"unknown script(s) for --force: {', '.join(unknown)} (choose from {', '.join(sources)})")
+    if args.csv:
+        os.environ["KELP_RESULT_CSV"] = "1"
+
+    start_time = datetime.now()
+    print(f"Working in directory: {base_dir}")
+
+    # Build the reference layer cache first, so the workers don't all build it at once
     print("----------------------------------")
-    print(f"Running {script}...")
-    script_path = base_dir / "linearize" / script
-    try:
-        run_script(script_path)
-        print(f"{script} complete")
-        print("🎉🥳🎉🥳🎉")
+    print("Refreshing reference layer cache...")
+    LOG_DIR.mkdir(exist_ok=True)
+    run_log("cache.py").unlink(missing_ok=True)
+    os.environ["KELP_RUN_LOG"] = str(run_log("cache.py"))
+    import kelp_linear_extent_code.cache as cache
+    cache.refresh()
+
+    # Run the linearize scripts
+    n_workers = max(1, min(args.workers, len(sources)))
+    to_log = n_workers > 1
+    if to_log:
+        print(f"Running {len(sources)} sources on {n_workers} worker processes, logs in {LOG_DIR}")
+
+    # check which sources need to run
+    manifest = load_manifest()
+    if args.force is None:
+        forced = []
+    elif len(args.force) == 0:
+        forced = list(sources)
+    else:
+        forced = args.force
+    to_run = [script for script in sources if script in forced or not is_up_to_date(script, manifest)]
+    for script in sources:
+        if script not in to_run:
+            print(f"{script} inputs unchanged since {manifest[script]['finished']}, skipping")
+
+    wall_times = {}
+    failed = []
+    run_log("runner").unlink(missing_ok=True)
+    jobs = [source_job(script, to_log, args.profile) for script in to_run]
+    for script in to_run:
+        print(f"Running {script}...")
+    for script, returncode, wall_time in runner.run_sources(jobs, n_workers, run_log("runner")):
+        wall_times[script] = wall_time
         print("----------------------------------")
-    except Exception as e:
-        print(f"Error occured while running {script}: {e}")
-        print("❌🚨❌🚨❌")
+        if returncode == 0:
+            # fingerprint taken after the run: some scripts write intermediate fcs into their source gdb
+            manifest[script] = {"fingerprint": source_fingerprint(script), "finished": datetime.now().isoformat()}
+            save_manifest(manifest)
+            print(f"{script} complete ({wall_time:.0f} s)")
+            print("🎉🥳🎉🥳🎉")
+        else:
+            failed.append(script)
+            print(f"Error occured while running {script} (exit code {returncode})")
+            print("❌🚨❌🚨❌")
+
+    # Run the join script once every upstream result table is there
+    missing = [str(f) for script in sources for f in result_files(script) if not f.exists()]
+    if failed or missing:
+        print("!!!!!!!!!!!!!!! Not running join script !!!!!!!!!!!!!!!")
+        for script in failed:
+            print(f"Failed: {script}")
+        for f in missing:
+            print(f"Missing: {f}")
+    elif (not to_run and manifest.get("compile_linear_data.py", {}).get("fingerprint") == compile_fingerprint()
+          and (COMPILED_DIR / "all_records.csv").exists()):
+        print("No results changed since the last compile, skipping join script")
+    else:
+        try:
+            # in this process, where arcpy is already imported if the sources ran in it too
+            job = source_job("compile_linear_data.py", False, args.profile)
+            _, returncode, wall_time = next(runner.run_sources([job], 1, run_log("runner")))
+            wall_times["compile_linear_data.py"] = wall_time
+            if returncode == 0:
+                manifest["compile_linear_data.py"] = {"fingerprint": compile_fingerprint(), "finished": datetime.now().isoformat()}
+                save_manifest(manifest)
+                print("Analysis complete")
+            else:
+                print("!!!!!!!!!!!!!!! Unable to complete join script !!!!!!!!!!!!!!!")
+        except Exception as e:
+            print("!!!!!!!!!!!!!!! Unable to complete join script !!!!!!!!!!!!!!!")
+            print(f"{e}")
+
+    end_time = datetime.now()
 
-# Living datasources
-# Rerun as updates occur
-living_sources = [
-    "costr_aqres.py",
-    "dnr_kayak.py",
-    "fixed_wing.py",
-    "mrc_kayak.py",
-    "samish_sji.py",
-    "psrf_elliotbay.py",
-    "vnc_kayak.py"
-]
-
-for script in living_sources:
     print("----------------------------------")
-    print(f"Running {script}...")
-    script_path = base_dir / "linearize" / script
-    try:
-        run_script(script_path)
-        print(f"{script} complete")
-        print("🎉🥳🎉🥳🎉")
-        print("----------------------------------")
-    except Exception as e:
-        print(f"Error occured while running {script}: {e}")
-        print("❌🚨❌🚨❌")
+    print("Wall time per step:")
+    for script, wall_time in sorted(wall_times.items(), key=lambda x: -x[1]):
+        print(f"{script:<28}{wall_time:>10.1f} s")
+
+    # stage summary of the scripts that ran this time
+    print("----------------------------------")
+    print(f"Stage summary (details in {LOG_DIR / '<script>.jsonl'}):")
+    instrument.summary(instrument.read_log([run_log(script) for script in ["cache.py", "runner", *wall_times]]))
 
+    if args.profile:
+        print("----------------------------------")
+        print(f"Profile hotspots (profiles in {profiling.profile_dir()}):")
+        profiling.print_hotspots([os.path.join(profiling.profile_dir(), f"{Path(script).stem}.hotspots.json")
+                                  for script in sorted(wall_times, key=lambda x: -wall_times[x])], args.profile_top)
 
-# Run the join script
-try:
-    run_script(base_dir / "compile_linear_data.py")
-    print("Analysis complete")
-except Exception as e:
-    print("!!!!!!!!!!!!!!! Unable to complete join script !!!!!!!!!!!!!!!")
-    print(f"{e}")
+    print(f"Script started: {start_time}")
+    print(f"Script finished: {end_time}")
 
-end_time = datetime.now()
 
-print(f"Script started: {start_time}")
-print(f"Script finished: {end_time}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
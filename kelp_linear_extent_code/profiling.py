@@ -0,0 +1,200 @@
+# run a script or a source under a profiler
+# python kelp_linear_extent_code/profiling.py linearize/costr_aqres.py
+# python kelp_linear_extent_code/profiling.py --profiler pyinstrument linearize/costr_aqres.py
+# with --profile (or KELP_PROFILE=cprofile/pyinstrument set), pipeline.py profiles each source's run(context) in the
+# process that runs it (see runner.py). Output goes to profiles/ (or KELP_PROFILE_DIR), per script:
+#   cprofile (deterministic, default): <script>.prof for pstats/snakeviz, and <script>.folded collapsed stacks
+#       (rebuilt from the pstats call graph) that speedscope and flamegraph.pl open directly
+#   pyinstrument (sampling, pip install pyinstrument): <script>.speedscope.json
+#   both: <script>.hotspots.json, the top functions by self time, printed by pipeline.py at the end of the run
+import os
+import sys
+import json
+import runpy
+import pstats
+import argparse
+import cProfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PROFILE_DIR = os.path.join(PROJECT_ROOT, "profiles")
+PROFILERS = ["cprofile", "pyinstrument"]
+N_HOTSPOTS = 50 # stored per script, pipeline.py prints fewer
+
+# stacks under this much time (s) are left out of the .folded file, to keep it small enough to open
+MIN_STACK_TIME = 1e-4
+
+
+def profile_dir():
+    return os.environ.get("KELP_PROFILE_DIR", DEFAULT_PROFILE_DIR)
+
+
+def label(func):
+    """
+    Readable name for a pstats function key (file, line, name)
+    """
+    file_name, line_no, name = func
+    if file_name == "~":  # built-in
+        return name
+    return f"{name} ({os.path.basename(file_name)}:{line_no})"
+
+
+# cProfile ----------------------------------------------------------------------------------------------------------
+def folded_stacks(stats):
+    """
+    Collapsed stacks ("a;b;c <microseconds>") from the pstats call graph
+    cProfile only keeps caller -> callee totals, not full stacks, so time is split across the paths into a function
+    in proportion to each caller's share (like flameprof does). Recursive calls are cut at the first repeat
+    * **stats**: pstats.Stats
+    * returns a list of lines
+    """
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, (cc, nc, tt, ct, callers) in stats.stats.items() if not callers]
+
+    lines = []
+
+    def walk(func, path, on_path, t):
+        tt, ct = stats.stats[func][2], stats.stats[func][3]
+        scale = t / ct if ct else 0
+        if tt * scale >= MIN_STACK_TIME:
+            lines.append(f"{';'.join(path)} {round(tt * scale * 1e6)}")
+        for child, edge_ct in callees.get(func, []):
+            if child in on_path or edge_ct * scale < MIN_STACK_TIME:
+                continue
+            walk(child, path + [label(child)], on_path | {child}, edge_ct * scale)
+
+    for root in roots:
+        walk(root, [label(root)], {root}, stats.stats[root][3])
+    return lines
+
+
+def cprofile_hotspots(stats, n=N_HOTSPOTS):
+    rows = sorted(stats.stats.items(), key=lambda x: -x[1][2])[:n]
+    return [{"function": label(func), "calls": nc, "self_s": round(tt, 4), "total_s": round(ct, 4)}
+            for func, (cc, nc, tt, ct, callers) in rows]
+
+
+def run_cprofile(fn, out_base):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        fn()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{out_base}.prof")
+        stats = pstats.Stats(profiler)
+        with open(f"{out_base}.folded", "w") as f:
+            f.write("\n".join(folded_stacks(stats)) + "\n")
+        write_hotspots(out_base, "cprofile", cprofile_hotspots(stats))
+        print(f"Profile written to {out_base}.prof and {out_base}.folded")
+
+
+# pyinstrument ------------------------------------------------------------------------------------------------------
+def pyinstrument_hotspots(session, n=N_HOTSPOTS):
+    """
+    Top functions by self time from a pyinstrument session, summed over every place they appear in the call tree
+    """
+    totals = {}
+
+    def walk(frame, on_path):
+        if frame.function.startswith("["):
+            return  # pyinstrument's [self]/[await] frames, already in the parent's total_self_time
+        key = (frame.file_path or "~", frame.line_no or 0, frame.function)
+        row = totals.setdefault(key, {"function": label(key), "calls": None, "self_s": 0.0, "total_s": 0.0})
+        row["self_s"] += frame.total_self_time
+        if key not in on_path:  # recursion: count the outermost call only
+            row["total_s"] += frame.time
+        for child in frame.children:
+            walk(child, on_path | {key})
+
+    root = session.root_frame()
+    if root is not None:
+        walk(root, frozenset())
+    rows = sorted(totals.values(), key=lambda r: -r["self_s"])[:n]
+    for row in rows:
+        row["self_s"], row["total_s"] = round(row["self_s"], 4), round(row["total_s"], 4)
+    return rows
+
+
+def run_pyinstrument(fn, out_base):
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+
+    profiler = Profiler()
+    profiler.start()
+    try:
+        fn()
+    finally:
+        session = profiler.stop()
+        with open(f"{out_base}.speedscope.json", "w") as f:
+            f.write(SpeedscopeRenderer().render(session))
+        write_hotspots(out_base, "pyinstrument", pyinstrument_hotspots(session))
+        print(f"Profile written to {out_base}.speedscope.json")
+
+
+# hotspots ----------------------------------------------------------------------------------------------------------
+def write_hotspots(out_base, profiler, rows):
+    with open(f"{out_base}.hotspots.json", "w") as f:
+        json.dump({"script": os.path.basename(out_base), "profiler": profiler, "hotspots": rows}, f, indent=2)
+
+
+def read_hotspots(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_hotspots(paths, n=15):
+    """
+    Prints the top n functions by self time for each profiled script
+    * **paths**: .hotspots.json files, missing ones are skipped
+    """
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        hot = read_hotspots(path)
+        print(f"{hot['script']} ({hot['profiler']}), top {n} by self time:")
+        print(f"    {'self s':>9}{'total s':>9}{'calls':>10}  function")
+        for row in hot["hotspots"][:n]:
+            calls = "" if row["calls"] is None else row["calls"]
+            print(f"    {row['self_s']:>9.2f}{row['total_s']:>9.2f}{calls:>10}  {row['function']}")
+
+
+def profile_call(fn, name, profiler="cprofile", out_dir=None):
+    """
+    Calls fn() under a profiler and writes the profile files (see top of file)
+    * **fn**: function to profile, called without arguments
+    * **name**: base name for the output files, eg. the script name without .py
+    * **profiler**: "cprofile" or "pyinstrument"
+    * **out_dir**: output folder, defaults to profiles/ (or KELP_PROFILE_DIR)
+    """
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profiler}, use one of {PROFILERS}")
+    out_dir = out_dir or profile_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    out_base = os.path.join(out_dir, name)
+    if profiler == "cprofile":
+        run_cprofile(fn, out_base)
+    else:
+        run_pyinstrument(fn, out_base)
+
+
+def profile_script(script, profiler="cprofile", out_dir=None):
+    """
+    Runs a python script as __main__ under a profiler, see profile_call
+    """
+    # the script should see itself as the program being run, as it would without the profiler
+    sys.argv = [script]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    name = os.path.splitext(os.path.basename(script))[0]
+    profile_call(lambda: runpy.run_path(script, run_name="__main__"), name, profiler, out_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a script under a profiler, output in profiles/")
+    parser.add_argument("script", help="python script to run")
+    parser.add_argument("--profiler", choices=PROFILERS, default=os.environ.get("KELP_PROFILE", "cprofile"))
+    parser.add_argument("--out-dir", default=None, help="output folder (default profiles/ or KELP_PROFILE_DIR)")
+    args = parser.parse_args()
+    profile_script(args.script, args.profiler, args.out_dir)
@@ -0,0 +1,277 @@
+# raster kelp sources
+# classified imagery / satellite canopy rasters (GeoTIFF or anything else GDAL reads, one raster per year) go straight to
+# presence and coverage, without vectorizing them into polygons first:
+#   the containers and cov cat segments are rasterized into label grids (pixel value = feature number + 1), once per
+#   raster grid, and every year's raster on that grid is read in the same windows. Kelp and valid pixels are counted per
+#   label with bincount: presence = any kelp pixel in the container, coverage fraction = kelp pixels / valid pixels
+#   the grid is streamed in tiles: each container/segment belongs to the tile its bounding box centre is in (the centre
+#   of the part of the box inside the raster, for features on the edge of the imagery), and the window read for a tile
+#   is the union of its members' bounding boxes, so memory depends on TILE_SIZE and the container size, not on the size
+#   of the mosaic. Features partly outside the raster are counted on the pixels they have inside it
+#   where footprints of the same layer overlap (neighbouring containers), a shared pixel is counted for one of them
+# GDAL (osgeo.gdal/ogr, the gdal package in kelp_reference/environment.yml) is imported when a raster is read, so the
+# rest of the library does not need it
+import os
+import functools
+import numpy as np
+import pandas as pd
+import shapely
+from kelp_linear_extent_code import cache
+from kelp_linear_extent_code import geo_fns
+from kelp_linear_extent_code import instrument
+
+# tile edge in pixels, the window read at once is about this size
+TILE_SIZE = 4096
+
+
+# utilities ---------------------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=None)
+def _gdal():
+    """
+    Imports GDAL/OGR the first time a raster is read, with exceptions on instead of error codes
+    """
+    from osgeo import gdal, ogr
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+    return gdal, ogr
+
+
+def raster_name(raster):
+    """
+    Name of a raster file without extension, year is the last 4 characters (like the kelp fcs)
+    """
+    return os.path.splitext(os.path.basename(str(raster)))[0]
+
+
+def grid_key(ds):
+    """
+    Rasters with the same crs, geotransform and size share their label grids
+    """
+    return ds.GetProjection(), tuple(ds.GetGeoTransform()), ds.RasterXSize, ds.RasterYSize
+
+
+def window_transform(gt, row_off, col_off):
+    """
+    Geotransform of a window of a raster
+    """
+    return (gt[0] + col_off * gt[1] + row_off * gt[2], gt[1], gt[2],
+            gt[3] + col_off * gt[4] + row_off * gt[5], gt[4], gt[5])
+
+
+def tile_windows(bounds, gt, width, height, tile_size=TILE_SIZE):
+    """
+    Groups features into tiles of a raster grid by the pixel their bounding box centre falls in
+    * **bounds**: (n, 4) xmin/ymin/xmax/ymax of the features, in the raster crs
+    * **gt**: GDAL geotransform of the raster (north up)
+    * **width**, **height**: raster size in pixels
+    * returns (windows, n_partial, n_outside): a list of (feature indices, (row_off, col_off, n_rows, n_cols)) for every
+    tile with features, the number of features partly outside the raster (they go to the tile of the centre of their
+    part inside it) and the number entirely outside it (left out)
+    """
+    col0 = (bounds[:, 0] - gt[0]) / gt[1]
+    col1 = (bounds[:, 2] - gt[0]) / gt[1]
+    row0 = (bounds[:, 3] - gt[3]) / gt[5]
+    row1 = (bounds[:, 1] - gt[3]) / gt[5]
+    col0, col1 = np.minimum(col0, col1), np.maximum(col0, col1)
+    row0, row1 = np.minimum(row0, row1), np.maximum(row0, row1)
+
+    # bounding boxes that reach into the raster (empty geometries have NaN bounds and never do)
+    overlaps = (col1 > 0) & (col0 < width) & (row1 > 0) & (row0 < height)
+    partial = overlaps & ((col0 < 0) | (col1 > width) | (row0 < 0) | (row1 > height))
+    idx = np.flatnonzero(overlaps)
+
+    # centre of the part of each box inside the raster
+    c_col = (np.clip(col0[idx], 0, width) + np.clip(col1[idx], 0, width)) / 2
+    c_row = (np.clip(row0[idx], 0, height) + np.clip(row1[idx], 0, height)) / 2
+    c_col = np.minimum(c_col, width - 1)
+    c_row = np.minimum(c_row, height - 1)
+    n_tile_cols = -(-width // tile_size)
+    tile = (c_row // tile_size).astype(np.int64) * n_tile_cols + (c_col // tile_size).astype(np.int64)
+
+    order = np.argsort(tile, kind="stable")
+    idx, tile = idx[order], tile[order]
+    _, first = np.unique(tile, return_index=True)
+
+    windows = []
+    for members in np.split(idx, first[1:]):
+        if len(members) == 0:
+            continue
+        r0 = max(int(np.floor(row0[members].min())), 0)
+        c0 = max(int(np.floor(col0[members].min())), 0)
+        r1 = min(int(np.ceil(row1[members].max())), height)
+        c1 = min(int(np.ceil(col1[members].max())), width)
+        windows.append((members, (r0, c0, r1 - r0, c1 - c0)))
+    return windows, int(partial.sum()), int(np.sum(~overlaps))
+
+
+def rasterize_labels(geoms, gt, wkt, n_rows, n_cols, all_touched=False):
+    """
+    Label grid of a set of geometries: pixel value = position in geoms + 1, 0 outside all of them
+    * **geoms**: geometries in the raster crs
+    * **gt**, **wkt**: geotransform and crs of the grid (see window_transform)
+    * **n_rows**, **n_cols**: grid size
+    * **all_touched**: see count_pixels
+    """
+    gdal, ogr = _gdal()
+    grid = gdal.GetDriverByName("MEM").Create("", n_cols, n_rows, 1, gdal.GDT_Int32)
+    grid.SetGeoTransform(gt)
+    grid.SetProjection(wkt)
+
+    # in memory layer with the label as an attribute, rasterized in one call
+    src = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = src.CreateLayer("labels", geom_type=ogr.wkbUnknown)
+    layer.CreateField(ogr.FieldDefn("label", ogr.OFTInteger))
+    defn = layer.GetLayerDefn()
+    for label, wkb in enumerate(shapely.to_wkb(geoms), start=1):
+        feature = ogr.Feature(defn)
+        feature.SetField("label", label)
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+        layer.CreateFeature(feature)
+
+    options = ["ATTRIBUTE=label"] + (["ALL_TOUCHED=TRUE"] if all_touched else [])
+    gdal.RasterizeLayer(grid, [1], layer, options=options)
+    return grid.GetRasterBand(1).ReadAsArray()
+
+
+# pixel counts ------------------------------------------------------------------------------------------
+def add_tile_counts(valid_n, kelp_n, k, feats, labels, ok, kelp):
+    """
+    Adds the valid and kelp pixels of one tile to the counts of its features, one bincount over the label grid each
+    * **valid_n**, **kelp_n**: (n_rasters, n_features) count arrays, updated in place
+    * **k**: raster row of the counts
+    * **feats**: feature index of each label (label i + 1 is feats[i], 0 is no feature)
+    * **labels**: label grid of the tile (see rasterize_labels)
+    * **ok**, **kelp**: boolean grids of the tile, valid (not nodata) pixels and kelp pixels
+    """
+    valid_n[k, feats] += np.bincount(labels[ok], minlength=len(feats) + 1)[1:]
+    kelp_n[k, feats] += np.bincount(labels[kelp], minlength=len(feats) + 1)[1:]
+
+
+def count_pixels(rasters, layers, kelp_values=(1,), band=1, tile_size=TILE_SIZE, all_touched=False):
+    """
+    Valid and kelp pixel counts in every feature of every layer, for every raster
+    * **rasters**: list of raster paths (one per year)
+    * **layers**: list of GeoSeries (eg. containers and cov cat segments), projected to each raster's crs if needed
+    * **kelp_values**: pixel values that are kelp, everything else that is not nodata (the band's mask) is surveyed water
+    without kelp
+    * **band**: band with the classification
+    * **tile_size**: see TILE_SIZE
+    * **all_touched**: rasterize with every pixel a footprint touches instead of the pixels whose centre is inside
+    * returns a list with a (valid, kelp) pair of (n_rasters, n_features) count arrays for each layer
+    """
+    gdal, _ = _gdal()
+
+    counts = [(np.zeros((len(rasters), len(geoms)), dtype=np.int64), np.zeros((len(rasters), len(geoms)), dtype=np.int64))
+              for geoms in layers]
+
+    # rasters on the same grid share the tiles and label grids
+    grids = {}
+    for i, raster in enumerate(rasters):
+        grids.setdefault(grid_key(gdal.Open(str(raster))), []).append(i)
+
+    n_partial = n_outside = 0
+    for (wkt, gt, width, height), raster_idx in grids.items():
+        if gt[2] != 0 or gt[4] != 0:
+            raise ValueError(f"Rotated rasters are not supported: {rasters[raster_idx[0]]}")
+        # the datasets are kept open while their bands are read
+        datasets = [gdal.Open(str(rasters[i])) for i in raster_idx]
+        bands = [ds.GetRasterBand(band) for ds in datasets]
+        print(f"Reading {len(bands)} raster(s) on a {width} x {height} grid...")
+
+        # all layers in the raster crs, one tile set for all of them
+        geoms = [np.asarray(g.to_crs(wkt).values, dtype=object) for g in layers]
+        layer_of = np.concatenate([np.full(len(g), j) for j, g in enumerate(geoms)])
+        feat_of = np.concatenate([np.arange(len(g)) for g in geoms])
+        all_geoms = np.concatenate(geoms)
+
+        windows, partial, outside = tile_windows(shapely.bounds(all_geoms), gt, width, height, tile_size)
+        n_partial += partial
+        n_outside += outside
+        if partial or outside:
+            print(f"{partial} features are partly outside the raster (counted on their pixels inside it), "
+                  f"{outside} are outside it")
+
+        for n, (members, (r0, c0, n_rows, n_cols)) in enumerate(windows):
+            if n_rows <= 0 or n_cols <= 0:
+                continue
+            transform = window_transform(gt, r0, c0)
+
+            # label grid of each layer for this tile, rasterized once for every raster on the grid
+            labels = []
+            for j in range(len(layers)):
+                m = members[layer_of[members] == j]
+                grid_j = rasterize_labels(all_geoms[m], transform, wkt, n_rows, n_cols, all_touched) if len(m) else None
+                labels.append((feat_of[m], grid_j))
+
+            for k, b in zip(raster_idx, bands):
+                data = b.ReadAsArray(c0, r0, n_cols, n_rows)
+                ok = b.GetMaskBand().ReadAsArray(c0, r0, n_cols, n_rows) > 0
+                kelp = ok & np.isin(data, kelp_values)
+                for j, (feats, grid_j) in enumerate(labels):
+                    if grid_j is None:
+                        continue
+                    add_tile_counts(*counts[j], k, feats, grid_j, ok, kelp)
+
+            if (n + 1) % 50 == 0:
+                print(f"{n + 1} of {len(windows)} tiles done")
+
+    instrument.count(n_partly_outside=n_partial, n_outside=n_outside)
+    return counts
+
+
+# main tool ---------------------------------------------------------------------------------------------
+@instrument.stage("calc_raster")
+def calc_raster(rasters, containers, cov_cat_containers, source_name, kelp_values=(1,), band=1, tile_size=TILE_SIZE):
+    """
+    Presence, coverage category and coverage fraction for classified kelp rasters, one raster per year
+    * **rasters**: list of raster paths, year is the last 4 characters of the file name (eg. kelp_canopy_2024.tif)
+    * **containers**: containers for presence
+    * **cov_cat_containers**: feature class with the subdivided containers
+    * **source_name**: string to be used as source name in table
+    * **kelp_values**: pixel values that are kelp (see count_pixels)
+    * **band**: band with the classification
+    * **tile_size**: see TILE_SIZE
+    * returns one SITE_CODE/year/source/presence/coverage_cat/coverage_frac dataframe, year as str (same as calc_results
+    plus coverage_frac, see geo_fns.cover_fractions). Containers with no valid pixels in a year's raster (outside the
+    imagery or all nodata) were not surveyed that year and are left out, like containers outside a survey boundary.
+    Containers on the edge of the imagery are summarized over their pixels inside it
+    """
+    print(f"Loading containers: {containers}")
+    cont = cache.load_layer(containers)
+    cc = cache.load_layer(cov_cat_containers)
+    weights = geo_fns.load_cov_cat_weights(cov_cat_containers)
+    names = [raster_name(r) for r in rasters]
+
+    (cont_valid, cont_kelp), (seg_valid, seg_kelp) = count_pixels(rasters, [cont.geometry, cc.geometry], kelp_values,
+                                                                  band, tile_size)
+
+    # touch based cov cat from segments with any kelp pixel, and the covered share of each segment
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(seg_valid > 0, seg_kelp / seg_valid, 0.0)
+    cats = geo_fns.cov_cat_from_hits(seg_kelp > 0, weights)
+    site_frac = geo_fns.cov_frac_from_fractions(frac, weights)
+    sites = geo_fns.cov_cat_sites(weights)
+
+    df_list = []
+    for i, name in enumerate(names):
+        surveyed = cont_valid[i] > 0
+        presence = pd.DataFrame({
+            "SITE_CODE": cont["SITE_CODE"].values[surveyed],
+            "year": name[-4:],
+            "source": source_name,
+            "presence": (cont_kelp[i][surveyed] > 0).astype(int),
+        })
+        cov_cat = pd.DataFrame({
+            "SITE_CODE": sites,
+            "coverage_cat": pd.Categorical(cats[i], categories=[0, 1, 2, 3, 4]),
+            "coverage_frac": site_frac[i],
+        })
+        df_list.append(pd.merge(presence, cov_cat, how="left", on="SITE_CODE"))
+        print(f"Raster analysis complete for {name}: {np.sum(surveyed)} containers surveyed")
+
+    results = pd.concat(df_list, ignore_index=True)
+    instrument.count(n_in=len(rasters), n_out=len(results), years=[name[-4:] for name in names])
+    print("Result preview:")
+    print(results.head())
+
+    return results
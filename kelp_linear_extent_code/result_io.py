@@ -0,0 +1,185 @@
+# linearize result tables
+# Every linearize script writes its results as <dataset_name>_result.parquet in kelp_data_linear_outputs with one
+# fixed schema, so compile_linear_data reads them all in one pyarrow dataset scan with no type clean up:
+#   SITE_CODE     categorical (dictionary) string
+#   year          int16
+#   source        categorical (dictionary) string
+#   presence      int8
+#   coverage_cat  uint8, null where there is no coverage category (eg. presence-only attribute sources)
+# Set KELP_RESULT_CSV=1 (or run pipeline.py --csv) to also write the old <dataset_name>_result.csv for inspection
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from kelp_linear_extent_code import instrument
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_DIR = os.path.join(PROJECT_ROOT, "kelp_data_linear_outputs")
+
+RESULT_SCHEMA = pa.schema([
+    ("SITE_CODE", pa.dictionary(pa.int32(), pa.string())),
+    ("year", pa.int16()),
+    ("source", pa.dictionary(pa.int32(), pa.string())),
+    ("presence", pa.int8()),
+    ("coverage_cat", pa.uint8()),
+])
+RESULT_COLUMNS = RESULT_SCHEMA.names
+
+
+def result_path(dataset_name, ext="parquet"):
+    """
+    Path of the result file for a dataset in kelp_data_linear_outputs
+    """
+    return os.path.join(RESULT_DIR, f"{dataset_name}_result.{ext}")
+
+
+def to_result_schema(df):
+    """
+    Casts a linearize result dataframe to the result schema
+    * **df**: dataframe with SITE_CODE, year, source, presence and optionally coverage_cat. year can be str or numeric,
+    coverage_cat can be categorical/float with nulls. Any other columns are dropped
+    * returns a dataframe with the RESULT_SCHEMA columns and pandas dtypes
+    """
+    if "coverage_cat" in df:
+        cov_cat = pd.to_numeric(np.asarray(df["coverage_cat"], dtype=float))
+    else:
+        cov_cat = np.full(len(df), np.nan)
+
+    return pd.DataFrame({
+        "SITE_CODE": pd.Categorical(df["SITE_CODE"].astype(str)),
+        "year": pd.to_numeric(df["year"]).astype(np.int16),
+        "source": pd.Categorical(df["source"].astype(str)),
+        "presence": df["presence"].astype(np.int8).to_numpy(),
+        "coverage_cat": pd.array(cov_cat, dtype="Float64").astype("UInt8"),
+    })
+
+
+@instrument.stage("write_results")
+def write_results(df, dataset_name, csv=None):
+    """
+    Writes a linearize result table as <dataset_name>_result.parquet with the result schema
+    * **df**: result dataframe, see to_result_schema
+    * **dataset_name**: name of the data source
+    * **csv**: also write <dataset_name>_result.csv. Defaults to the KELP_RESULT_CSV environment variable
+    * returns the path of the parquet file
+    """
+    if csv is None:
+        csv = os.environ.get("KELP_RESULT_CSV", "0") == "1"
+
+    result = to_result_schema(df)
+    instrument.count(n_out=len(result))
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    out_results = result_path(dataset_name)
+    pq.write_table(pa.Table.from_pandas(result, schema=RESULT_SCHEMA, preserve_index=False), out_results)
+    print(f"{len(result)} records saved here: {out_results}")
+
+    if csv:
+        result.to_csv(result_path(dataset_name, "csv"), index=False)
+        print(f"Saved as csv here: {result_path(dataset_name, 'csv')}")
+
+    return out_results
+
+
+@instrument.stage("read_results")
+def read_results(paths):
+    """
+    Reads any number of result files in one pyarrow dataset scan
+    * **paths**: list of <dataset_name>_result.parquet files
+    * returns one dataframe with the result schema (SITE_CODE/source categorical, coverage_cat nullable UInt8)
+    """
+    table = ds.dataset([str(p) for p in paths], format="parquet", schema=RESULT_SCHEMA).to_table()
+    instrument.count(n_in=len(paths), n_out=table.num_rows)
+    return table.to_pandas(types_mapper={pa.uint8(): pd.UInt8Dtype()}.get)
+
+
+# compile ---------------------------------------------------------------------------------------------
+@instrument.stage("combine_results")
+def combine_results(all_synth, OUT_PATH):
+    """
+    combine linearized results (see read_results) into most recent and all records .csvs  
+    in folder specified with OUT_PATH, used by compile_linear_data
+    """
+    pd.set_option("display.max_rows", 7)
+    print("Joined results df: ")
+    print(all_synth.head(5))
+
+    # handle instances where presence and coverage_cat disagree
+    # if presence == 0 and coverage_cat > 0, make coverage_cat 0
+    # if presence == 1 and coverage_cat == 0, make coverage_cat 1
+    presence = all_synth["presence"].to_numpy()
+    cov_cat = all_synth["coverage_cat"]
+    all_synth["coverage_cat"] = cov_cat.mask(
+        (presence == 0) & (cov_cat.isna() | (cov_cat > 0)).to_numpy(dtype=bool), 0
+    ).mask(
+        (presence == 1) & (cov_cat == 0).fillna(False).to_numpy(dtype=bool), 1
+    )
+
+    # drop rows where source is null
+    all_synth = all_synth.dropna(subset=["source"], axis=0)
+
+    # rename abundance
+    all_synth.rename(columns={"coverage_cat": "coverage_category"}, inplace=True)
+
+    # add the source_url field
+    print("Adding the source_urls in from the file source_urls.csv")
+    source_url = pd.read_csv(os.path.join(PROJECT_ROOT, "kelp_reference", "source_urls.csv"))
+    all_synth = all_synth.merge(
+        source_url[["source", "source_url"]], on="source", how="left"
+    )
+
+    # save this as the 'all_records" table.
+    os.makedirs(OUT_PATH, exist_ok=True)
+    all_synth.to_csv(os.path.join(OUT_PATH, "all_records.csv"))
+    print("Compiled all results and written to csv: all_records.csv")
+    print(f"Total records: {len(all_synth)}")
+
+    #### Select most recent year for each site_code ####
+    # find most recent year for each SITE_CODE, then the max coverage within that year
+    # one sort by (site, year, coverage): the last row of each site holds both maximums
+    # NULL coverage counts as -9999 so sites with no coverage category still get a record
+    site_idx, sites = pd.factorize(all_synth["SITE_CODE"])
+    year_rank, _ = pd.factorize(all_synth["year"], sort=True)
+    cov = all_synth["coverage_category"].astype("Int16").fillna(-9999).to_numpy(dtype=np.int16)
+
+    valid = np.flatnonzero((site_idx >= 0) & (year_rank >= 0))
+    order = valid[np.lexsort((cov[valid], year_rank[valid], site_idx[valid]))]
+    last = order[np.append(site_idx[order][1:] != site_idx[order][:-1], True)]
+    # one extra slot at the end for NA SITE_CODEs (site_idx -1), which are never selected
+    best_year = np.full(len(sites) + 1, -1)
+    best_year[site_idx[last]] = year_rank[last]
+    best_cov = np.full(len(sites) + 1, -10000)
+    best_cov[site_idx[last]] = cov[last]
+
+    # grab the most recent year rows
+    in_year = (year_rank >= 0) & (year_rank == best_year[site_idx])
+    most_recent = all_synth[in_year].copy()
+
+    # check if site_code is unique
+    if not most_recent["SITE_CODE"].is_unique:
+        dupes = most_recent[
+        most_recent.duplicated("SITE_CODE", keep=False)
+        ].sort_values("SITE_CODE")
+        print(f"{len(dupes)} sites have more than 1 record for the most recent year:")
+        print(dupes)
+        print("Selecting source with maximum coverage...")
+    else:
+        print("All sites have unique records for most recent year")
+
+    # count number of records for most recent year
+    most_recent["n_records_most_rec"] = np.bincount(site_idx[in_year], minlength=len(sites))[site_idx[in_year]]
+
+    # for years with multiple records, select row with max coverage category
+    most_recent["coverage_category"] = cov[in_year]
+    most_rec_max = most_recent[cov[in_year] == best_cov[site_idx[in_year]]]
+
+    # Set index to site_code
+    most_rec_max = most_rec_max.set_index("SITE_CODE")
+
+    print("Preview of most recent year table:")
+    print(most_rec_max.head(5))
+
+    # write to a csv
+    most_rec_max.to_csv(os.path.join(OUT_PATH, "most_recent.csv"))
+    print("Written to csv: most_recent.csv")
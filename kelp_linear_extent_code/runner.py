@@ -0,0 +1,178 @@
+# in-process source runner
+# Every linearize script and compile_linear_data.py is a module with a run(context) function. pipeline.py runs them
+# here instead of starting a new python for each one, so arcpy/arcgis are imported and the reference layers loaded
+# once per process rather than once per script:
+#   workers = 1: every source runs in the pipeline process, in sequence
+#   workers > 1: a pool of worker processes, each imports once and runs sources until there are none left.
+#       Each worker has its own scratch gdb (scratch_workers/scratch_<n>.gdb) through KELP_SCRATCH_WS, which
+#       fns.config_scratch clears at the start of every source
+# The scripts still run standalone (python linearize/costr_aqres.py), they build their own Context.
+import os
+import sys
+import time
+import importlib
+import traceback
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT) # this lets the project function library be found as a module
+
+from kelp_linear_extent_code import instrument # noqa: E402
+from kelp_linear_extent_code import profiling # noqa: E402
+
+COMPILE = "compile_linear_data"
+
+
+class Context:
+    """
+    What a source's run() gets from the process running it
+    * **source**: script name without .py, eg. "costr_aqres"
+    * **project_root**: folder containing the package, LinearExtent.gdb and the data folders
+    * **scratch_ws**: scratch gdb of this process (fns.config_scratch clears it, the scripts use the path it returns)
+    """
+
+    def __init__(self, source, project_root=PROJECT_ROOT, scratch_ws=None):
+        self.source = source
+        self.project_root = project_root
+        self.scratch_ws = scratch_ws
+        lines_and_containers = os.path.join(project_root, "LinearExtent.gdb", "lines_and_containers")
+        self.containers = os.path.join(lines_and_containers, "kelp_containers_v3")
+        self.cov_cat_containers = os.path.join(lines_and_containers, "cov_cat_containers")
+        self.lines = os.path.join(lines_and_containers, "all_lines_clean_v3")
+
+    def reference(self, fc):
+        """
+        Returns (GeoDataFrame, STRtree) for a reference layer, loaded once per process and shared by every source run
+        in it (see cache.load_tree)
+        """
+        from kelp_linear_extent_code import cache
+        return cache.load_tree(fc)
+
+    def shoreline(self):
+        """
+        Returns the linear referenced shoreline of the reference layers, built once per process (see linref.py)
+        """
+        from kelp_linear_extent_code import linref
+        return linref.load_shoreline(self.lines, self.containers, self.cov_cat_containers)
+
+
+def module_name(script):
+    """
+    Module of a pipeline script, eg. "costr_aqres.py" -> kelp_linear_extent_code.linearize.costr_aqres
+    """
+    name = os.path.splitext(os.path.basename(str(script)))[0]
+    if name == COMPILE:
+        return f"kelp_linear_extent_code.{name}"
+    return f"kelp_linear_extent_code.linearize.{name}"
+
+
+# process set up -----------------------------------------------------------------------------------------------------
+def init_process(scratch_ws=None, run_log=None):
+    """
+    Imports arcpy/arcgis and the function library and loads the container layers, once per process
+    * **scratch_ws**: scratch gdb for every source run in this process (default: fns.DEFAULT_SCRATCH_WS)
+    * **run_log**: instrument run log for the start up stages (see instrument.py)
+    """
+    if scratch_ws is not None:
+        os.environ["KELP_SCRATCH_WS"] = str(scratch_ws)
+    if run_log is not None:
+        os.environ["KELP_RUN_LOG"] = str(run_log)
+    instrument.skip_startup()
+    with instrument.stage("import", source="runner"):
+        # warm up imports: nothing here uses them, importing them once puts them in sys.modules so the sources run in
+        # this process don't each pay the (slow) arcpy/arcgis import
+        import arcpy # noqa: F401
+        from arcgis.features import GeoAccessor, GeoSeriesAccessor # noqa: F401
+        import kelp_linear_extent_code.fns # noqa: F401
+    with instrument.stage("load_references", source="runner"):
+        context = Context("runner")
+        for fc in [context.containers, context.cov_cat_containers]:
+            context.reference(fc)
+
+
+def _init_worker(slots, run_log):
+    # each pool worker takes a free worker number for its scratch gdb name
+    scratch_dir = os.path.join(PROJECT_ROOT, "scratch_workers")
+    init_process(os.path.join(scratch_dir, f"scratch_{slots.get()}.gdb"), run_log)
+
+
+def _reset_arcpy():
+    # sources share the process, so nothing one sets (workspace, output crs...) or leaves in memory reaches the next
+    import arcpy
+    arcpy.ResetEnvironments()
+    arcpy.env.overwriteOutput = True
+    arcpy.management.Delete("memory")
+    arcpy.management.Delete("in_memory")
+
+
+# running sources --------------------------------------------------------------------------------------------------
+def run_source(script, log_file=None, run_log=None, profile=None, **kwargs):
+    """
+    Runs one source module's run(context) in this process, returns (script, exit code, wall time in seconds)
+    Errors are printed and give exit code 1, like a failed script would
+    * **script**: pipeline script name, eg. "costr_aqres.py"
+    * **log_file**: if given, the source's output goes to this file instead of the console
+    * **run_log**: instrument run log for the source (see instrument.py)
+    * **profile**: None, "cprofile" or "pyinstrument" to profile the run (see profiling.py)
+    * other keywords are passed to run(), eg. flat_all_records for compile_linear_data
+    """
+    import kelp_linear_extent_code.fns as fns
+
+    source = os.path.splitext(os.path.basename(str(script)))[0]
+    os.environ["KELP_SOURCE"] = source
+    if run_log is not None:
+        os.environ["KELP_RUN_LOG"] = str(run_log)
+
+    t0 = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if log_file is not None:
+            log = stack.enter_context(open(log_file, "w"))
+            stack.enter_context(contextlib.redirect_stdout(log))
+            stack.enter_context(contextlib.redirect_stderr(log))
+        try:
+            module = importlib.import_module(module_name(script))
+            context = Context(source, scratch_ws=fns.DEFAULT_SCRATCH_WS)
+            if profile:
+                profiling.profile_call(lambda: module.run(context, **kwargs), source, profile)
+            else:
+                module.run(context, **kwargs)
+            returncode = 0
+        except (Exception, SystemExit):
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            instrument.end_section()
+            _reset_arcpy()
+    return script, returncode, time.perf_counter() - t0
+
+
+def run_sources(jobs, n_workers=1, run_log=None):
+    """
+    Runs sources in this process (n_workers = 1) or on a pool of worker processes, yields (script, exit code, wall time)
+    as each one finishes
+    * **jobs**: list of (script, keyword arguments for run_source)
+    * **run_log**: instrument run log for the process start up (imports, reference layers)
+    """
+    if not jobs:
+        return
+    if n_workers <= 1 or len(jobs) == 1:
+        init_process(run_log=run_log)
+        for script, kwargs in jobs:
+            yield run_source(script, **kwargs)
+        return
+
+    n_workers = min(n_workers, len(jobs))
+    slots = multiprocessing.get_context().Queue()
+    for i in range(n_workers):
+        slots.put(i)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(slots, run_log)) as pool:
+        futures = {pool.submit(run_source, script, **kwargs): script for script, kwargs in jobs}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:  # the worker process itself died
+                print(f"Error occured while running {futures[future]}: {e}")
+                yield futures[future], -1, 0.0
@@ -0,0 +1 @@
+"""Tests for the kelp linear extent function library, run with python -m pytest from the project root"""
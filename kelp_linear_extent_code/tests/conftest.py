@@ -0,0 +1,12 @@
+# shared test set up
+# every tool is instrumented (see instrument.py) and the reference layers are cached (see cache.py), so the run log and
+# the reference cache go to the test's temp folder instead of pipeline_logs/ and reference_cache/
+import pytest
+from kelp_linear_extent_code import cache
+
+
+@pytest.fixture(autouse=True)
+def run_log(tmp_path, monkeypatch):
+    monkeypatch.setenv("KELP_RUN_LOG", str(tmp_path / "run_log.jsonl"))
+    monkeypatch.setenv("KELP_SOURCE", "tests")
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "reference_cache"))
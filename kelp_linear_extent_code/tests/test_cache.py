@@ -0,0 +1,81 @@
+# per year result and derived table files: written atomically, old versions kept until prune
+import os
+import time
+import pandas as pd
+import pytest
+from kelp_linear_extent_code import cache
+
+
+def year_files():
+    return sorted(os.listdir(os.path.join(cache.CACHE_DIR, "years", "SRC")))
+
+
+def test_store_year_result_keeps_old_versions_until_prune():
+    df = pd.DataFrame({"SITE_CODE": ["A"], "presence": [1]})
+    cache.store_year_result("SRC", "presence", "kelp_2019", "a" * 40, df)
+    old = cache._year_path("SRC", "presence", "kelp_2019", "a" * 40)
+    os.utime(old, (time.time() - 10, time.time() - 10))
+    cache.store_year_result("SRC", "presence", "kelp_2019", "b" * 40, df.assign(presence=0))
+    cache.store_year_result("SRC", "presence", "kelp_2020", "c" * 40, df)
+
+    # a reader of the old key still finds it, and no temp files are left
+    assert cache.load_year_result("SRC", "presence", "kelp_2019", "a" * 40) is not None
+    assert len(year_files()) == 3
+
+    cache.prune()
+    assert year_files() == [f"presence_kelp_2019_{'b' * 16}.parquet", f"presence_kelp_2020_{'c' * 16}.parquet"]
+    assert cache.load_year_result("SRC", "presence", "kelp_2019", "b" * 40)["presence"].tolist() == [0]
+
+
+def test_keyed_write_keeps_a_file_that_is_open_elsewhere(monkeypatch):
+    df = pd.DataFrame({"x": [1]})
+    cache.store_year_result("SRC", "result", "kelp_2019", "d" * 40, df)
+
+    # os.replace on Windows, when another worker is reading the file
+    def locked(src, dst):
+        raise PermissionError(dst)
+    monkeypatch.setattr(os, "replace", locked)
+    cache.store_year_result("SRC", "result", "kelp_2019", "d" * 40, df)
+    assert year_files() == [f"result_kelp_2019_{'d' * 16}.parquet"]
+
+    # files without a key in their name still fail
+    with pytest.raises(PermissionError):
+        cache._atomic_write(os.path.join(cache.CACHE_DIR, "layer.parquet"), lambda p: df.to_parquet(p))
+    assert not [f for f in os.listdir(cache.CACHE_DIR) if f.endswith(".tmp")]
+
+
+def test_source_key_reads_the_schema_once_per_modification(tmp_path, monkeypatch):
+    import geopandas as gpd
+    import shapely
+
+    path = tmp_path / "layer.gpkg"
+    gpd.GeoDataFrame({"SITE_CODE": ["A"]}, geometry=[shapely.box(0, 0, 1, 1)], crs="EPSG:32610").to_file(path)
+    calls = []
+    schema_hash = cache.schema_hash
+    monkeypatch.setattr(cache, "schema_hash", lambda fc: calls.append(fc) or schema_hash(fc))
+
+    key = cache.source_key(str(path))
+    assert cache.source_key(str(path)) == key
+    assert len(calls) == 1
+
+    # an edit changes the modification time and the key
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert cache.source_key(str(path)) != key
+    assert len(calls) == 2
+
+
+def test_source_mtime_ignores_lock_files(tmp_path):
+    gdb = tmp_path / "LinearExtent.gdb"
+    gdb.mkdir()
+    table = gdb / "a00000009.gdbtable"
+    table.write_bytes(b"x")
+    os.utime(table, (1000, 1000))
+    fc = str(gdb / "kelp_containers_v3")
+    assert cache.source_mtime(fc) == 1000
+
+    # arcpy opening the gdb
+    lock = gdb / "a00000009.1234.5678.sr.lock"
+    lock.write_bytes(b"")
+    assert cache.source_mtime(fc) == 1000
+    lock.unlink()
+    assert cache.source_mtime(fc) == 1000
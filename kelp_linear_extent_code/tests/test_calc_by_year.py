@@ -0,0 +1,25 @@
+# calc_by_year on a small multi-year kelp layer with survey boundaries per year
+import geopandas as gpd
+import shapely
+from kelp_linear_extent_code import geo_fns
+
+CRS = "EPSG:32610"
+
+
+def test_calc_by_year_skips_years_without_survey_boundary(tmp_path):
+    boxes = [shapely.box(0, 0, 100, 20), shapely.box(100, 0, 200, 20)]
+    containers = str(tmp_path / "containers.gpkg")
+    cov_cat = str(tmp_path / "cov_cat.gpkg")
+    gpd.GeoDataFrame({"SITE_CODE": ["A", "B"]}, geometry=boxes, crs=CRS).to_file(containers)
+    gpd.GeoDataFrame({"SITE_CODE": ["A", "B"], "length_m": [100.0, 100.0]}, geometry=boxes, crs=CRS).to_file(cov_cat)
+
+    # kelp in A in 2019 and 2020, only 2019 has a survey boundary (both sites)
+    kelp = str(tmp_path / "kelp.gpkg")
+    gpd.GeoDataFrame({"Year": [2019, 2020]}, geometry=[shapely.box(10, 5, 20, 10), shapely.box(30, 5, 40, 10)],
+                     crs=CRS).to_file(kelp)
+    svy = str(tmp_path / "Ortho2019.gpkg")
+    gpd.GeoDataFrame(geometry=[shapely.box(-10, -10, 210, 30)], crs=CRS).to_file(svy)
+
+    result = geo_fns.calc_by_year(kelp, "Year", containers, cov_cat, "UAS", svy_fcs={"2019": svy})
+    assert result["year"].unique().tolist() == ["2019"]
+    assert result.set_index("SITE_CODE")["presence"].to_dict() == {"A": 1, "B": 0}
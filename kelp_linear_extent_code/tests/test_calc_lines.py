@@ -0,0 +1,59 @@
+# calc_lines (ShoreZone) year per site against the Buffer + PairwiseIntersect + groupby idxmax it replaced
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from kelp_linear_extent_code import geo_fns
+
+TOLERANCE = 10
+CRS = "EPSG:32610"
+
+
+def reference_layers(tmp_path):
+    # two 100 x 20 containers along the shore, each one cov cat segment
+    boxes = [shapely.box(0, 0, 100, 20), shapely.box(100, 0, 200, 20)]
+    containers = tmp_path / "containers.gpkg"
+    cov_cat = tmp_path / "cov_cat.gpkg"
+    gpd.GeoDataFrame({"SITE_CODE": ["A", "B"]}, geometry=boxes, crs=CRS).to_file(containers)
+    gpd.GeoDataFrame({"SITE_CODE": ["A", "B"], "length_m": [100.0, 100.0]}, geometry=boxes, crs=CRS).to_file(cov_cat)
+    return str(containers), str(cov_cat)
+
+
+def kelp_lines():
+    # A: 2010 is a short line inside the container, 2012 a long one just offshore of it (no length inside, but its
+    # buffer covers more of the container). B: 2015 inside, 2012 only reaches it with the end of its buffer
+    return gpd.GeoDataFrame({
+        "year": [2010, 2012, 2015],
+        "presence": [1, 1, 0],
+    }, geometry=[
+        shapely.LineString([(0, 10), (15, 10)]),
+        shapely.LineString([(40, -2), (100, -2)]),
+        shapely.LineString([(150, 10), (170, 10)]),
+    ], crs=CRS)
+
+
+def old_site_year(lines, containers):
+    """
+    The year step of the old shorezone.py: buffer by 10 m, intersect with the containers, most area per site
+    """
+    buff = gpd.GeoDataFrame({"year": lines["year"]}, geometry=lines.buffer(TOLERANCE), crs=CRS)
+    inter = gpd.overlay(buff, gpd.read_file(containers), how="intersection")
+    inter["area"] = inter.area
+    site_year = inter.groupby(["SITE_CODE", "year"]).agg(year_area=("area", "sum")).reset_index()
+    return site_year.loc[site_year.groupby("SITE_CODE")["year_area"].idxmax(), ["SITE_CODE", "year"]]
+
+
+def test_calc_lines_year_matches_buffered_area(tmp_path):
+    containers, cov_cat = reference_layers(tmp_path)
+    lines = kelp_lines()
+    result = geo_fns.calc_lines(lines, "year", "presence", containers, cov_cat, "SZ", tolerance=TOLERANCE)
+
+    # by line length inside the container A would be 2010
+    assert shapely.length(shapely.intersection(lines.geometry.values[1], shapely.box(0, 0, 100, 20))) == 0
+    expected = old_site_year(lines, containers).set_index("SITE_CODE")["year"]
+    assert expected.to_dict() == {"A": 2012, "B": 2015}
+    got = result.set_index("SITE_CODE")["year"]
+    pd.testing.assert_series_equal(got.sort_index(), expected.sort_index(), check_dtype=False)
+
+    # presence/cov cat from the kelp lines within 10 m: the 2015 line is an absence line
+    np.testing.assert_array_equal(result.set_index("SITE_CODE").loc[["A", "B"], "presence"], [1, 1])
@@ -0,0 +1,111 @@
+# result_io.combine_results against the groupby version it replaced (compile_linear_data.py before the parquet results)
+# The old version read the result csvs, so it gets the same synthetic tables as csvs and the new one gets them as parquet.
+# KELP_TEST_ROWS sets the table size (default 200,000 rows, set it to a few million for a full size run)
+import os
+import pandas as pd
+import pytest
+from kelp_linear_extent_code import result_io
+from kelp_linear_extent_code.benchmarks import synthetic
+
+N_ROWS = int(os.environ.get("KELP_TEST_ROWS", 200_000))
+SOURCES = ["WADNR_COSTR_AQRES", "WADNR_ShoreZone", "WADNR_Kayak", "MRC_Kayak", "NOT_IN_SOURCE_URLS"]
+
+
+def old_combine_results(synth_dfs, OUT_PATH):
+    """
+    combine_results as it was before the vectorized version, with two changes that do not change the output:
+    the coverage_cat apply runs once per distinct (presence, coverage_cat) pair instead of once per row, and the
+    in place fillna on a slice is an assignment (copy on write in newer pandas ignores the in place version)
+    """
+    all_synth = pd.concat(synth_dfs)
+
+    def reconcile(row):
+        return (0
+                if row["presence"] == 0 and (pd.isna(row["coverage_cat"]) or row["coverage_cat"] > 0)
+                else 1
+                if row["presence"] == 1 and (row["coverage_cat"] == 0)
+                else row["coverage_cat"])
+
+    pairs = all_synth[["presence", "coverage_cat"]].drop_duplicates()
+    pairs["new_cov"] = pairs.apply(reconcile, axis=1)
+    all_synth["coverage_cat"] = pd.merge(all_synth[["presence", "coverage_cat"]], pairs, how="left",
+                                         on=["presence", "coverage_cat"])["new_cov"].to_numpy()
+
+    all_synth = all_synth.drop(["Unnamed: 0"], axis=1)
+    all_synth = all_synth.dropna(subset=["source"], axis=0)
+    all_synth.rename(columns={"coverage_cat": "coverage_category"}, inplace=True)
+    source_url = pd.read_csv(os.path.join(result_io.PROJECT_ROOT, "kelp_reference", "source_urls.csv"))
+    all_synth = all_synth.merge(source_url[["source", "source_url"]], on="source", how="left")
+    all_synth.to_csv(os.path.join(OUT_PATH, "all_records.csv"))
+
+    most_recent_year = all_synth.groupby("SITE_CODE")["year"].transform("max")
+    most_recent = all_synth[all_synth["year"] == most_recent_year].copy()
+    most_recent.loc[:, "n_records_most_rec"] = most_recent.groupby("SITE_CODE")["SITE_CODE"].transform("count")
+    most_recent["coverage_category"] = most_recent["coverage_category"].fillna(-9999)
+    most_rec_max = most_recent[
+        most_recent["coverage_category"]
+        == most_recent.groupby("SITE_CODE")["coverage_category"].transform("max")
+    ]
+    most_rec_max = most_rec_max.set_index("SITE_CODE")
+    most_rec_max.to_csv(os.path.join(OUT_PATH, "most_recent.csv"))
+
+
+# intended dtype changes of the new version, per output: column -> dtype of the new output as read back from the csv
+# most_recent: the NULL coverage fill (-9999) is done on int16 instead of float, so the csv has 1 instead of 1.0
+DTYPE_CHANGES = {
+    "all_records.csv": {},
+    "most_recent.csv": {"coverage_category": "int64"},
+}
+
+
+def read_outputs(old_dir, new_dir, name):
+    """
+    Old and new output csv as written, with only the DTYPE_CHANGES applied to the old one
+    """
+    old = pd.read_csv(old_dir / name, low_memory=False)
+    new = pd.read_csv(new_dir / name, low_memory=False)
+    for col, dtype in DTYPE_CHANGES[name].items():
+        assert (old[col] % 1 == 0).all(), f"{name} {col} has values that are not whole numbers"
+        old[col] = old[col].astype(dtype)
+    return old, new
+
+
+@pytest.fixture(scope="module")
+def outputs(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("combine")
+    tables = synthetic.result_tables(N_ROWS, max(N_ROWS // 20, 10), SOURCES)
+
+    # old: csvs written by the linearize scripts (with the index), read back by csv_to_pd
+    csvs = []
+    for source, df in tables.items():
+        path = tmp / f"{source}_result.csv"
+        df.to_csv(path)
+        csvs.append(path)
+    old_dir = tmp / "old"
+    old_dir.mkdir()
+    old_combine_results([pd.read_csv(p) for p in csvs], str(old_dir))
+
+    # new: parquet results through read_results
+    result_dir = result_io.RESULT_DIR
+    result_io.RESULT_DIR = str(tmp / "results")
+    try:
+        paths = [result_io.write_results(df, source) for source, df in tables.items()]
+    finally:
+        result_io.RESULT_DIR = result_dir
+    new_dir = tmp / "new"
+    new_dir.mkdir()
+    result_io.combine_results(result_io.read_results(paths), str(new_dir))
+    return old_dir, new_dir
+
+
+def test_all_records_match(outputs):
+    old, new = read_outputs(*outputs, "all_records.csv")
+    assert len(old) == N_ROWS // len(SOURCES) * len(SOURCES)
+    pd.testing.assert_frame_equal(old, new)
+
+
+def test_most_recent_match(outputs):
+    old, new = read_outputs(*outputs, "most_recent.csv")
+    assert old["SITE_CODE"].nunique() > 0
+    assert (old["coverage_category"] == -9999).any()  # sites with only presence-only records in their last year
+    pd.testing.assert_frame_equal(old, new)
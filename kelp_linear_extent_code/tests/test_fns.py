@@ -0,0 +1,25 @@
+# in-memory attribute join (the AddJoin + CalculateField replacement)
+import json
+import numpy as np
+import pandas as pd
+from kelp_linear_extent_code import fns
+
+
+def join_records(path):
+    with open(path) as f:
+        return [r for r in map(json.loads, f) if r["stage"] == "join_field"]
+
+
+def test_join_field_first_match_wins_and_nan_for_missing(tmp_path):
+    table = pd.DataFrame({"UNIT_ID": [1, 2, 2, 3], "VIDEO_DATE": [2001, 2002, 2099, 2003]})
+    out = fns.join_field(pd.Series([3, 2, 4, 1]), table, "UNIT_ID", "VIDEO_DATE")
+    np.testing.assert_array_equal(out, [2003, 2002, np.nan, 2001])
+
+    [record] = join_records(tmp_path / "run_log.jsonl")
+    assert (record["n_in"], record["n_matched"]) == (4, 3)
+
+
+def test_join_field_empty_table():
+    table = pd.DataFrame({"UNIT_ID": pd.Series([], dtype=int), "VIDEO_DATE": pd.Series([], dtype=float)})
+    out = fns.join_field(pd.Series([1, 2]), table, "UNIT_ID", "VIDEO_DATE")
+    assert len(out) == 2 and np.isnan(out).all()
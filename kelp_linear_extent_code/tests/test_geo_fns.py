@@ -0,0 +1,192 @@
+# geo_fns engines on small hand made layers, expected results worked out by hand
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from kelp_linear_extent_code import geo_fns
+
+
+def box(x0, x1, y0=0.0, y1=10.0):
+    return shapely.box(x0, y0, x1, y1)
+
+
+# two 10 x 10 cov cat segments side by side
+SEGMENTS = np.array([box(0, 10), box(10, 20)], dtype=object)
+SEG_SIZE = (shapely.area(SEGMENTS), np.array([10.0, 10.0]))
+
+
+# cover_fractions ------------------------------------------------------------------------------------------
+def test_cover_fractions_counts_overlapping_kelp_once():
+    # two identical polygons covering 60% of segment 0 in the same year
+    kelp = np.array([box(0, 6), box(0, 6)], dtype=object)
+    hits, frac = geo_fns.cover_fractions(shapely.STRtree(SEGMENTS), SEG_SIZE, kelp, np.array([0, 0]), 1)
+    np.testing.assert_array_equal(hits, [[True, False]])
+    np.testing.assert_allclose(frac, [[0.6, 0.0]])
+
+
+def test_cover_fractions_partial_overlap_and_groups():
+    # year 0: 0-4 and 2-6 overlap on 2-4, covered share of segment 0 is 0.6; 8-12 covers 20% of each segment
+    # year 1: the same bed again, covered separately
+    kelp = np.array([box(0, 4), box(2, 6), box(8, 12), box(0, 6)], dtype=object)
+    hits, frac = geo_fns.cover_fractions(shapely.STRtree(SEGMENTS), SEG_SIZE, kelp, np.array([0, 0, 0, 1]), 2)
+    np.testing.assert_array_equal(hits, [[True, True], [True, False]])
+    np.testing.assert_allclose(frac, [[0.8, 0.2], [0.6, 0.0]])
+
+
+def test_cover_fractions_lines():
+    # line kelp is measured against length_m, overlapping lines once
+    kelp = np.array([shapely.LineString([(0, 5), (5, 5)]), shapely.LineString([(3, 5), (15, 5)])], dtype=object)
+    _, frac = geo_fns.cover_fractions(shapely.STRtree(SEGMENTS), SEG_SIZE, kelp, np.array([0, 0]), 1)
+    np.testing.assert_allclose(frac, [[1.0, 0.5]])
+
+
+# rollup_hits ----------------------------------------------------------------------------------------------
+def test_rollup_hits_queries_clipped_containers():
+    # site A has the two segments, site B one segment further along
+    seg_geoms = np.array([box(0, 10), box(10, 20), box(20, 30)], dtype=object)
+    weights = pd.DataFrame({"SITE_CODE": ["A", "A", "B"], "site_idx": [0, 0, 1], "weight": [0.5, 0.5, 1.0]})
+    # kelp on the second segment of A only
+    kelp = np.array([box(12, 14)], dtype=object)
+    seg_hits = geo_fns.hit_matrix(shapely.STRtree(seg_geoms), kelp, np.array([0]), 1)
+
+    # unclipped containers: rolled up from the segments
+    cont = gpd.GeoDataFrame({"SITE_CODE": ["A", "B"]}, geometry=[box(0, 20), box(20, 30)])
+    hits = geo_fns.rollup_hits(seg_hits, weights, shapely.area(seg_geoms), cont, kelp, np.array([0]))
+    np.testing.assert_array_equal(hits, [[True, False]])
+
+    # A clipped to its first segment: the kelp is outside the clipped container
+    cont = gpd.GeoDataFrame({"SITE_CODE": ["A", "B"]}, geometry=[box(0, 10), box(20, 30)])
+    hits = geo_fns.rollup_hits(seg_hits, weights, shapely.area(seg_geoms), cont, kelp, np.array([0]))
+    np.testing.assert_array_equal(hits, [[False, False]])
+
+
+# year_by_overlap ------------------------------------------------------------------------------------------
+def containers_gdf(geoms, codes):
+    return gpd.GeoDataFrame({"SITE_CODE": codes}, geometry=geoms)
+
+
+def test_argmax_by_site_ties_go_to_lowest_group():
+    # site 0: groups 0 and 1 both total 2, site 1: group 1 totals 1.1 against 1.0
+    site = np.array([0, 0, 1, 1, 1])
+    group = np.array([1, 0, 0, 1, 1])
+    weight = np.array([2.0, 2.0, 1.0, 0.5, 0.6])
+    best_site, best_group = geo_fns.argmax_by_site(site, group, weight)
+    np.testing.assert_array_equal(best_site, [0, 1])
+    np.testing.assert_array_equal(best_group, [0, 1])
+
+
+def test_year_by_overlap_tie_goes_to_earliest_year():
+    cont = containers_gdf([box(0, 100, 0, 20)], ["A"])
+    tree = shapely.STRtree(cont.geometry.values)
+    # 200 m2 each, the later year first in the layer
+    kelp = np.array([box(0, 10), box(50, 60)], dtype=object)
+    df = geo_fns.year_by_overlap(cont, tree, kelp, np.array([2011.0, 2009.0]))
+    assert df.to_dict("records") == [{"SITE_CODE": "A", "year": 2009.0}]
+
+
+def test_year_by_overlap_within_tolerance():
+    cont = containers_gdf([box(0, 100, 0, 20)], ["A"])
+    tree = shapely.STRtree(cont.geometry.values)
+    # 2010: 60 m offshore line 4 m outside the container, 2012: 5 m line inside it
+    kelp = np.array([shapely.LineString([(20, -4), (80, -4)]), shapely.LineString([(0, 10), (5, 10)])], dtype=object)
+    year = np.array([2010, 2012])
+
+    # no tolerance: only the line inside counts
+    assert geo_fns.year_by_overlap(cont, tree, kelp, year)["year"].tolist() == [2012]
+
+    # 10 m buffers: 2010 covers a 60 x 6 strip plus two circular segments (r 10, chord 4 m from the centre) split in
+    # half, 360 + 100 acos(0.4) - 4 sqrt(84); 2012 a 5 x 20 strip plus a half disc, 100 + 50 pi. The buffer arcs are
+    # polygons (8 segments per quarter circle), so the areas are a little smaller
+    _, _, overlap = geo_fns.overlap_pairs(tree, np.asarray(cont.geometry.values), kelp, distance=10)
+    expected = [360 + 100 * np.arccos(0.4) - 4 * np.sqrt(84), 100 + 50 * np.pi]
+    np.testing.assert_allclose(overlap, expected, rtol=1e-2)
+    assert geo_fns.year_by_overlap(cont, tree, kelp, year, distance=10)["year"].tolist() == [2010]
+
+
+def test_year_by_overlap_touching_only_does_not_count():
+    cont = containers_gdf([box(0, 100, 0, 20)], ["A"])
+    tree = shapely.STRtree(cont.geometry.values)
+    kelp = np.array([box(0, 10, -10, 0)], dtype=object)
+    assert len(geo_fns.year_by_overlap(cont, tree, kelp, np.array([2010]))) == 0
+
+
+# hit_matrix -----------------------------------------------------------------------------------------------
+def test_hit_matrix():
+    tree = shapely.STRtree(np.array([box(0, 10), box(10, 20), box(30, 40)], dtype=object))
+    kelp = np.array([
+        box(2, 4),                                # group 0: segment 0
+        box(8, 12),                               # group 0: segments 0 and 1
+        box(24, 26),                              # group 1: in the gap, 4 m from segments 1 and 2
+        shapely.Point(35, 5),                     # group 2: segment 2
+    ], dtype=object)
+    owner = np.array([0, 0, 1, 2])
+    np.testing.assert_array_equal(geo_fns.hit_matrix(tree, kelp, owner, 4), [
+        [True, True, False],
+        [False, False, False],
+        [False, False, True],
+        [False, False, False],  # no kelp in group 3
+    ])
+    # within 5 m the gap kelp reaches both neighbours
+    np.testing.assert_array_equal(geo_fns.hit_matrix(tree, kelp, owner, 4, distance=5)[1], [False, True, True])
+    assert geo_fns.hit_matrix(tree, np.empty(0, dtype=object), np.empty(0, dtype=int), 2).shape == (2, 3)
+
+
+# cov_cat_from_hits ----------------------------------------------------------------------------------------
+def old_cov_cat(hits, cov_cat):
+    """
+    Coverage category as the arcpy calc_cov_cat computed it from the SpatialJoin table: weighted presence summed per
+    site and binned with pd.cut
+    """
+    rows = []
+    for g in range(hits.shape[0]):
+        df = cov_cat.assign(presence=hits[g].astype(int))
+        df["total_length"] = df.groupby("SITE_CODE")["length_m"].transform("sum")
+        df["w_pres"] = df["length_m"] / df["total_length"] * df["presence"]
+        result = df.groupby("SITE_CODE").agg(sum_w_pres=("w_pres", "sum")).reset_index()
+        rows.append(pd.cut(result["sum_w_pres"], bins=[-float("inf"), 0, 0.25, 0.5, 0.75, float("inf")],
+                           labels=[0, 1, 2, 3, 4]).astype(int).to_numpy())
+    return np.array(rows)
+
+
+def test_cov_cat_from_hits_bin_edges():
+    # one site of 4 equal segments: 0-4 hit segments give weighted presence 0, 0.25, 0.5, 0.75 and 1, on the bin edges
+    cov_cat = pd.DataFrame({"SITE_CODE": ["A"] * 4, "length_m": [10.0] * 4})
+    weights = geo_fns.cov_cat_weights(cov_cat)
+    hits = np.tril(np.ones((5, 4), dtype=bool), k=-1)
+    np.testing.assert_array_equal(geo_fns.cov_cat_from_hits(hits, weights), [[0], [1], [2], [3], [4]])
+    np.testing.assert_array_equal(geo_fns.cov_cat_from_hits(hits, weights), old_cov_cat(hits, cov_cat))
+
+
+def test_cov_cat_from_hits_matches_pd_cut():
+    # sites of 1-5 segments with lengths of 1, 2 or 4 m
+    rng = np.random.default_rng(0)
+    sites = np.repeat(["A", "B", "C", "D"], [3, 4, 1, 5])
+    lengths = rng.choice([1.0, 2.0, 4.0], len(sites))
+    cov_cat = pd.DataFrame({"SITE_CODE": sites, "length_m": lengths})
+    hits = rng.random((50, len(sites))) < 0.5
+    np.testing.assert_array_equal(geo_fns.cov_cat_from_hits(hits, geo_fns.cov_cat_weights(cov_cat)),
+                                  old_cov_cat(hits, cov_cat))
+
+
+# survey masks ---------------------------------------------------------------------------------------------
+def test_survey_mask():
+    cont = np.array([box(0, 10), box(10, 20), box(20, 30), box(40, 50)], dtype=object)
+    # survey covers container 0, half of container 1, and touches container 3 along an edge only
+    svy = shapely.union(box(0, 15), box(30, 40))
+    keep, partial, partial_tree = geo_fns.survey_mask(cont, svy)
+    np.testing.assert_array_equal(keep, [True, True, False, False])
+    np.testing.assert_array_equal(partial, [False, True, False, False])
+    assert len(partial_tree.geometries) == 1
+    assert shapely.equals(partial_tree.geometries[0], box(10, 15))
+
+
+def test_survey_masks_shared_boundaries():
+    cont = np.array([box(0, 10), box(10, 20)], dtype=object)
+    svy_a = box(0, 15)
+    svy_a_copy = box(0, 15)  # same geometry read from another fc
+    svy_b = box(0, 10)
+    masks = geo_fns.survey_masks(cont, [svy_a, svy_b, svy_a, svy_a_copy])
+    assert masks[0] is masks[2] is masks[3]
+    np.testing.assert_array_equal(masks[0][1], [False, True])
+    np.testing.assert_array_equal(masks[1][0], [True, False])
+    assert masks[1][2] is None
@@ -0,0 +1,57 @@
+# linref interval sweeps on hand made intervals, and the segment hits on a small straight shoreline
+from types import SimpleNamespace
+import geopandas as gpd
+import numpy as np
+import shapely
+from kelp_linear_extent_code import geo_fns
+from kelp_linear_extent_code import linref
+
+CRS = "EPSG:32610"
+
+
+def test_merge_intervals():
+    # unsorted, [0, 2] and [1, 3] overlap, [3, 4] touches them, [6, 7] contains [6.5, 6.6], [9, 10] is alone
+    start = np.array([6.0, 1.0, 9.0, 0.0, 3.0, 6.5])
+    end = np.array([7.0, 3.0, 10.0, 2.0, 4.0, 6.6])
+    m_start, m_end = linref.merge_intervals(start, end)
+    np.testing.assert_array_equal(m_start, [0.0, 6.0, 9.0])
+    np.testing.assert_array_equal(m_end, [4.0, 7.0, 10.0])
+
+
+def test_interval_hits():
+    # segments [0, 10], [10, 20], [25, 30] and one with no line (NaN), on a 31 m axis
+    shoreline = SimpleNamespace(seg_start=np.array([0.0, 10.0, 25.0, np.nan]),
+                                seg_end=np.array([10.0, 20.0, 30.0, np.nan]),
+                                axis_length=31.0)
+    group = np.array([0, 0, 1, 1])
+    start = np.array([2.0, 21.0, 20.0, 29.0])
+    end = np.array([3.0, 24.0, 22.0, 31.0])
+    hits = linref.interval_hits(shoreline, group, start, end, 3)
+    np.testing.assert_array_equal(hits, [
+        [True, False, False, False],   # [21, 24] falls in the gap between segments 1 and 2
+        [False, True, True, False],    # [20, 22] touches the end of segment 1, [29, 31] overlaps the end of segment 2
+        [False, False, False, False],  # no intervals
+    ])
+    assert not linref.interval_hits(shoreline, group[:0], start[:0], end[:0], 2).any()
+
+
+def test_segment_hits_match_hit_matrix(tmp_path):
+    # one straight 100 m site line, its container and two 50 m cov cat segments
+    lines = str(tmp_path / "lines.gpkg")
+    containers = str(tmp_path / "containers.gpkg")
+    cov_cat = str(tmp_path / "cov_cat.gpkg")
+    gpd.GeoDataFrame({"SITE_CODE": ["A"]}, geometry=[shapely.LineString([(0, 0), (100, 0)])], crs=CRS).to_file(lines)
+    gpd.GeoDataFrame({"SITE_CODE": ["A"]}, geometry=[shapely.box(0, -10, 100, 10)], crs=CRS).to_file(containers)
+    segs = [shapely.box(0, -10, 50, 10), shapely.box(50, -10, 100, 10)]
+    gpd.GeoDataFrame({"SITE_CODE": ["A", "A"], "length_m": [50.0, 50.0]}, geometry=segs, crs=CRS).to_file(cov_cat)
+
+    shoreline = linref.load_shoreline(lines, containers, cov_cat)
+    np.testing.assert_allclose(shoreline.seg_start, [0, 50])
+    np.testing.assert_allclose(shoreline.seg_end, [50, 100])
+
+    # year 0: kelp on the second segment, year 1: across the segment boundary, year 2: outside the container
+    kelp = np.array([shapely.box(60, 0, 70, 5), shapely.box(45, -5, 55, 5), shapely.box(20, 20, 30, 30)], dtype=object)
+    owner = np.array([0, 1, 2])
+    hits = linref.segment_hits(shoreline, kelp, owner, 3)
+    np.testing.assert_array_equal(hits, [[False, True], [True, True], [False, False]])
+    np.testing.assert_array_equal(hits, geo_fns.hit_matrix(shapely.STRtree(np.array(segs, dtype=object)), kelp, owner, 3))
@@ -0,0 +1,24 @@
+# pipeline worker pool smoke test: sources run on 2 workers, each with its own scratch_workers/scratch_<n>.gdb
+# (see runner.py), so scripts that build paths in the scratch gdb see the worker paths and not scratch.gdb.
+# Needs ArcGIS and the project data (LinearExtent.gdb, kelp_data_sources), skipped without them. The sources write
+# their result tables to kelp_data_linear_outputs like a pipeline run does
+import os
+import pytest
+from kelp_linear_extent_code import runner
+
+# samish_sji writes its kelp fcs to the scratch gdb and reads the years back from their paths, the second source is
+# there so the jobs go to the pool (a single job runs in this process)
+POOL_SOURCES = ["samish_sji.py", "psrf_elliottbay.py"]
+
+
+def test_sources_run_on_worker_pool(tmp_path):
+    pytest.importorskip("arcpy")
+    data = [os.path.join(runner.PROJECT_ROOT, "LinearExtent.gdb"), os.path.join(runner.PROJECT_ROOT, "kelp_data_sources")]
+    if not all(os.path.exists(p) for p in data):
+        pytest.skip("project data not available")
+
+    jobs = [(script, {"run_log": str(tmp_path / f"{script}.jsonl"), "log_file": str(tmp_path / f"{script}.log")})
+            for script in POOL_SOURCES]
+    results = {script: code for script, code, _ in runner.run_sources(jobs, 2, str(tmp_path / "runner.jsonl"))}
+    logs = {script: open(tmp_path / f"{script}.log").read() for script in POOL_SOURCES}
+    assert results == {script: 0 for script in POOL_SOURCES}, logs
@@ -0,0 +1,81 @@
+# raster_fns tiling and per tile counts on hand made grids, and the pixel counts on a small GeoTIFF (needs GDAL)
+import numpy as np
+import pytest
+import shapely
+from kelp_linear_extent_code import raster_fns
+
+# 100 x 100 pixel grid of 1 m pixels, top left corner at (0, 100)
+GT = (0.0, 1.0, 0.0, 100.0, 0.0, -1.0)
+
+
+def test_tile_windows_partial_and_outside():
+    geoms = np.array([
+        shapely.box(10, 80, 20, 90),     # inside, tile (0, 0) with tile size 50
+        shapely.box(60, 10, 70, 20),     # inside, tile (1, 1)
+        shapely.box(-30, 60, 10, 70),    # centre outside, the part inside (0-10) is in tile (0, 0)
+        shapely.box(200, 0, 210, 10),    # outside
+        shapely.Polygon(),               # empty, counted as outside
+    ], dtype=object)
+    windows, n_partial, n_outside = raster_fns.tile_windows(shapely.bounds(geoms), GT, 100, 100, tile_size=50)
+    assert (n_partial, n_outside) == (1, 2)
+
+    by_members = {tuple(m): w for m, w in windows}
+    # rows 10-20 (y 90-80) and 30-40 (y 70-60), cols 0-20: the partial feature's window is clipped to the raster
+    assert by_members == {(0, 2): (10, 0, 30, 20), (1,): (80, 60, 10, 10)}
+
+
+def test_add_tile_counts():
+    # 3 x 4 tile with features 5 and 2 of the layer as labels 1 and 2, and a nodata pixel in each
+    labels = np.array([
+        [1, 1, 0, 2],
+        [1, 1, 0, 2],
+        [0, 0, 0, 2],
+    ], dtype=np.int32)
+    data = np.array([
+        [1, 0, 1, 1],
+        [1, 9, 1, 0],
+        [1, 1, 1, 9],
+    ])
+    ok = data != 9
+    kelp = ok & (data == 1)
+
+    valid_n = np.zeros((2, 6), dtype=np.int64)
+    kelp_n = np.zeros((2, 6), dtype=np.int64)
+    feats = np.array([5, 2])
+    raster_fns.add_tile_counts(valid_n, kelp_n, 1, feats, labels, ok, kelp)
+    # a second tile of the same raster adds to the counts
+    raster_fns.add_tile_counts(valid_n, kelp_n, 1, feats[:1], np.ones((1, 2), dtype=np.int32),
+                               np.ones((1, 2), dtype=bool), np.array([[True, False]]))
+
+    np.testing.assert_array_equal(valid_n, [[0] * 6, [0, 0, 2, 0, 0, 5]])
+    np.testing.assert_array_equal(kelp_n, [[0] * 6, [0, 0, 1, 0, 0, 3]])
+
+
+def test_count_pixels_partial_overlap(tmp_path):
+    gdal = pytest.importorskip("osgeo.gdal")
+    gpd = pytest.importorskip("geopandas")
+    osr = pytest.importorskip("osgeo.osr")
+
+    # 10 x 10 raster, left half kelp (1), right half water (0), bottom row nodata (255)
+    data = np.zeros((10, 10), dtype=np.uint8)
+    data[:, :5] = 1
+    data[9, :] = 255
+    path = str(tmp_path / "kelp_2024.tif")
+    ds = gdal.GetDriverByName("GTiff").Create(path, 10, 10, 1, gdal.GDT_Byte)
+    ds.SetGeoTransform((0.0, 1.0, 0.0, 10.0, 0.0, -1.0))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32610)
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).WriteArray(data)
+    ds.GetRasterBand(1).SetNoDataValue(255)
+    ds = None
+
+    layer = gpd.GeoSeries([
+        shapely.box(0, 5, 4, 9),    # 16 kelp pixels
+        shapely.box(6, 5, 16, 9),   # partly outside: 4 x 4 water pixels inside the raster
+        shapely.box(0, 0, 2, 2),    # 2 kelp pixels, the bottom row is nodata
+        shapely.box(20, 0, 30, 5),  # outside
+    ], crs="EPSG:32610")
+    [(valid, kelp)] = raster_fns.count_pixels([path], [layer])
+    np.testing.assert_array_equal(valid, [[16, 16, 2, 0]])
+    np.testing.assert_array_equal(kelp, [[16, 0, 2, 0]])